@@ -2,7 +2,22 @@ from typing import TextIO
 
 import click
 
-from src.tasks import main_task
+# the light modules only: the options are parsed (and --help is answered)
+# before the fetching and the aggregation machinery is imported
+from src.ranking import CityRanker, TIE_BREAKS
+from src.utils import (
+    AGGREGATION_ENGINES,
+    CACHE_DIR,
+    CITIES,
+    DAEMON_REFRESH,
+    FETCH_CONCURRENCY,
+    FETCH_MODES,
+    FETCH_RETRIES,
+    INLINE_MAX_CITIES,
+    MEMO_MAX_ENTRIES,
+    MEMO_TTL,
+    OUTPUT_FORMATS,
+)
 
 
 @click.command()
@@ -19,8 +34,384 @@ from src.tasks import main_task
     type=click.File(mode="w"),
     help="the output file or stream (specify '-' for the stdout)",
 )
-def main(cities: tuple[str], fout: TextIO):
-    main_task(city_names=cities, file_object=fout)
+@click.option(
+    "-f",
+    "--format",
+    "output_format",
+    default="json",
+    type=click.Choice(OUTPUT_FORMATS),
+    show_default=True,
+    help="the output format: JSON, compact JSON, the CSV/TSV table or columnar",
+)
+@click.option(
+    "-m",
+    "--mode",
+    default="threads",
+    type=click.Choice(FETCH_MODES),
+    show_default=True,
+    help="fetch the forecasts with a thread pool or with asyncio",
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    default=FETCH_CONCURRENCY,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="the number of requests in flight (the async mode)",
+)
+@click.option(
+    "--threads",
+    default=None,
+    type=click.IntRange(min=1),
+    help="the fetch threads (the threads mode)  [default: adaptive]",
+)
+@click.option(
+    "--processes",
+    default=None,
+    type=click.IntRange(min=0),
+    help="the aggregation processes, 0 aggregates inline  [default: adaptive]",
+)
+@click.option(
+    "--inline-max",
+    default=INLINE_MAX_CITIES,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help="aggregate this many cities or fewer inline, without the process pool",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    default=False,
+    help="write the results as NDJSON while the cities are being processed",
+)
+@click.option(
+    "--cache-dir",
+    default=CACHE_DIR,
+    type=click.Path(file_okay=False, writable=True),
+    show_default=True,
+    help="the directory of the HTTP response cache",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="download every forecast without consulting the cache",
+)
+@click.option(
+    "-e",
+    "--engine",
+    default="pydantic",
+    type=click.Choice(AGGREGATION_ENGINES),
+    show_default=True,
+    help="aggregate with the pydantic models, the columnar kernel or slotted records",
+)
+@click.option(
+    "--chunk-size",
+    default=None,
+    type=click.IntRange(min=1),
+    help="the cities per process pool call  [default: auto]",
+)
+@click.option(
+    "--raw",
+    is_flag=True,
+    default=False,
+    help="pass the undecoded responses to the workers to parse them there",
+)
+@click.option(
+    "--streaming",
+    is_flag=True,
+    default=False,
+    help="decode the bodies while they download, keeping the analysed fields",
+)
+@click.option(
+    "--registry",
+    "registry_path",
+    default=None,
+    type=click.Path(exists=True),
+    help="a JSON/CSV file (or a directory of them) mapping the cities to URLs",
+)
+@click.option(
+    "--store",
+    "store_path",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="an SQLite file of the stats to recompute only the changed days",
+)
+@click.option(
+    "--history",
+    "history_dir",
+    default=None,
+    type=click.Path(file_okay=False, writable=True),
+    help="append the analysed days to the columnar history in the directory",
+)
+@click.option(
+    "--profiles",
+    "profiles_path",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="a JSON list of analysis profiles to evaluate along with the default",
+)
+@click.option(
+    "--memo-ttl",
+    default=MEMO_TTL,
+    type=click.FloatRange(min=0),
+    show_default=True,
+    help="keep the fetched forecasts in memory this many seconds (0 for none)",
+)
+@click.option(
+    "--memo-size",
+    default=MEMO_MAX_ENTRIES,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="the fetched forecasts kept in memory at most",
+)
+@click.option(
+    "--metrics-file",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="export the stage metrics: *.json for a summary, else Prometheus text",
+)
+@click.option(
+    "--profile",
+    "profile_dir",
+    default=None,
+    type=click.Path(file_okay=False, writable=True),
+    help="dump the cProfile stats of every stage into the directory",
+)
+@click.option(
+    "--retries",
+    default=FETCH_RETRIES,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help="retry a failed request with a jittered exponential backoff",
+)
+@click.option(
+    "--hedge",
+    is_flag=True,
+    default=False,
+    help="duplicate a request slower than the p95 of the observed latencies",
+)
+@click.option(
+    "--breaker",
+    "breaker_threshold",
+    default=None,
+    type=click.IntRange(min=1),
+    help="skip a host for a while after this many consecutive failures",
+)
+@click.option(
+    "--deadline",
+    default=None,
+    type=click.FloatRange(min=0, min_open=True),
+    help="the seconds the run may take, the late cities are reported missing",
+)
+@click.option(
+    "--top",
+    "top_k",
+    default=None,
+    type=click.IntRange(min=1),
+    help="keep and report the top K ranks only",
+)
+@click.option(
+    "--weights",
+    default=None,
+    type=(float, float),
+    metavar="TEMP HOURS",
+    help="score a city by the weighted temperature and suitable hours totals",
+)
+@click.option(
+    "--tie-break",
+    default="ties",
+    type=click.Choice(TIE_BREAKS),
+    show_default=True,
+    help="rank equal scores together or prefer the first name or arrival",
+)
+@click.option(
+    "--workers",
+    default=0,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help="shard the cities over this many local worker processes",
+)
+@click.option(
+    "--remote-workers",
+    default=0,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help="wait for this many workers started with `python -m src.cluster`",
+)
+@click.option(
+    "--listen",
+    default="127.0.0.1:0",
+    show_default=True,
+    help="the HOST:PORT the coordinator accepts the workers at",
+)
+@click.option(
+    "--serve",
+    "serve_address",
+    default=None,
+    metavar="HOST:PORT|unix:PATH",
+    help="stay resident and answer the queries over HTTP at the address",
+)
+@click.option(
+    "--refresh",
+    default=DAEMON_REFRESH,
+    type=click.FloatRange(min=0, min_open=True),
+    show_default=True,
+    help="the seconds between the background refreshes of the served cities",
+)
+def main(
+    cities: tuple[str],
+    fout: TextIO,
+    output_format: str,
+    mode: str,
+    concurrency: int,
+    threads: None | int,
+    processes: None | int,
+    inline_max: int,
+    stream: bool,
+    cache_dir: str,
+    no_cache: bool,
+    engine: str,
+    chunk_size: None | int,
+    raw: bool,
+    streaming: bool,
+    registry_path: None | str,
+    store_path: None | str,
+    history_dir: None | str,
+    profiles_path: None | str,
+    memo_ttl: float,
+    memo_size: int,
+    metrics_file: None | str,
+    profile_dir: None | str,
+    retries: int,
+    hedge: bool,
+    breaker_threshold: None | int,
+    deadline: None | float,
+    top_k: None | int,
+    weights: None | tuple[float, float],
+    tie_break: str,
+    workers: int,
+    remote_workers: int,
+    listen: str,
+    serve_address: None | str,
+    refresh: float,
+):
+    if stream and output_format != "json":
+        raise click.UsageError("--stream writes JSON lines only")
+    if store_path and stream:
+        raise click.UsageError("--store cannot be used with --stream")
+    if raw and streaming:
+        raise click.UsageError("--raw cannot be used with --streaming")
+    if history_dir and stream:
+        raise click.UsageError("--history cannot be used with --stream")
+    if profiles_path and store_path:
+        raise click.UsageError("--profiles cannot be used with --store")
+    if serve_address and (
+        stream or store_path or history_dir or workers or remote_workers
+    ):
+        raise click.UsageError(
+            "--serve supports neither --stream, --store, --history nor the workers"
+        )
+
+    from src.cache import ResponseCache
+    from src.cluster import Coordinator, parse_address
+    from src.coalesce import FetchCoalescer
+    from src.history import HistoryStore
+    from src.metrics import Metrics, set_metrics
+    from src.profiles import load_profiles
+    from src.registry import CityRegistry
+    from src.resilience import FetchPolicy
+    from src.scheduler import PoolScheduler
+    from src.store import ResultStore
+    from src.tasks import main_task
+
+    registry = CityRegistry.from_path(registry_path) if registry_path else None
+    cache = None if no_cache else ResponseCache(cache_dir)
+    policy = FetchPolicy(
+        retries=retries,
+        hedge=hedge,
+        breaker_threshold=breaker_threshold,
+        deadline=deadline,
+    )
+    coalescer = FetchCoalescer(memo_ttl, memo_size)
+    metrics = None
+    if metrics_file or profile_dir:
+        metrics = Metrics(profile_dir=profile_dir)
+        set_metrics(metrics)
+
+    def export_metrics() -> None:
+        if metrics is not None:
+            metrics.dump_profiles()
+            if metrics_file:
+                metrics.export(metrics_file)
+
+    scheduler = PoolScheduler(threads, processes, inline_max)
+    profiles = load_profiles(profiles_path) if profiles_path else None
+    if serve_address:
+        from src.daemon import WeatherDaemon, serve_daemon
+        from src.tasks import run_settings
+
+        daemon = WeatherDaemon(
+            cities or (registry if registry is not None else CITIES),
+            refresh=refresh,
+            mode=mode,
+            concurrency=concurrency,
+            cache=cache,
+            engine=engine,
+            chunk_size=chunk_size,
+            raw=raw,
+            streaming=streaming,
+            profiles=profiles,
+            scheduler=scheduler,
+        )
+        try:
+            # a deadline is never armed: the daemon has no end of the run
+            with run_settings(registry, policy, coalescer):
+                serve_daemon(serve_address, daemon)
+        finally:
+            scheduler.close()
+        export_metrics()
+        return
+    cluster = None
+    if workers or remote_workers:
+        if stream or store_path:
+            raise click.UsageError("the workers support neither --stream nor --store")
+        cluster = Coordinator(
+            workers,
+            remote_workers,
+            parse_address(listen),
+            threads=threads,
+            processes=processes,
+        )
+    ranker = None
+    if top_k or weights or tie_break != "ties":
+        ranker = CityRanker(k=top_k, weights=weights, tie_break=tie_break)
+    try:
+        main_task(
+            city_names=cities,
+            file_object=fout,
+            output_format=output_format,
+            mode=mode,
+            concurrency=concurrency,
+            stream=stream,
+            cache=cache,
+            engine=engine,
+            chunk_size=chunk_size,
+            raw=raw,
+            streaming=streaming,
+            registry=registry,
+            store=ResultStore(store_path) if store_path else None,
+            policy=policy,
+            ranker=ranker,
+            cluster=cluster,
+            history=HistoryStore(history_dir) if history_dir else None,
+            profiles=profiles,
+            scheduler=scheduler,
+            coalescer=coalescer,
+        )
+    finally:
+        scheduler.close()
+    export_metrics()
 
 
 main()
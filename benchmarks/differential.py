@@ -0,0 +1,254 @@
+"""Differential checks and speed of the aggregation engines.
+
+    python -m benchmarks.differential --cases 500 --days 2000
+
+Random (and deliberately messy) payloads are aggregated by every engine
+and compared with the reference of its semantics, a mismatch is shrunk
+to a minimal payload. The engines are then timed on the same forecasts.
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import timedelta
+from typing import Any, Callable, NamedTuple
+
+from benchmarks.generator import CONDITIONS, START_DATE, generate_forecasts
+from external.analyzer import analyze_json
+from src.core import AGGREGATORS
+from src.profiles import AnalysisProfile, ProfileSet
+from src.types_ import FORECAST
+from src.utils import DAY_HOURS_END, DAY_HOURS_START, SUITABLE_CONDITIONS
+
+
+AGGREGATE = Callable[[list[FORECAST]], list[dict[str, Any]]]
+
+
+def analyzer_reference(forecasts: list[FORECAST]) -> list[dict[str, Any]]:
+    """The stats of external/analyzer.py, written out plainly.
+
+    Unlike `aggregate_forecast_stats` the analyzer takes every hour of
+    the window (the suitable conditions are only counted), in the given
+    order, and averages the temperatures cast to int.
+    """
+
+    results = []
+    for forecast in forecasts:
+        hours = [
+            hour
+            for hour in forecast["hours"]
+            if DAY_HOURS_START <= int(hour["hour"]) <= DAY_HOURS_END
+        ]
+        temps = [int(hour["temp"]) for hour in hours]
+        temp_avg = sum(temps) / len(temps) if temps else None
+        results.append(
+            {
+                "date": forecast["date"],
+                "hours_start": int(hours[0]["hour"]) if hours else None,
+                "hours_end": int(hours[-1]["hour"]) if hours else None,
+                "hours_count": len(hours),
+                "temp_avg": round(temp_avg, 3) if temp_avg else temp_avg,
+                "relevant_cond_hours": sum(
+                    hour["condition"] in SUITABLE_CONDITIONS for hour in hours
+                ),
+            }
+        )
+    return results
+
+
+def _analyzer(forecasts: list[FORECAST]) -> list[dict[str, Any]]:
+    return analyze_json({"forecasts": forecasts})["days"]
+
+
+_DEFAULT_PROFILE = ProfileSet([AnalysisProfile("default")])
+
+
+def _default_profile(forecasts: list[FORECAST]) -> list[dict[str, Any]]:
+    return _DEFAULT_PROFILE.aggregate(forecasts)["default"]
+
+
+class Engine(NamedTuple):
+    aggregate: AGGREGATE
+    reference: AGGREGATE
+    # the analyzer fails on the payloads the core engines tolerate
+    messy: bool = True
+
+
+REFERENCE = AGGREGATORS["pydantic"]
+ENGINES: dict[str, Engine] = {
+    **{name: Engine(aggregate, REFERENCE) for name, aggregate in AGGREGATORS.items()},
+    "profiles": Engine(_default_profile, REFERENCE),
+    "analyzer": Engine(_analyzer, analyzer_reference, messy=False),
+}
+
+
+def random_forecasts(rnd: random.Random, messy: bool = True) -> list[FORECAST]:
+    """Returns a few days of random hours in random order.
+
+    The temperatures are ints, floats or numeric strings, the conditions
+    include unknown ones; a messy payload has the days without a date or
+    hours and the hours without a temperature too.
+    """
+
+    forecasts = []
+    for day in range(rnd.randint(0, 4)):
+        date_: None | str = (START_DATE + timedelta(days=day)).isoformat()
+        hours: None | list = [
+            {
+                "hour": rnd.choice([str(hour), hour]),
+                "temp": rnd.choice(
+                    [
+                        rnd.randint(-30, 30),
+                        round(rnd.uniform(-30, 30), rnd.randint(0, 2)),
+                        str(rnd.randint(-30, 30)),
+                        0,
+                    ]
+                ),
+                "condition": rnd.choice([*CONDITIONS, "unknown"]),
+            }
+            for hour in rnd.sample(range(24), rnd.randint(0, 24))
+        ]
+        if messy:
+            for hour in hours:
+                if rnd.random() < 0.1:
+                    hour["temp"] = None
+            if rnd.random() < 0.1:
+                date_ = rnd.choice([None, ""])
+            if rnd.random() < 0.1:
+                hours = rnd.choice([None, []])
+        forecasts.append({"date": date_, "hours": hours})
+    return forecasts
+
+
+class Mismatch(NamedTuple):
+    engine: str
+    forecasts: list[FORECAST]
+    expected: Any
+    actual: Any
+
+
+def _outcome(aggregate: AGGREGATE, forecasts: list[FORECAST]) -> Any:
+    # an engine failing where the reference fails is no mismatch
+    try:
+        return aggregate(forecasts)
+    except Exception as e:
+        return type(e).__name__
+
+
+def _fails(engine: Engine, forecasts: list[FORECAST]) -> bool:
+    return _outcome(engine.aggregate, forecasts) != _outcome(
+        engine.reference, forecasts
+    )
+
+
+def shrink(engine: Engine, forecasts: list[FORECAST]) -> list[FORECAST]:
+    """Drops the days, then the hours, as long as the mismatch stays."""
+
+    forecasts = list(forecasts)
+    i = 0
+    while i < len(forecasts):
+        candidate = forecasts[:i] + forecasts[i + 1 :]
+        if _fails(engine, candidate):
+            forecasts = candidate
+        else:
+            i += 1
+    for i, day in enumerate(forecasts):
+        j = 0
+        while isinstance(day.get("hours"), list) and j < len(day["hours"]):
+            hours = day["hours"][:j] + day["hours"][j + 1 :]
+            candidate = forecasts[:i] + [{**day, "hours": hours}] + forecasts[i + 1 :]
+            if _fails(engine, candidate):
+                forecasts, day = candidate, candidate[i]
+            else:
+                j += 1
+    return forecasts
+
+
+def check(
+    engines: None | dict[str, Engine] = None,
+    cases: int = 200,
+    seed: None | int | str = 0,
+) -> list[Mismatch]:
+    """Returns the shrunk mismatches, the first one of every engine."""
+
+    engines = ENGINES if engines is None else engines
+    rnd = random.Random(seed)
+    payloads = [random_forecasts(rnd) for _ in range(cases)]
+    clean = [random_forecasts(rnd, messy=False) for _ in range(cases)]
+    mismatches = []
+    for name, engine in engines.items():
+        for forecasts in payloads if engine.messy else clean:
+            if _fails(engine, forecasts):
+                forecasts = shrink(engine, forecasts)
+                mismatches.append(
+                    Mismatch(
+                        name,
+                        forecasts,
+                        _outcome(engine.reference, forecasts),
+                        _outcome(engine.aggregate, forecasts),
+                    )
+                )
+                break
+    return mismatches
+
+
+def compare_speed(
+    engines: None | dict[str, Engine] = None,
+    days: int = 1000,
+    repeat: int = 3,
+) -> list[dict[str, Any]]:
+    """Times the engines on the same forecasts, the best of `repeat` runs."""
+
+    engines = ENGINES if engines is None else engines
+    forecasts = generate_forecasts(days=days, seed="differential")
+    results = []
+    for name, engine in engines.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            engine.aggregate(forecasts)
+            best = min(best, time.perf_counter() - start)
+        results.append(
+            {
+                "engine": name,
+                "seconds": round(best, 6),
+                "days_per_second": round(days / best) if best else None,
+            }
+        )
+    reference = next(
+        (result["seconds"] for result in results if result["engine"] == "pydantic"),
+        None,
+    )
+    for result in results:
+        result["speedup"] = (
+            round(reference / result["seconds"], 2)
+            if reference and result["seconds"]
+            else None
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--seed", default="0")
+    parser.add_argument("--days", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    args = parser.parse_args()
+    for mismatch in check(cases=args.cases, seed=args.seed):
+        print(json.dumps({"mismatch": mismatch._asdict()}))
+    results = compare_speed(days=args.days, repeat=args.repeat)
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    header = list(results[0])
+    print("  ".join(f"{name:>16}" for name in header))
+    for result in results:
+        print("  ".join(f"{str(result[name]):>16}" for name in header))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import json
+import random
+from datetime import date, timedelta
+from typing import Any
+
+from src.types_ import FORECAST
+from src.utils import CONDITION_MAPPING
+
+
+CONDITIONS = list(CONDITION_MAPPING)
+START_DATE = date(2022, 5, 18)
+
+
+def generate_city_names(count: int) -> list[str]:
+    """Returns `count` distinct synthetic city names."""
+
+    return [f"city{num:06d}" for num in range(count)]
+
+
+def generate_forecasts(
+    days: int = 5, hours: int = 24, seed: None | int | str = None
+) -> list[FORECAST]:
+    """Returns `days` x `hours` forecasts shaped like the Yandex Weather ones."""
+
+    rnd = random.Random(seed)
+    forecasts = []
+    for day in range(days):
+        base_temp = rnd.uniform(-10.0, 30.0)
+        forecasts.append(
+            {
+                "date": (START_DATE + timedelta(days=day)).isoformat(),
+                "hours": [
+                    {
+                        "hour": str(hour),
+                        "temp": round(base_temp + rnd.uniform(-5.0, 5.0)),
+                        "condition": rnd.choice(CONDITIONS),
+                    }
+                    for hour in range(hours)
+                ],
+            }
+        )
+    return forecasts
+
+
+def generate_response(
+    days: int = 5,
+    hours: int = 24,
+    seed: None | int | str = None,
+    payload_size: int = 0,
+) -> dict[str, Any]:
+    """Returns a response body padded up to about `payload_size` bytes.
+
+    The padding goes to the sections the pipeline never reads.
+    """
+
+    response: dict[str, Any] = {
+        "fact": {"padding": ""},
+        "forecasts": generate_forecasts(days=days, hours=hours, seed=seed),
+    }
+    missing = payload_size - len(json.dumps(response))
+    response["fact"]["padding"] = "x" * max(0, missing)
+    return response
@@ -0,0 +1,75 @@
+"""Memory and speed of the pydantic models against the compact records.
+
+    python -m benchmarks.models --days 5000
+"""
+
+import argparse
+import json
+import pickle
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from benchmarks.generator import generate_forecasts
+from src.compact import DayRecord, select_day_record
+from src.core import select_forecast_days
+
+
+def _measure(name: str, build: Callable[[], list[Any]]) -> dict[str, Any]:
+    tracemalloc.start()
+    objects = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    count = len(objects) or 1
+    return {
+        "model": name,
+        "objects": len(objects),
+        "bytes_per_object": round(size / count, 1),
+        "us_per_object": round(elapsed / count * 1e6, 3),
+        "pickled_bytes_per_object": round(len(pickle.dumps(objects)) / count, 1),
+    }
+
+
+def run(days: int = 1000) -> list[dict[str, Any]]:
+    """Builds the selected days and their stats with both representations.
+
+    A day object includes its hours, so "per object" means per day.
+    """
+
+    forecasts = generate_forecasts(days=days, seed="models")
+
+    def select_day_records() -> list[DayRecord]:
+        days = map(select_day_record, forecasts)
+        return [day for day in days if day is not None]
+
+    records = select_day_records()
+    stats = [day.stats() for day in records]
+    return [
+        _measure("DayInfo", lambda: select_forecast_days(forecasts)),
+        _measure("DayRecord", select_day_records),
+        _measure("StatsInfo", lambda: [record.to_model() for record in stats]),
+        _measure("StatsRecord", lambda: [day.stats() for day in records]),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    args = parser.parse_args()
+    results = run(days=args.days)
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    header = list(results[0])
+    print("  ".join(f"{name:>24}" for name in header))
+    for result in results:
+        print("  ".join(f"{str(result[name]):>24}" for name in header))
+
+
+if __name__ == "__main__":
+    main()
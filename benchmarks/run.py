@@ -0,0 +1,189 @@
+"""Throughput, latency and memory benchmarks of the pipeline stages.
+
+Every stage runs in a fresh process against a local WeatherServer,
+so the peak RSS of one stage does not leak into another:
+
+    python -m benchmarks.run --cities 200 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from benchmarks.generator import generate_city_names, generate_forecasts
+from benchmarks.server import registered_cities, serve
+from src.core import AGGREGATORS, make_async_client
+from src.tasks import fetch_forecasts_async_task, fetch_forecasts_task, main_task
+from src.utils import AGGREGATION_ENGINES, FETCH_CONCURRENCY, FETCH_TIMEOUT
+
+
+STAGES = (
+    "fetch-threads",
+    "fetch-async",
+    *(f"aggregate-{engine}" for engine in AGGREGATION_ENGINES),
+    "main-threads",
+    "main-async",
+    "main-stream",
+)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Returns the nearest-rank percentile of the values."""
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _timed(func: Callable, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def _bench_fetch_threads(cities: list[str], days: int) -> list[float]:
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as pool:
+        return list(
+            pool.map(
+                lambda city: _timed(fetch_forecasts_task, city, FETCH_TIMEOUT),
+                cities,
+            )
+        )
+
+
+def _bench_fetch_async(cities: list[str], days: int) -> list[float]:
+    async def fetch_all() -> list[float]:
+        semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+        async with make_async_client() as client:
+
+            async def fetch(city: str) -> float:
+                async with semaphore:
+                    start = time.perf_counter()
+                    await fetch_forecasts_async_task(
+                        city, client, asyncio.Semaphore(), FETCH_TIMEOUT
+                    )
+                    return time.perf_counter() - start
+
+            return await asyncio.gather(*map(fetch, cities))
+
+    return asyncio.run(fetch_all())
+
+
+def _bench_aggregate(engine: str) -> Callable[[list[str], int], list[float]]:
+    def bench(cities: list[str], days: int) -> list[float]:
+        aggregate = AGGREGATORS[engine]
+        return [
+            _timed(aggregate, generate_forecasts(days=days, seed=city))
+            for city in cities
+        ]
+
+    return bench
+
+
+def _bench_main(mode: str, stream: bool = False):
+    def bench(cities: list[str], days: int) -> list[float]:
+        out = io.StringIO()
+        out.close = lambda: None  # type: ignore
+        return [_timed(lambda: main_task(tuple(cities), out, mode=mode, stream=stream))]
+
+    return bench
+
+
+BENCHMARKS: dict[str, Callable[[list[str], int], list[float]]] = {
+    "fetch-threads": _bench_fetch_threads,
+    "fetch-async": _bench_fetch_async,
+    **{f"aggregate-{e}": _bench_aggregate(e) for e in AGGREGATION_ENGINES},
+    "main-threads": _bench_main("threads"),
+    "main-async": _bench_main("async"),
+    "main-stream": _bench_main("threads", stream=True),
+}
+
+
+def run_stage(stage: str, base_url: str, cities: list[str], days: int) -> dict:
+    """Runs the stage benchmark, to be called in a fresh process."""
+
+    with registered_cities(base_url, cities):
+        start = time.perf_counter()
+        latencies = BENCHMARKS[stage](cities, days)
+        elapsed = time.perf_counter() - start
+    if stage.startswith("aggregate"):
+        # the measured calls only, without generating the forecasts
+        elapsed = sum(latencies)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return {
+        "stage": stage,
+        "cities": len(cities),
+        "seconds": round(elapsed, 4),
+        "cities_per_sec": round(len(cities) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "peak_rss_mb": round(self_rss / 2**20, 1),
+        "children_peak_rss_mb": round(children_rss / 2**20, 1),
+    }
+
+
+def run(
+    stages: tuple[str, ...] = STAGES,
+    cities_count: int = 100,
+    days: int = 5,
+    **server_options: Any,
+) -> list[dict]:
+    cities = generate_city_names(cities_count)
+    results = []
+    spawn = multiprocessing.get_context("spawn")
+    with serve(days=days, **server_options) as server:
+        for stage in stages:
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as isolated:
+                future = isolated.submit(
+                    run_stage, stage, server.base_url, cities, days
+                )
+                results.append(future.result())
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cities", type=int, default=100)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--payload-size", type=int, default=50_000, help="bytes")
+    parser.add_argument("--stage", action="append", choices=STAGES)
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = run(
+        stages=tuple(args.stage or STAGES),
+        cities_count=args.cities,
+        days=args.days,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        payload_size=args.payload_size,
+    )
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    header = list(results[0])
+    print("  ".join(f"{name:>20}" for name in header))
+    for result in results:
+        print("  ".join(f"{str(result[name]):>20}" for name in header))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator
+
+from benchmarks.generator import generate_response
+from src import utils
+
+
+RESPONSE_PATH = Path(__file__).parent.parent / "examples" / "response.json"
+
+
+class WeatherServer(ThreadingHTTPServer):
+    """A local stand-in for the forecast storage.
+
+    `/example-response.json` serves `examples/response.json`, any other
+    `/<city>-response.json` serves a synthetic response seeded by the city.
+    """
+
+    daemon_threads = True
+    # the mock should not be the bottleneck of the benchmarks
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        address: tuple[str, int] = ("127.0.0.1", 0),
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        days: int = 5,
+        payload_size: int = 0,
+        seed: int = 0,
+    ):
+        super().__init__(address, WeatherRequestHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.days = days
+        self.payload_size = payload_size
+        self.requests_count = 0
+        self._random = random.Random(seed)
+        self._bodies: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def body(self, city: str) -> bytes:
+        with self._lock:
+            if (body := self._bodies.get(city)) is None:
+                if city == "example":
+                    body = RESPONSE_PATH.read_bytes()
+                else:
+                    response = generate_response(
+                        days=self.days, seed=city, payload_size=self.payload_size
+                    )
+                    body = json.dumps(response).encode()
+                self._bodies[city] = body
+            return body
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self.requests_count += 1
+            return self._random.random() < self.error_rate
+
+
+class WeatherRequestHandler(BaseHTTPRequestHandler):
+    server: WeatherServer
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        name = self.path.rsplit("/", 1)[-1]
+        if not name.endswith("-response.json"):
+            self._reply(HTTPStatus.NOT_FOUND)
+            return
+        if self.server.should_fail():
+            self._reply(HTTPStatus.INTERNAL_SERVER_ERROR)
+            return
+        body = self.server.body(name.removesuffix("-response.json"))
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self._reply(HTTPStatus.NOT_MODIFIED, etag=etag)
+            return
+        self._reply(HTTPStatus.OK, body, etag=etag)
+
+    def _reply(self, status: HTTPStatus, body: bytes = b"", etag: str = ""):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve(**kwargs) -> Iterator[WeatherServer]:
+    """Runs a WeatherServer in a background thread."""
+
+    server = WeatherServer(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@contextmanager
+def registered_cities(base_url: str, names: list[str]) -> Iterator[None]:
+    """Maps the city names to the server URLs for the duration of the block."""
+
+    added = {name.upper(): f"{base_url}/{name.lower()}-response.json" for name in names}
+    saved = {name: utils.CITIES[name] for name in added if name in utils.CITIES}
+    utils.CITIES.update(added)
+    try:
+        yield
+    finally:
+        for name in added:
+            utils.CITIES.pop(name, None)
+        utils.CITIES.update(saved)
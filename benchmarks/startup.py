@@ -0,0 +1,133 @@
+"""The start-up cost of the CLI against a query to the warm daemon.
+
+Every measurement of a command runs a fresh interpreter:
+
+    python -m benchmarks.startup --cities 5 --repeat 5
+"""
+
+import argparse
+import json
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+from urllib.parse import urlencode
+
+from benchmarks.generator import generate_city_names
+from benchmarks.server import registered_cities, serve
+from src.daemon import WeatherDaemon, make_server
+
+
+ROOT = Path(__file__).resolve().parent.parent
+MODULES = ("src.utils", "src.cluster", "src.core", "src.tasks", "src.daemon")
+
+
+def import_time(module: str, repeat: int = 3) -> float:
+    """Returns the best cumulative import time of the module in seconds."""
+
+    best = float("inf")
+    for _ in range(repeat):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stderr
+        # "import time: self [us] | cumulative | imported package"
+        for line in stderr.splitlines():
+            _, cumulative, name = line.split("|")
+            if name.strip() == module:
+                best = min(best, int(cumulative) / 1e6)
+    return best
+
+
+def command_time(args: list[str], repeat: int = 3) -> float:
+    """Returns the best wall time of the command in seconds."""
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=ROOT, capture_output=True, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@contextmanager
+def _serving(server: socketserver.BaseServer) -> Iterator[None]:
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def run(cities_count: int = 5, repeat: int = 3) -> list[dict[str, Any]]:
+    results = [
+        {"target": f"import {module}", "ms": round(import_time(module, repeat) * 1e3)}
+        for module in MODULES
+    ]
+    cli = [sys.executable, "__main__.py"]
+    results.append(
+        {"target": "cli --help", "ms": round(command_time([*cli, "--help"]) * 1e3)}
+    )
+
+    cities = generate_city_names(cities_count)
+    with serve() as server, tempfile.TemporaryDirectory() as tmp:
+        registry = Path(tmp, "registry.json")
+        registry.write_text(
+            json.dumps({c: f"{server.base_url}/{c}-response.json" for c in cities})
+        )
+        one_shot = [
+            *cli,
+            *cities,
+            "--no-cache",
+            f"--registry={registry}",
+            f"--out={Path(tmp, 'out.json')}",
+        ]
+        results.append(
+            {"target": "cli run", "ms": round(command_time(one_shot, repeat) * 1e3)}
+        )
+
+        with registered_cities(server.base_url, cities), WeatherDaemon(
+            cities, refresh=None
+        ) as daemon, make_server("127.0.0.1:0", daemon) as daemon_server:
+            host, port = daemon_server.server_address[:2]
+            url = f"http://{host}:{port}/rank?" + urlencode({"city": cities}, True)
+            daemon.results(cities)
+            with _serving(daemon_server):
+                best = float("inf")
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    with urllib.request.urlopen(url) as response:
+                        response.read()
+                    best = min(best, time.perf_counter() - start)
+        results.append({"target": "daemon /rank", "ms": round(best * 1e3, 1)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cities", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    args = parser.parse_args()
+    results = run(cities_count=args.cities, repeat=args.repeat)
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    for result in results:
+        print(f"{result['target']:>24}  {result['ms']:>8} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,22 @@
 import argparse
+import copy
+import glob
 import json
 import logging
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 from functools import reduce
 from operator import getitem
 from typing import Optional, List, Dict
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - the optional fast parser
+    orjson = None
+
 PATH_FROM_INPUT = "./../examples/response.json"
 PATH_TO_OUTPUT = "./../examples/output.json"
 
@@ -61,6 +72,19 @@ def load_data(input_path: str = PATH_FROM_INPUT):
         return json.loads(data)
 
 
+def load_data_mmap(input_path: str):
+    """Parses the file through a read-only memory map, without a text copy."""
+
+    with open(input_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if orjson is not None:
+                with memoryview(mapped) as view:
+                    return orjson.loads(view)
+            return json.loads(mapped[:])
+
+
 def dump_data(data, output_path: str = PATH_TO_OUTPUT):
     with open(output_path, mode="w") as file:
         formatted_data = json.dumps(data, indent=2)
@@ -83,6 +107,28 @@ def parse_args():
         type=str,
         help="path to file with result",
     )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        nargs="+",
+        default=None,
+        metavar="PATH",
+        help="analyze the files, directories (of *.json) or globs; "
+        "the output is the merged summary",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        type=str,
+        help="the directory of the per-file results in the batch mode",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=None,
+        type=int,
+        help="the worker processes in the batch mode (default: the CPU count)",
+    )
     parser.add_argument("-v", "--verbose", action="store_true")
     return parser.parse_args()
 
@@ -198,12 +244,120 @@ def analyze_json(data):
 
         days.append(d_info.to_json())
 
-    result = DEFAULT_OUTPUT_RESULT
+    # a fresh result: the default is shared by every call
+    result = copy.deepcopy(DEFAULT_OUTPUT_RESULT)
     # result[OUTPUT_RAW_DATA_KEY] = data
     result[OUTPUT_DAYS_KEY] = days
     return result
 
 
+def find_input_paths(patterns: List[str]) -> List[str]:
+    """Expands the files, the directories (their *.json) and the globs."""
+
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.json")
+        paths.update(
+            path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)
+        )
+    return sorted(paths)
+
+
+def summarize_days(days: List[dict]) -> dict:
+    temps = [day["temp_avg"] for day in days if day["temp_avg"] is not None]
+    return {
+        "days": len(days),
+        "temp_avg": round(sum(temps) / len(temps), 3) if temps else None,
+        "relevant_cond_hours": sum(day["relevant_cond_hours"] for day in days),
+    }
+
+
+def analyze_file(input_path: str, output_path: Optional[str] = None) -> dict:
+    """Analyzes one file, the state of a file is its own.
+
+    Returns:
+        the summary of the file days, or the error, with the file size
+    """
+
+    report = {"path": input_path, "bytes": 0, "summary": None, "error": None}
+    try:
+        report["bytes"] = os.path.getsize(input_path)
+        result = analyze_json(load_data_mmap(input_path))
+        days = result.get(OUTPUT_DAYS_KEY, [])
+        report["summary"] = summarize_days(days)
+        if output_path is not None:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            dump_data(result, output_path)
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        report["error"] = f"{type(e).__name__}: {e}"
+    return report
+
+
+def analyze_batch(
+    patterns: List[str],
+    output_dir: Optional[str] = None,
+    jobs: Optional[int] = None,
+) -> dict:
+    """Analyzes the files in parallel and merges their summaries.
+
+    Args:
+        patterns: List[str] - the files, directories or globs
+        output_dir: Optional[str] - write the result of every file there
+        jobs: Optional[int] - the worker processes, 1 runs in this process
+
+    Returns:
+        the summaries and the errors by path with the throughput stats
+    """
+
+    paths = find_input_paths(patterns)
+    output_paths: List[Optional[str]] = [None] * len(paths)
+    if output_dir is not None and paths:
+        # the results mirror the input tree, the equal names do not clash
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+        output_paths = [
+            os.path.join(output_dir, os.path.relpath(os.path.abspath(path), root))
+            for path in paths
+        ]
+    jobs = min(jobs or os.cpu_count() or 1, max(len(paths), 1))
+    start = time.perf_counter()
+    if jobs == 1:
+        reports = list(map(analyze_file, paths, output_paths))
+    else:
+        # a few files per task keep the pickling overhead low
+        chunksize = max(1, len(paths) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            reports = list(
+                pool.map(analyze_file, paths, output_paths, chunksize=chunksize)
+            )
+    seconds = time.perf_counter() - start
+
+    files, errors = {}, {}
+    for report in reports:
+        if report["error"] is None:
+            files[report["path"]] = report["summary"]
+        else:
+            logging.warning(f"Cannot analyze {report['path']!r}: {report['error']}")
+            errors[report["path"]] = report["error"]
+    total_bytes = sum(report["bytes"] for report in reports)
+    return {
+        "files": files,
+        "errors": errors,
+        "stats": {
+            "files": len(paths),
+            "failed": len(errors),
+            "days": sum(summary["days"] for summary in files.values()),
+            "bytes": total_bytes,
+            "jobs": jobs,
+            "seconds": round(seconds, 3),
+            "files_per_second": round(len(paths) / seconds, 1) if seconds else None,
+            "mb_per_second": (
+                round(total_bytes / seconds / 2**20, 3) if seconds else None
+            ),
+        },
+    }
+
+
 if __name__ == "__main__":
     args = parse_args()
     input_path = args.input
@@ -213,7 +367,10 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG if verbose_mode else logging.WARNING)
     logging.info(args)
 
-    data = load_data(input_path)
-    data = analyze_json(data)
+    if args.batch:
+        data = analyze_batch(args.batch, args.output_dir, args.jobs)
+    else:
+        data = load_data(input_path)
+        data = analyze_json(data)
 
     dump_data(data, output_path)
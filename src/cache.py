@@ -0,0 +1,207 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from http import HTTPStatus
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from src.utils import CACHE_MAX_SIZE, CACHE_TTL
+
+if TYPE_CHECKING:  # httpx is imported by the fetching code only
+    import httpx
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    body: bytes
+    stored_at: float
+    etag: None | str = None
+    last_modified: None | str = None
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.stored_at < ttl
+
+
+class ResponseCache:
+    """A persistent HTTP response cache keyed by URL.
+
+    An entry is a file sharded by the first two hex digits of the URL hash:
+    a JSON line with the metadata followed by the raw response body.
+    Fresh entries are served without a request, stale ones are
+    revalidated with ETag/Last-Modified conditional headers.
+    The least recently used entries are evicted above `max_size` bytes.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str | os.PathLike,
+        ttl: float = CACHE_TTL,
+        max_size: int = CACHE_MAX_SIZE,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size: None | int = None
+        self._lock = threading.Lock()
+
+    def _path(self, url: str) -> Path:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.cache_dir / key[:2] / key
+
+    def lookup(self, url: str) -> None | CacheEntry:
+        """Returns the stored entry for the URL (fresh or stale)."""
+
+        path = self._path(url)
+        try:
+            with open(path, "rb") as fin:
+                meta = json.loads(fin.readline())
+                body = fin.read()
+            os.utime(path)  # the access time for the LRU eviction
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url:
+            return None
+        return CacheEntry(
+            url=url,
+            body=body,
+            stored_at=meta["stored_at"],
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+        )
+
+    def get_fresh(self, url: str) -> tuple[None | bytes, None | CacheEntry]:
+        """Returns (body, None) on a fresh hit, else (None, the stale entry)."""
+
+        entry = self.lookup(url)
+        if entry and entry.is_fresh(self.ttl):
+            with self._lock:
+                self.hits += 1
+            return (entry.body, None)
+        return (None, entry)
+
+    @staticmethod
+    def conditional_headers(entry: None | CacheEntry) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if entry is None:
+            return headers
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def resolve(
+        self,
+        url: str,
+        entry: None | CacheEntry,
+        response: "httpx.Response",
+        body: None | bytes = None,
+    ) -> bytes:
+        """Returns the body for the response and updates the cache.
+
+        A 304 response renews the stale entry, a 200 response replaces it.
+        The body of a streamed response is passed as it was read.
+        """
+
+        if response.status_code == HTTPStatus.NOT_MODIFIED and entry is not None:
+            with self._lock:
+                self.revalidated += 1
+            self._write(
+                CacheEntry(
+                    url=url,
+                    body=entry.body,
+                    stored_at=time.time(),
+                    etag=response.headers.get("ETag", entry.etag),
+                    last_modified=response.headers.get(
+                        "Last-Modified", entry.last_modified
+                    ),
+                )
+            )
+            return entry.body
+        with self._lock:
+            self.misses += 1
+        if body is None:
+            body = response.content
+        if response.status_code == HTTPStatus.OK:
+            self._write(
+                CacheEntry(
+                    url=url,
+                    body=body,
+                    stored_at=time.time(),
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified"),
+                )
+            )
+        return body
+
+    def _write(self, entry: CacheEntry) -> None:
+        path = self._path(entry.url)
+        meta = {
+            "url": entry.url,
+            "stored_at": entry.stored_at,
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+        }
+        data = json.dumps(meta).encode() + b"\n" + entry.body
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            old_size = path.stat().st_size if path.exists() else 0
+            fd, tmp = tempfile.mkstemp(dir=path.parent)
+            with os.fdopen(fd, "wb") as fout:
+                fout.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"Cannot cache the response for {entry.url!r}: {e}")
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_size()
+            else:
+                self._size += len(data) - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        for path in self.cache_dir.glob("??/*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _disk_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        """Removes the least recently used entries (the lock is held)."""
+
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            self._size -= size
+            self.evictions += 1
+
+    def log_stats(self) -> None:
+        logging.info(
+            f"Response cache {str(self.cache_dir)!r}: hits={self.hits}, "
+            f"revalidated={self.revalidated}, misses={self.misses}, "
+            f"evictions={self.evictions}"
+        )
@@ -0,0 +1,443 @@
+"""The sharded execution: a coordinator and its worker processes.
+
+The coordinator splits the cities into shards and hands them out to the
+workers connected to it, a worker fetches and aggregates its shard with
+its own pools and streams the results back city by city. A shard of a
+lost worker goes to the others, but for the cities already received.
+
+A worker on another node connects with
+
+    python -m src.cluster HOST:PORT
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterable
+
+from src.cache import ResponseCache
+from src.exceptions import TaskError
+from src.profiles import ProfileSet
+from src.registry import CityRegistry, set_default_registry
+from src.resilience import FetchPolicy, get_fetch_policy, set_fetch_policy
+from src.scheduler import PoolScheduler
+from src.utils import (
+    BREAKER_COOLDOWN,
+    FETCH_CONCURRENCY,
+    SHARDS_PER_WORKER,
+    WORKER_CONNECT_TIMEOUT,
+    get_url_by_city_name,
+)
+
+
+# a message is a JSON object prefixed with its length
+_HEADER = struct.Struct("!I")
+# how often the coordinator looks for new workers while serving the others
+_POLL_INTERVAL = 0.1
+_ROOT = Path(__file__).resolve().parent.parent
+
+
+def send_message(sock: socket.socket, message: dict[str, Any]) -> None:
+    data = json.dumps(message).encode()
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def recv_message(reader: BinaryIO) -> None | dict[str, Any]:
+    """Returns the next message or None if the peer has gone."""
+
+    header = reader.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    (size,) = _HEADER.unpack(header)
+    data = reader.read(size)
+    if len(data) < size:
+        return None
+    return json.loads(data)
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """Returns the (host, port) of "HOST:PORT"."""
+
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise TaskError(f"the address {address!r} is not HOST:PORT")
+    return (host, int(port))
+
+
+class _ShardQueue:
+    """The shards to hand out, a failed shard is put back."""
+
+    def __init__(self, shards: Iterable[list[str]]):
+        self._pending = deque(shards)
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def get(self) -> None | list[str]:
+        """Returns the next shard, None when all of them are done."""
+
+        with self._cond:
+            while not self._pending and self._in_flight:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            self._in_flight += 1
+            return self._pending.popleft()
+
+    def done(self, unfinished: list[str]) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            if unfinished:
+                self._pending.append(unfinished)
+            self._cond.notify_all()
+
+    def wait(self, timeout: float) -> None:
+        with self._cond:
+            if not self.finished:
+                self._cond.wait(timeout)
+
+    @property
+    def finished(self) -> bool:
+        return not self._pending and not self._in_flight
+
+    def remaining(self) -> list[str]:
+        with self._cond:
+            return sorted(city for shard in self._pending for city in shard)
+
+
+def _policy_options(policy: FetchPolicy) -> dict[str, Any]:
+    breaker = policy.breaker
+    return {
+        "retries": policy.retries,
+        "backoff_base": policy.backoff_base,
+        "backoff_max": policy.backoff_max,
+        "hedge": policy.hedge,
+        "hedge_quantile": policy.hedge_quantile,
+        "hedge_min_samples": policy.hedge_min_samples,
+        "breaker_threshold": None if breaker is None else breaker.threshold,
+        "breaker_cooldown": BREAKER_COOLDOWN if breaker is None else breaker.cooldown,
+    }
+
+
+class Coordinator:
+    """Runs the fetching and the aggregation of the cities on the workers.
+
+    Args:
+        local_workers: int - the worker subprocesses to start on this host
+        remote_workers: int - the workers to accept from the other nodes
+        address: tuple[str, int] - where to listen, port 0 picks a free one
+        shards_per_worker: int - the shards to split the cities into
+            per worker, the smaller shards balance the slower workers
+        connect_timeout: float - how long to wait for a worker to connect
+        threads: None | int - the fetch threads of a local worker
+        processes: None | int - the aggregation processes of a local
+            worker, None to adapt them within its share of the CPUs
+    """
+
+    def __init__(
+        self,
+        local_workers: int = 1,
+        remote_workers: int = 0,
+        address: tuple[str, int] = ("127.0.0.1", 0),
+        shards_per_worker: int = SHARDS_PER_WORKER,
+        connect_timeout: float = WORKER_CONNECT_TIMEOUT,
+        threads: None | int = None,
+        processes: None | int = None,
+    ):
+        if local_workers < 0 or remote_workers < 0:
+            raise TaskError("the number of the workers must not be negative")
+        if not local_workers + remote_workers:
+            raise TaskError("the cluster has no workers")
+        if shards_per_worker < 1:
+            raise TaskError(f"shards_per_worker={shards_per_worker} must be positive")
+        self.local_workers = local_workers
+        self.remote_workers = remote_workers
+        self.address = address
+        self.shards_per_worker = shards_per_worker
+        self.connect_timeout = connect_timeout
+        self.threads = threads
+        self.processes = processes
+        self._lock = threading.Lock()
+
+    @property
+    def workers(self) -> int:
+        return self.local_workers + self.remote_workers
+
+    def worker_args(self) -> list[str]:
+        """Returns the pool options of a local worker.
+
+        The local workers share the CPUs of the host, so each one adapts
+        its processes within its share unless their number is given.
+        """
+
+        args = []
+        if self.threads is not None:
+            args += ["--threads", str(self.threads)]
+        if self.processes is not None:
+            args += ["--processes", str(self.processes)]
+        else:
+            cpus = max(1, (os.cpu_count() or 1) // max(self.local_workers, 1))
+            args += ["--cpus", str(cpus)]
+        return args
+
+    def run(
+        self,
+        cities: Iterable[str],
+        on_result: Callable[[str, dict[str, Any]], None],
+        mode: str = "threads",
+        concurrency: int = FETCH_CONCURRENCY,
+        cache: None | ResponseCache = None,
+        engine: str = "pydantic",
+        chunk_size: None | int = None,
+        raw: bool = False,
+        streaming: bool = False,
+        profiles: None | ProfileSet = None,
+    ) -> list[str]:
+        """Passes the result of every city to `on_result` as it arrives.
+
+        The options are those of `aggregate_cities_task`, the fetch policy
+        is the current one.
+
+        Returns:
+            the cities lost with the workers
+        """
+
+        urls: dict[str, str] = {}
+        for city in sorted(cities):
+            try:
+                urls[city] = get_url_by_city_name(city)
+            except KeyError:
+                logging.error(f"Cannot request data for the city {city!r}: unknown")
+        if not urls:
+            return []
+        count = min(len(urls), self.workers * self.shards_per_worker) or 1
+        shards = _ShardQueue(
+            shard for shard in (list(urls)[i::count] for i in range(count)) if shard
+        )
+        options = {
+            "type": "options",
+            "mode": mode,
+            "concurrency": concurrency,
+            "engine": engine,
+            "chunk_size": chunk_size,
+            "raw": raw,
+            "streaming": streaming,
+            "policy": _policy_options(get_fetch_policy()),
+            "cache": None,
+            "profiles": None if profiles is None else profiles.to_json(),
+        }
+        if cache is not None:
+            options["cache"] = {
+                "cache_dir": str(cache.cache_dir),
+                "ttl": cache.ttl,
+                "max_size": cache.max_size,
+            }
+
+        def serve(conn: socket.socket) -> None:
+            with conn, conn.makefile("rb") as reader:
+                try:
+                    send_message(conn, options)
+                except OSError as e:
+                    logging.error(f"The worker has gone: {e}")
+                    return
+                while (shard := shards.get()) is not None:
+                    received: set[str] = set()
+                    try:
+                        self._run_shard(conn, reader, shard, urls, on_result, received)
+                    except OSError as e:
+                        logging.error(f"The worker has gone, requeueing its shard: {e}")
+                        shards.done([city for city in shard if city not in received])
+                        return
+                    shards.done([])
+                try:
+                    send_message(conn, {"type": "stop"})
+                except OSError:
+                    pass
+
+        processes: list[subprocess.Popen] = []
+        threads: list[threading.Thread] = []
+        try:
+            with socket.create_server(self.address) as listener:
+                listener.settimeout(_POLL_INTERVAL)
+                host, port = listener.getsockname()[:2]
+                self.address = (host, port)
+                logging.info(f"Waiting for {self.workers} workers at {host}:{port}")
+                processes = [
+                    subprocess.Popen(
+                        [
+                            sys.executable,
+                            "-m",
+                            "src.cluster",
+                            f"{host}:{port}",
+                            *self.worker_args(),
+                        ],
+                        cwd=_ROOT,
+                    )
+                    for _ in range(self.local_workers)
+                ]
+                self._accept(listener, serve, shards, processes, threads)
+                for thread in threads:
+                    thread.join()
+        finally:
+            # the listener is closed: a worker not served yet is refused
+            for process in processes:
+                try:
+                    process.wait(self.connect_timeout)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        if not threads and not shards.finished:
+            raise TaskError("no worker has connected to the coordinator")
+        if lost := shards.remaining():
+            logging.error(f"No worker is left for the cities {lost}")
+        return lost
+
+    def _accept(
+        self,
+        listener: socket.socket,
+        serve: Callable[[socket.socket], None],
+        shards: _ShardQueue,
+        processes: list[subprocess.Popen],
+        threads: list[threading.Thread],
+    ) -> None:
+        """Serves the connecting workers until the shards are finished."""
+
+        waiting_since = time.monotonic()
+        while not shards.finished:
+            serving = any(thread.is_alive() for thread in threads)
+            if serving:
+                waiting_since = time.monotonic()
+            awaited = self.remote_workers or any(
+                process.poll() is None for process in processes
+            )
+            if (
+                len(threads) < self.workers
+                and awaited
+                and time.monotonic() - waiting_since < self.connect_timeout
+            ):
+                try:
+                    conn, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                thread = threading.Thread(
+                    target=serve, args=(conn,), name="cluster-worker"
+                )
+                thread.start()
+                threads.append(thread)
+            elif serving:
+                shards.wait(_POLL_INTERVAL)
+            else:
+                break
+
+    def _run_shard(
+        self,
+        conn: socket.socket,
+        reader: BinaryIO,
+        shard: list[str],
+        urls: dict[str, str],
+        on_result: Callable[[str, dict[str, Any]], None],
+        received: set[str],
+    ) -> None:
+        remaining = get_fetch_policy().remaining()
+        message = {
+            "type": "shard",
+            "cities": {city: urls[city] for city in shard},
+            "deadline": remaining,
+        }
+        send_message(conn, message)
+        while (message := recv_message(reader)) is not None:
+            if message["type"] == "done":
+                return
+            received.add(message["city"])
+            with self._lock:
+                on_result(message["city"], message["result"])
+        raise ConnectionError("the connection is closed")
+
+
+def run_worker(
+    address: tuple[str, int], scheduler: None | PoolScheduler = None
+) -> None:
+    """Serves the shards of the coordinator at the address until it stops.
+
+    Every shard leases its pools from the scheduler, an adaptive one
+    by default.
+    """
+
+    # the tasks module imports this one for the coordinator
+    from src.tasks import aggregate_cities_task
+
+    scheduler = PoolScheduler() if scheduler is None else scheduler
+    try:
+        with socket.create_connection(address) as sock, sock.makefile("rb") as reader:
+            _serve_shards(sock, reader, aggregate_cities_task, scheduler)
+    finally:
+        scheduler.close()
+
+
+def _serve_shards(
+    sock: socket.socket,
+    reader: BinaryIO,
+    aggregate_cities_task: Callable,
+    scheduler: PoolScheduler,
+) -> None:
+    options = recv_message(reader)
+    if options is None:
+        return
+    policy = FetchPolicy(**options.pop("policy"))
+    set_fetch_policy(policy)
+    cache = None
+    if (cache_options := options.pop("cache")) is not None:
+        cache = ResponseCache(**cache_options)
+    profiles = None
+    if (profiles_data := options.pop("profiles")) is not None:
+        profiles = ProfileSet.from_json(profiles_data)
+    del options["type"]
+
+    def send_result(city: str, result: dict[str, Any]) -> None:
+        send_message(sock, {"type": "result", "city": city, "result": result})
+
+    while (message := recv_message(reader)) is not None:
+        if message["type"] != "shard":
+            return
+        set_default_registry(CityRegistry.from_mapping(message["cities"]))
+        policy.deadline = message["deadline"]
+        policy.start()
+        cities = message["cities"]
+        with scheduler.run(len(cities)) as (executor, thread_pool):
+            aggregate_cities_task(
+                executor,
+                cities,
+                send_result,
+                cache=cache,
+                profiles=profiles,
+                thread_pool=thread_pool,
+                **options,
+            )
+        send_message(sock, {"type": "done"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A worker of the coordinator.")
+    parser.add_argument("address", help="the HOST:PORT of the coordinator")
+    parser.add_argument("--threads", type=int, help="the fetch threads")
+    parser.add_argument("--processes", type=int, help="the aggregation processes")
+    parser.add_argument("--cpus", type=int, help="the CPUs the processes may use")
+    args = parser.parse_args()
+    scheduler = PoolScheduler(args.threads, args.processes, cpus=args.cpus)
+    try:
+        run_worker(parse_address(args.address), scheduler)
+    except ConnectionError as e:
+        # the coordinator has finished without this worker
+        logging.info(f"The coordinator is gone: {e}")
+
+
+if __name__ == "__main__":
+    main()
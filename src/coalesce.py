@@ -0,0 +1,241 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Hashable, Iterable
+
+from src.metrics import get_metrics
+from src.utils import MEMO_MAX_ENTRIES, MEMO_TTL, get_url_by_city_name
+
+
+# the value of a missing (or expired) memo entry
+MISSING = object()
+
+
+class TTLMemo:
+    """The results kept for `ttl` seconds, the least recently used go first.
+
+    Args:
+        ttl: float - the seconds an entry lives, 0 keeps nothing
+        max_entries: int - the entries kept at most
+    """
+
+    def __init__(self, ttl: float = MEMO_TTL, max_entries: int = MEMO_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        """Returns the value or MISSING."""
+
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                get_metrics().inc("memo_evictions_total")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SingleFlight:
+    """Runs one call per key at a time, the concurrent callers share it.
+
+    The first caller of a key (the leader) makes the call, the callers
+    coming while it is in flight wait for its result or its exception.
+    The async flights are per event loop and separate from the threaded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[Hashable, Future] = {}
+        self._async_flights: dict[tuple[int, Hashable], asyncio.Future] = {}
+
+    def lead(self, key: Hashable) -> tuple[Future, bool]:
+        """Returns the flight of the key and if the caller leads it.
+
+        The leader must `land` the flight, the others wait for its result.
+        """
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+        if not leader:
+            get_metrics().inc("coalesced_total")
+        return flight, leader
+
+    def land(self, key: Hashable, result: Any) -> None:
+        with self._lock:
+            flight = self._flights.pop(key)
+        flight.set_result(result)
+
+    def do(self, key: Hashable, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        flight, leader = self.lead(key)
+        if not leader:
+            return flight.result()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                del self._flights[key]
+            flight.set_exception(e)
+            raise
+        self.land(key, result)
+        return result
+
+    async def do_async(self, key: Hashable, factory: Callable[[], Awaitable]) -> Any:
+        """The `do` of the coroutines made by `factory`."""
+
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        if (flight := self._async_flights.get(flight_key)) is not None:
+            get_metrics().inc("coalesced_total")
+            # a cancelled follower must not cancel the leader
+            return await asyncio.shield(flight)
+        flight = self._async_flights[flight_key] = loop.create_future()
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            # nobody may be waiting: retrieve it to keep the loop quiet
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._async_flights[flight_key]
+
+
+class FetchCoalescer:
+    """Shares the fetches of the same source between the concurrent callers.
+
+    A fetch in flight is joined rather than repeated, and a successful
+    result is memoized for `ttl` seconds (off by default). The aggregated
+    stats of a source are shared the same way, keyed by the source, the
+    engine and the profiles. The callers get the same object, which must
+    not be modified.
+
+    Args:
+        ttl: float - the seconds a result is memoized, 0 for none
+        max_entries: int - the memoized results kept at most
+    """
+
+    def __init__(self, ttl: float = MEMO_TTL, max_entries: int = MEMO_MAX_ENTRIES):
+        self.memo = TTLMemo(ttl, max_entries)
+        self.flights = SingleFlight()
+        self.stats_memo = TTLMemo(ttl, max_entries)
+        self.stats_flights = SingleFlight()
+
+    @staticmethod
+    def _memoized(memo: TTLMemo, key: Hashable) -> Any:
+        if (value := memo.get(key)) is not MISSING:
+            get_metrics().inc("memo_hits_total")
+        return value
+
+    @staticmethod
+    def _memoize(memo: TTLMemo, key: Hashable, value: Any) -> Any:
+        if value is not None:
+            memo.put(key, value)
+        return value
+
+    def fetch(self, key: Hashable, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        if (value := self._memoized(self.memo, key)) is not MISSING:
+            return value
+        return self.flights.do(
+            key, lambda: self._memoize(self.memo, key, func(*args, **kwargs))
+        )
+
+    async def fetch_async(self, key: Hashable, factory: Callable[[], Awaitable]) -> Any:
+        if (value := self._memoized(self.memo, key)) is not MISSING:
+            return value
+
+        async def fetch() -> Any:
+            return self._memoize(self.memo, key, await factory())
+
+        return await self.flights.do_async(key, fetch)
+
+    def claim_stats(self, key: Hashable) -> tuple[Any, None | Future]:
+        """Returns the memoized stats of the key, or MISSING with the flight.
+
+        The flight is None when the caller leads it: the caller aggregates
+        and must `land_stats`, the others wait for the flight.
+        """
+
+        if (stats := self._memoized(self.stats_memo, key)) is not MISSING:
+            return stats, None
+        flight, leader = self.stats_flights.lead(key)
+        if leader:
+            return MISSING, None
+        return MISSING, flight
+
+    def land_stats(self, key: Hashable, stats: Any) -> None:
+        """Shares the stats of the flight the caller leads (None if failed)."""
+
+        self.stats_flights.land(key, self._memoize(self.stats_memo, key, stats or None))
+
+
+def source_key(city_name: str) -> str:
+    """Returns the URL of the city, the cities of one URL share a fetch.
+
+    An unknown city is its own key, its fetch is left to fail.
+    """
+
+    try:
+        return get_url_by_city_name(city_name)
+    except KeyError:
+        return city_name
+
+
+def group_by_source(cities: Iterable[str]) -> dict[str, list[str]]:
+    """Maps the first city of every URL to all the cities of the URL."""
+
+    leads: dict[str, str] = {}
+    groups: dict[str, list[str]] = {}
+    for city in cities:
+        lead = leads.setdefault(source_key(city), city)
+        groups.setdefault(lead, []).append(city)
+    return groups
+
+
+_coalescer = FetchCoalescer()
+
+
+def get_coalescer() -> FetchCoalescer:
+    return _coalescer
+
+
+def set_coalescer(coalescer: None | FetchCoalescer) -> None:
+    """Makes the fetches share the coalescer (None means no memo)."""
+
+    global _coalescer
+    _coalescer = FetchCoalescer() if coalescer is None else coalescer
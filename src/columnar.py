@@ -0,0 +1,193 @@
+from array import array
+from datetime import date
+from functools import reduce
+from itertools import chain, compress, repeat
+from math import isnan, nan
+from operator import add, itemgetter
+from typing import Any, NamedTuple
+
+from src.types_ import FORECAST
+from src.utils import (
+    CONDITION_MAPPING,
+    DAY_HOURS_END,
+    DAY_HOURS_START,
+    SUITABLE_CONDITIONS,
+)
+
+
+# the interned condition codes, the unknown conditions share the last one
+CONDITION_CODES = {cond: code for code, cond in enumerate(CONDITION_MAPPING)}
+UNKNOWN_CODE = 255
+# the hours out of a byte range fall out of any window
+UNKNOWN_HOUR = 255
+
+# the usual hour values (ints and numeric strings) mapped to their codes
+HOUR_CODES: dict[Any, int] = {
+    **{hour: hour for hour in range(UNKNOWN_HOUR)},
+    **{str(hour): hour for hour in range(UNKNOWN_HOUR)},
+}
+
+# 256-byte lookup tables turning a column into a 0/1 mask with bytes.translate
+WINDOW_TABLE = bytes(
+    int(DAY_HOURS_START <= hour <= DAY_HOURS_END) for hour in range(256)
+)
+SUITABLE_TABLE = bytes(
+    int(code in {CONDITION_CODES[cond] for cond in SUITABLE_CONDITIONS})
+    for code in range(256)
+)
+
+
+class DayColumns(NamedTuple):
+    date_: str
+    hours: bytes
+    temps: array
+    conds: bytes
+
+
+def _hour_code(hour: Any) -> int:
+    hour = int(hour)
+    return hour if 0 <= hour < UNKNOWN_HOUR else UNKNOWN_HOUR
+
+
+def _temp_value(temp: Any) -> float:
+    return nan if temp is None else float(temp)
+
+
+def _hours_column(values: tuple[Any, ...]) -> bytes:
+    try:
+        return bytes(map(HOUR_CODES.__getitem__, values))
+    except KeyError:
+        return bytes(map(_hour_code, values))
+
+
+def _temps_column(values: tuple[Any, ...]) -> array:
+    try:
+        return array("d", map(float, values))
+    except TypeError:
+        return array("d", map(_temp_value, values))
+
+
+def _conds_column(values: tuple[Any, ...]) -> bytes:
+    return bytes(map(CONDITION_CODES.get, values, repeat(UNKNOWN_CODE)))
+
+
+def _day_hours(forecast: FORECAST) -> None | tuple[str, list[FORECAST]]:
+    if not (date_ := forecast.get("date")):
+        return None
+    if not (hours := forecast.get("hours")):
+        return None
+    if isinstance(date_, str):
+        date_ = date.fromisoformat(date_)
+    return date_.isoformat(), hours
+
+
+def _fields(hours: list[FORECAST]) -> tuple[tuple[Any, ...], ...]:
+    """Returns the hour, the temperature and the condition columns."""
+
+    try:
+        hour_values = tuple(map(itemgetter("hour"), hours))
+        temps = tuple(map(itemgetter("temp"), hours))
+        conds = tuple(map(itemgetter("condition"), hours))
+    except KeyError:
+        # the hours without a temperature or a condition
+        hour_values = tuple(hour["hour"] for hour in hours)
+        temps = tuple(hour.get("temp") for hour in hours)
+        conds = tuple(hour.get("condition") for hour in hours)
+    return hour_values, temps, conds
+
+
+def _mask(hours: bytes, conds: bytes) -> bytes:
+    """Returns 1 for the suitable hours in the window, 0 for the others."""
+
+    window = int.from_bytes(hours.translate(WINDOW_TABLE), "big")
+    suitable = int.from_bytes(conds.translate(SUITABLE_TABLE), "big")
+    return (window & suitable).to_bytes(len(hours), "big")
+
+
+def parse_day(forecast: FORECAST) -> None | DayColumns:
+    """Returns the columns of the day or None for a day without data."""
+
+    if (day := _day_hours(forecast)) is None:
+        return None
+    date_, hours = day
+    hour_values, temps, conds = _fields(hours)
+    return DayColumns(
+        date_=date_,
+        hours=_hours_column(hour_values),
+        temps=_temps_column(temps),
+        conds=_conds_column(conds),
+    )
+
+
+def aggregate_day(day: DayColumns) -> dict[str, Any]:
+    """Computes the stats of the day with whole-column operations."""
+
+    mask = _mask(day.hours, day.conds)
+    hours = bytes(compress(day.hours, mask))
+    temps = array("d", compress(day.temps, mask))
+    return day_stats(day.date_, hours, temps)
+
+
+def day_stats(date_: str, hours: bytes, temps: array) -> dict[str, Any]:
+    """Computes the stats of the selected hours and their temperatures."""
+
+    if any(a > b for a, b in zip(hours, hours[1:])):
+        # a stable sort keeps the summation order of the pydantic engine
+        order = sorted(range(len(hours)), key=hours.__getitem__)
+        hours = bytes(hours[i] for i in order)
+        temps = array("d", (temps[i] for i in order))
+
+    start_hour, end_hour, hours_count = None, None, None
+    avg_temp = None
+    rel_cond_hours = len(hours)
+    if rel_cond_hours:
+        start_hour, end_hour = hours[0], hours[-1]
+        hours_count = rel_cond_hours
+        known = [t for t in temps if not isnan(t)]
+        total = reduce(add, known, 0.0) if known else None
+        if total:
+            avg_temp = round(total / rel_cond_hours, 3)
+    return {
+        "date": date_,
+        "hours_start": start_hour,
+        "hours_end": end_hour,
+        "hours_count": hours_count,
+        "temp_avg": avg_temp,
+        "relevant_cond_hours": rel_cond_hours,
+    }
+
+
+def aggregate_forecast_stats_columnar(
+    forecasts: list[FORECAST],
+) -> list[dict[str, Any]]:
+    """Results in analysed forecast data, the same as the pydantic engine.
+
+    The hours of all the days make up one batch of columns: they are
+    selected with one mask, only the selected temperatures are converted
+    and the days are sliced out of the selected columns.
+    """
+
+    days = [day for forecast in forecasts if (day := _day_hours(forecast))]
+    if not days:
+        return []
+    hour_values, temp_values, conds = _fields(
+        list(chain.from_iterable(hours for _, hours in days))
+    )
+    hours = _hours_column(hour_values)
+    mask = _mask(hours, _conds_column(conds))
+    selected_hours = bytes(compress(hours, mask))
+    selected_temps = _temps_column(tuple(compress(temp_values, mask)))
+    results = []
+    start = selected_start = 0
+    for date_, day_hours in days:
+        end = start + len(day_hours)
+        selected_end = selected_start + mask.count(1, start, end)
+        results.append(
+            day_stats(
+                date_,
+                selected_hours[selected_start:selected_end],
+                selected_temps[selected_start:selected_end],
+            )
+        )
+        start, selected_start = end, selected_end
+    return results
@@ -0,0 +1,219 @@
+from array import array
+from datetime import date
+from math import isnan, nan
+from typing import Any, Iterator
+
+from src.columnar import CONDITION_CODES
+from src.types_ import FORECAST, DayInfo, HourInfo, StatsInfo
+from src.utils import DAY_HOURS_END, DAY_HOURS_START, SUITABLE_CONDITIONS_SET
+
+
+# the code -> condition, the inverse of the interned CONDITION_CODES
+CONDITIONS = tuple(CONDITION_CODES)
+
+
+def _to_date(date_: Any) -> Any:
+    return date.fromisoformat(date_) if isinstance(date_, str) else date_
+
+
+class HourRecord:
+    """The slotted counterpart of `HourInfo`."""
+
+    __slots__ = ("hour", "temperature", "condition")
+
+    def __init__(
+        self,
+        hour: None | int = None,
+        temperature: None | int | float = None,
+        condition: None | str = None,
+    ):
+        self.hour = hour
+        self.temperature = temperature
+        self.condition = condition
+
+    def to_model(self) -> HourInfo:
+        return HourInfo(
+            hour=self.hour, temperature=self.temperature, condition=self.condition
+        )
+
+    def to_json(self) -> FORECAST:
+        return {
+            "hour": self.hour,
+            "temp": self.temperature,
+            "cond": self.condition,
+        }
+
+
+class DayRecord:
+    """The counterpart of `DayInfo` with the hours packed into columns.
+
+    An hour is a byte of `hours`, a double of `temps` (NaN for no
+    temperature) and a byte of `conds` holding an interned condition code.
+    """
+
+    __slots__ = ("date_", "hours", "temps", "conds")
+
+    def __init__(self, date_: None | date, hours: bytes, temps: array, conds: bytes):
+        self.date_ = date_
+        self.hours = hours
+        self.temps = temps
+        self.conds = conds
+
+    def __len__(self) -> int:
+        return len(self.hours)
+
+    def records(self) -> Iterator[HourRecord]:
+        for hour, temp, code in zip(self.hours, self.temps, self.conds):
+            yield HourRecord(hour, None if isnan(temp) else temp, CONDITIONS[code])
+
+    def validate(self) -> None:
+        """Raises ValueError unless the columns make up the same hours."""
+
+        if not len(self.hours) == len(self.temps) == len(self.conds):
+            raise ValueError(f"the columns of the day {self.date_} differ in length")
+        if max(self.conds, default=0) >= len(CONDITIONS):
+            raise ValueError(f"an unknown condition code in the day {self.date_}")
+
+    def to_model(self) -> DayInfo:
+        return DayInfo(
+            date_=self.date_, hours=[hour.to_model() for hour in self.records()]
+        )
+
+    def to_json(self) -> FORECAST:
+        return {
+            "date": self.date_,
+            "hours": [hour.to_json() for hour in self.records()],
+        }
+
+    def stats(self) -> "StatsRecord":
+        """Computes the stats the way `aggregate_forecast_stats` does."""
+
+        hours, temps = self.hours, self.temps
+        if not hours:
+            return StatsRecord(self.date_)
+        if any(a > b for a, b in zip(hours, hours[1:])):
+            # a stable sort keeps the summation order
+            order = sorted(range(len(hours)), key=hours.__getitem__)
+            hours = bytes(hours[i] for i in order)
+            temps = array("d", (temps[i] for i in order))
+        count = len(hours)
+        temp, all_none = 0.0, True
+        for t in temps:
+            if not isnan(t):
+                all_none = False
+                temp += t
+        temp_avg = None
+        if not all_none and temp:
+            temp_avg = temp / count
+            if temp_avg:
+                temp_avg = round(temp_avg, 3)
+        return StatsRecord(self.date_, hours[0], hours[-1], count, temp_avg, count)
+
+
+class StatsRecord:
+    """The slotted counterpart of `StatsInfo`, validated on demand only."""
+
+    __slots__ = (
+        "date_",
+        "hours_start",
+        "hours_end",
+        "hours_count",
+        "temp_avg",
+        "relevant_cond_hours",
+    )
+
+    def __init__(
+        self,
+        date_: None | date = None,
+        hours_start: None | int = None,
+        hours_end: None | int = None,
+        hours_count: None | int = None,
+        temp_avg: None | float = None,
+        relevant_cond_hours: int = 0,
+    ):
+        self.date_ = date_
+        self.hours_start = hours_start
+        self.hours_end = hours_end
+        self.hours_count = hours_count
+        self.temp_avg = temp_avg
+        self.relevant_cond_hours = relevant_cond_hours
+
+    def validate(self) -> None:
+        """Raises ValueError where `StatsInfo` would not validate."""
+
+        for name in ("hours_start", "hours_end", "hours_count", "relevant_cond_hours"):
+            value = getattr(self, name)
+            if value is not None and value < 0:
+                raise ValueError(f"{name}={value} is negative")
+        hs, he, hc = self.hours_start, self.hours_end, self.hours_count
+        if (hs is None) and (he is None) and (hc is None):
+            return
+        if hs is None or he is None or hs > he:
+            raise ValueError(f"hours_end={he} < hours_start={hs}")
+        if he and not hc:
+            raise ValueError(f"hours_count={hc} is zero with non-zero hours")
+
+    def to_model(self) -> StatsInfo:
+        return StatsInfo(
+            date_=self.date_,
+            hours_start=self.hours_start,
+            hours_end=self.hours_end,
+            hours_count=self.hours_count,
+            temp_avg=self.temp_avg,
+            relevant_cond_hours=self.relevant_cond_hours,
+        )
+
+    def to_json(self) -> FORECAST:
+        return {
+            "date": self.date_.isoformat() if self.date_ else None,
+            "hours_start": self.hours_start,
+            "hours_end": self.hours_end,
+            "hours_count": self.hours_count,
+            "temp_avg": self.temp_avg,
+            "relevant_cond_hours": self.relevant_cond_hours,
+        }
+
+
+def select_day_record(forecast: FORECAST) -> None | DayRecord:
+    """Returns the suitable hours of the day like `select_forecast_days`."""
+
+    if not (date_ := forecast.get("date")):
+        return None
+    if not (hours := forecast.get("hours")):
+        return None
+    selected, temps, conds = bytearray(), array("d"), bytearray()
+    for hour_forecast in hours:
+        hour = int(hour_forecast["hour"])
+        if DAY_HOURS_START <= hour <= DAY_HOURS_END:
+            cond = hour_forecast["condition"]
+            if cond in SUITABLE_CONDITIONS_SET:
+                temp = hour_forecast["temp"]
+                selected.append(hour)
+                temps.append(nan if temp is None else float(temp))
+                conds.append(CONDITION_CODES[cond])
+    return DayRecord(_to_date(date_), bytes(selected), temps, bytes(conds))
+
+
+def aggregate_forecast_stats_compact(
+    forecasts: list[FORECAST], validate: bool = True
+) -> list[dict[str, Any]]:
+    """Results in the same analysed data as `aggregate_forecast_stats`.
+
+    Args:
+        forecasts: list[FORECAST] - the forecasts of a city
+        validate: bool - check the days and the stats at the edges
+
+    Returns:
+        the stats of the days
+    """
+
+    results: list[dict[str, Any]] = []
+    for forecast in forecasts:
+        if (day := select_day_record(forecast)) is None:
+            continue
+        stats = day.stats()
+        if validate:
+            day.validate()
+            stats.validate()
+        results.append(stats.to_json())
+    return results
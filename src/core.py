@@ -1,42 +1,525 @@
-from typing import Any
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from typing import Any, Awaitable, Callable
+
+import asyncio
+import json
+import threading
+import time
 
 import httpx
 
+from src.cache import CacheEntry, ResponseCache
+from src.columnar import aggregate_forecast_stats_columnar
+from src.compact import aggregate_forecast_stats_compact
 from src.exceptions import YandexWeatherAPIError
+from src.metrics import get_metrics, Metrics
+from src.resilience import get_fetch_policy, is_retryable, FetchPolicy
+from src.streaming import parse_forecasts_streaming, ForecastStreamParser
 from src.types_ import FORECAST, HourInfo, DayInfo, StatsInfo
-from src.utils import get_url_by_city_name, FETCH_TIMEOUT, SUITABLE_CONDITIONS
+from src.utils import (
+    get_url_by_city_name,
+    DAY_HOURS_END,
+    DAY_HOURS_START,
+    FETCH_TIMEOUT,
+    KEEPALIVE_EXPIRY,
+    MAX_CONNECTIONS,
+    MAX_KEEPALIVE_CONNECTIONS,
+    SUITABLE_CONDITIONS_SET,
+)
 
 
 httpx_client = httpx.Client()
+# runs the sync requests which may be hedged
+_hedge_pool = ThreadPoolExecutor(
+    max_workers=MAX_CONNECTIONS, thread_name_prefix="hedge"
+)
 
 
-def fetch_forecasts(
-    city: str, timeout: None | float = FETCH_TIMEOUT
-) -> None | list[FORECAST]:
-    """Returns the forecasts for the city.
+def make_async_client(
+    max_connections: None | int = MAX_CONNECTIONS,
+    max_keepalive_connections: None | int = MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry: None | float = KEEPALIVE_EXPIRY,
+) -> httpx.AsyncClient:
+    """Returns an asynchronous client with a bounded connection pool.
 
     Args:
-        city: str - the name of the city
-        timeout: None | float - the timeout for the request
+        max_connections: None | int - the pool size (None means unlimited)
+        max_keepalive_connections: None | int - idle connections to keep
+        keepalive_expiry: None | float - the idle connection lifetime
 
     Returns:
-        the forecasts for URL mapped to the city name
+        the client to be shared between the coroutines
     """
 
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return httpx.AsyncClient(limits=limits)
+
+
+class ResidentClient:
+    """An event loop in its own thread with a client bound to it.
+
+    The async runs of a long-lived process submit their coroutines here,
+    so they keep the connections of the one client between the runs.
+
+    Args:
+        max_connections: None | int - the pool size (None means unlimited)
+    """
+
+    def __init__(self, max_connections: None | int = MAX_CONNECTIONS):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="resident-loop", daemon=True
+        )
+        self._thread.start()
+        self.client: httpx.AsyncClient = self.run(self._make_client(max_connections))
+
+    @staticmethod
+    async def _make_client(max_connections: None | int) -> httpx.AsyncClient:
+        return make_async_client(max_connections=max_connections)
+
+    def run(self, coro: Awaitable) -> Any:
+        """Runs the coroutine in the loop, returns its result."""
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self) -> None:
+        self.run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def _resolve_url(city: str) -> str:
     try:
-        url = get_url_by_city_name(city)
+        return get_url_by_city_name(city)
     except KeyError as e:
         raise YandexWeatherAPIError from e
 
-    response = httpx_client.get(url=url, timeout=timeout)
+
+def _extract_body(
+    url: str,
+    response: httpx.Response,
+    cache: None | ResponseCache = None,
+    entry: None | CacheEntry = None,
+) -> bytes:
+    body = response.content
+    if cache is not None:
+        body = cache.resolve(url, entry, response)
+        if response.status_code == httpx.codes.NOT_MODIFIED and entry is not None:
+            return body
     if (status := response.status_code) != httpx.codes.OK:
         msg = f"The request for {url!r} has failed: " f"status={status} is not OK"
         raise YandexWeatherAPIError(msg)
 
-    result = response.json()
+    return body
+
+
+def parse_forecasts(body: bytes) -> None | list[FORECAST]:
+    """Returns the forecasts from the raw response body."""
+
+    with get_metrics().stage("decode"):
+        result = json.loads(body)
     return result["forecasts"] if result else None
 
 
+class _PhaseTrace:
+    """Observes the connection phases of a request via the httpx trace hook."""
+
+    # the httpcore events: DNS + TCP connect, TLS, waiting for the headers
+    PHASES = {
+        "connection.connect_tcp": "connect",
+        "connection.start_tls": "tls",
+        "http11.receive_response_headers": "ttfb",
+        "http2.receive_response_headers": "ttfb",
+    }
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self.started: dict[str, float] = {}
+
+    def __call__(self, event: str, info: dict[str, Any]) -> None:
+        name, _, status = event.rpartition(".")
+        if (phase := self.PHASES.get(name)) is None:
+            return
+        if status == "started":
+            self.started[phase] = time.perf_counter()
+        elif status == "complete" and phase in self.started:
+            elapsed = time.perf_counter() - self.started.pop(phase)
+            self.metrics.observe("http_phase_seconds", elapsed, phase=phase)
+
+    async def atrace(self, event: str, info: dict[str, Any]) -> None:
+        self(event, info)
+
+
+def _trace_extensions(metrics: Metrics, is_async: bool = False) -> dict[str, Any]:
+    if not metrics.enabled:
+        return {}
+    trace = _PhaseTrace(metrics)
+    return {"trace": trace.atrace if is_async else trace}
+
+
+def _timed(policy: FetchPolicy, get: Callable[[], httpx.Response]) -> httpx.Response:
+    start = time.perf_counter()
+    response = get()
+    if response.status_code == httpx.codes.OK:
+        policy.latencies.observe(time.perf_counter() - start)
+    return response
+
+
+def _close_response(future: Future) -> None:
+    if future.exception() is None:
+        future.result().close()
+
+
+def _first_response(futures: list[Future]) -> httpx.Response:
+    error: None | BaseException = None
+    for future in as_completed(futures):
+        if (error := future.exception()) is None:
+            for other in futures:
+                if other is not future:
+                    other.add_done_callback(_close_response)
+            return future.result()
+    raise error  # type: ignore[misc]
+
+
+def _hedged_get(
+    policy: FetchPolicy, get: Callable[[], httpx.Response]
+) -> httpx.Response:
+    if (delay := policy.hedge_delay()) is None:
+        return _timed(policy, get)
+    first = _hedge_pool.submit(_timed, policy, get)
+    if wait([first], timeout=delay).done:
+        return first.result()
+    get_metrics().inc("hedged_requests_total")
+    # the loser cannot be interrupted, it completes in the background
+    return _first_response([first, _hedge_pool.submit(_timed, policy, get)])
+
+
+def _request(
+    url: str, headers: dict[str, str], timeout: None | float, stream: bool = False
+) -> httpx.Response:
+    """Sends the request as the fetch policy says: retried, hedged, bounded.
+
+    With `stream`, the body of the returned response is not read yet.
+    """
+
+    policy = get_fetch_policy()
+    metrics = get_metrics()
+    host = httpx.URL(url).host
+    response, error = None, None
+    for attempt in range(policy.retries + 1):
+        if attempt:
+            metrics.inc("fetch_retries_total")
+            if response is not None:
+                response.close()
+            time.sleep(policy.backoff(attempt - 1))
+        policy.check(host)
+        request = httpx_client.build_request(
+            "GET",
+            url=url,
+            timeout=policy.timeout(timeout),
+            headers=headers,
+            extensions=_trace_extensions(metrics),
+        )
+
+        def get() -> httpx.Response:
+            return httpx_client.send(request, stream=stream)
+
+        try:
+            with metrics.stage("fetch"):
+                response = _hedged_get(policy, get)
+        except httpx.TransportError as e:
+            response, error = None, e
+        else:
+            if not is_retryable(response.status_code):
+                policy.record(host, ok=True)
+                return response
+        policy.record(host, ok=False)
+    if response is None:
+        raise YandexWeatherAPIError(f"The request for {url!r} has failed: {error!r}")
+    return response
+
+
+async def _timed_async(
+    policy: FetchPolicy, get: Callable[[], Awaitable[httpx.Response]]
+) -> httpx.Response:
+    start = time.perf_counter()
+    response = await get()
+    if response.status_code == httpx.codes.OK:
+        policy.latencies.observe(time.perf_counter() - start)
+    return response
+
+
+async def _hedged_get_async(
+    policy: FetchPolicy, get: Callable[[], Awaitable[httpx.Response]]
+) -> httpx.Response:
+    if (delay := policy.hedge_delay()) is None:
+        return await _timed_async(policy, get)
+    first = asyncio.ensure_future(_timed_async(policy, get))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+    get_metrics().inc("hedged_requests_total")
+    pending = {first, asyncio.ensure_future(_timed_async(policy, get))}
+    error: None | BaseException = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if (error := task.exception()) is None:
+                    for other in pending:
+                        other.cancel()
+                    for other in done - {task}:
+                        if other.exception() is None:
+                            await other.result().aclose()
+                    return task.result()
+        raise error  # type: ignore[misc]
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _request_async(
+    client: httpx.AsyncClient,
+    url: str,
+    headers: dict[str, str],
+    timeout: None | float,
+    stream: bool = False,
+) -> httpx.Response:
+    """The asynchronous `_request`, a losing hedged request is cancelled."""
+
+    policy = get_fetch_policy()
+    metrics = get_metrics()
+    host = httpx.URL(url).host
+    response, error = None, None
+    for attempt in range(policy.retries + 1):
+        if attempt:
+            metrics.inc("fetch_retries_total")
+            if response is not None:
+                await response.aclose()
+            await asyncio.sleep(policy.backoff(attempt - 1))
+        policy.check(host)
+        request = client.build_request(
+            "GET",
+            url=url,
+            timeout=policy.timeout(timeout),
+            headers=headers,
+            extensions=_trace_extensions(metrics, is_async=True),
+        )
+
+        def get() -> Awaitable[httpx.Response]:
+            return client.send(request, stream=stream)
+
+        try:
+            # the coroutines interleave in one thread, so they are timed only
+            with metrics.timer("stage_seconds", stage="fetch"):
+                response = await _hedged_get_async(policy, get)
+        except httpx.TransportError as e:
+            response, error = None, e
+        else:
+            if not is_retryable(response.status_code):
+                policy.record(host, ok=True)
+                return response
+        policy.record(host, ok=False)
+    if response is None:
+        raise YandexWeatherAPIError(f"The request for {url!r} has failed: {error!r}")
+    return response
+
+
+def fetch_forecasts_raw(
+    city: str,
+    timeout: None | float = FETCH_TIMEOUT,
+    cache: None | ResponseCache = None,
+) -> bytes:
+    """Returns the undecoded response body with the forecasts for the city.
+
+    Args:
+        city: str - the name of the city
+        timeout: None | float - the timeout for the request
+        cache: None | ResponseCache - the response cache to consult
+
+    Returns:
+        the body to be parsed with `parse_forecasts`
+    """
+
+    url = _resolve_url(city)
+    entry = None
+    if cache is not None:
+        body, entry = cache.get_fresh(url)
+        if body is not None:
+            return body
+    headers = ResponseCache.conditional_headers(entry)
+    response = _request(url, headers, timeout)
+    return _extract_body(url, response, cache, entry)
+
+
+def fetch_forecasts(
+    city: str,
+    timeout: None | float = FETCH_TIMEOUT,
+    cache: None | ResponseCache = None,
+) -> None | list[FORECAST]:
+    """Returns the forecasts for the city.
+
+    Args:
+        city: str - the name of the city
+        timeout: None | float - the timeout for the request
+        cache: None | ResponseCache - the response cache to consult
+
+    Returns:
+        the forecasts for URL mapped to the city name
+    """
+
+    return parse_forecasts(fetch_forecasts_raw(city, timeout=timeout, cache=cache))
+
+
+async def fetch_forecasts_raw_async(
+    city: str,
+    client: httpx.AsyncClient,
+    timeout: None | float = FETCH_TIMEOUT,
+    cache: None | ResponseCache = None,
+) -> bytes:
+    """Returns the undecoded response body without blocking the event loop.
+
+    Args:
+        city: str - the name of the city
+        client: httpx.AsyncClient - the shared (pooled) client
+        timeout: None | float - the timeout for the request
+        cache: None | ResponseCache - the response cache to consult
+
+    Returns:
+        the body to be parsed with `parse_forecasts`
+    """
+
+    url = _resolve_url(city)
+    entry = None
+    if cache is not None:
+        body, entry = cache.get_fresh(url)
+        if body is not None:
+            return body
+    headers = ResponseCache.conditional_headers(entry)
+    response = await _request_async(client, url, headers, timeout)
+    return _extract_body(url, response, cache, entry)
+
+
+async def fetch_forecasts_async(
+    city: str,
+    client: httpx.AsyncClient,
+    timeout: None | float = FETCH_TIMEOUT,
+    cache: None | ResponseCache = None,
+) -> None | list[FORECAST]:
+    """Returns the forecasts for the city without blocking the event loop.
+
+    Args:
+        city: str - the name of the city
+        client: httpx.AsyncClient - the shared (pooled) client
+        timeout: None | float - the timeout for the request
+        cache: None | ResponseCache - the response cache to consult
+
+    Returns:
+        the forecasts for URL mapped to the city name
+    """
+
+    body = await fetch_forecasts_raw_async(
+        city, client=client, timeout=timeout, cache=cache
+    )
+    return parse_forecasts(body)
+
+
+def fetch_forecasts_streaming(
+    city: str,
+    timeout: None | float = FETCH_TIMEOUT,
+    cache: None | ResponseCache = None,
+) -> None | list[FORECAST]:
+    """Returns the forecasts for the city decoded while the body downloads.
+
+    Only the fields the aggregation reads are kept, see `ForecastStreamParser`.
+
+    Args:
+        city: str - the name of the city
+        timeout: None | float - the timeout for the request
+        cache: None | ResponseCache - the response cache to consult
+
+    Returns:
+        the trimmed forecasts for URL mapped to the city name
+    """
+
+    url = _resolve_url(city)
+    entry = None
+    if cache is not None:
+        body, entry = cache.get_fresh(url)
+        if body is not None:
+            return parse_forecasts_streaming(body)
+    headers = ResponseCache.conditional_headers(entry)
+    response = _request(url, headers, timeout, stream=True)
+    try:
+        if response.status_code != httpx.codes.OK:
+            response.read()
+            body = _extract_body(url, response, cache, entry)
+            return parse_forecasts_streaming(body)
+        parser = ForecastStreamParser()
+        chunks: list[bytes] = []
+        for chunk in response.iter_bytes():
+            parser.feed(chunk)
+            if cache is not None:
+                # the cache keeps the whole body anyway
+                chunks.append(chunk)
+        if cache is not None:
+            cache.resolve(url, entry, response, b"".join(chunks))
+        return parser.close()
+    finally:
+        response.close()
+
+
+async def fetch_forecasts_streaming_async(
+    city: str,
+    client: httpx.AsyncClient,
+    timeout: None | float = FETCH_TIMEOUT,
+    cache: None | ResponseCache = None,
+) -> None | list[FORECAST]:
+    """The asynchronous `fetch_forecasts_streaming`.
+
+    Args:
+        city: str - the name of the city
+        client: httpx.AsyncClient - the shared (pooled) client
+        timeout: None | float - the timeout for the request
+        cache: None | ResponseCache - the response cache to consult
+
+    Returns:
+        the trimmed forecasts for URL mapped to the city name
+    """
+
+    url = _resolve_url(city)
+    entry = None
+    if cache is not None:
+        body, entry = cache.get_fresh(url)
+        if body is not None:
+            return parse_forecasts_streaming(body)
+    headers = ResponseCache.conditional_headers(entry)
+    response = await _request_async(client, url, headers, timeout, stream=True)
+    try:
+        if response.status_code != httpx.codes.OK:
+            await response.aread()
+            body = _extract_body(url, response, cache, entry)
+            return parse_forecasts_streaming(body)
+        parser = ForecastStreamParser()
+        chunks: list[bytes] = []
+        async for chunk in response.aiter_bytes():
+            parser.feed(chunk)
+            if cache is not None:
+                chunks.append(chunk)
+        if cache is not None:
+            cache.resolve(url, entry, response, b"".join(chunks))
+        return parser.close()
+    finally:
+        await response.aclose()
+
+
 def select_forecast_days(forecasts: list[FORECAST]) -> list[DayInfo]:
     """Extracts the data for the further analysis.
 
@@ -52,9 +535,9 @@ def select_forecast_days(forecasts: list[FORECAST]) -> list[DayInfo]:
         hours_info: list[HourInfo] = []
         for hour_forecast in hours:
             hour = int(hour_forecast["hour"])
-            if 9 <= hour <= 19:
+            if DAY_HOURS_START <= hour <= DAY_HOURS_END:
                 cond = hour_forecast["condition"]
-                if cond in SUITABLE_CONDITIONS:
+                if cond in SUITABLE_CONDITIONS_SET:
                     temp = hour_forecast["temp"]
                     if temp is not None:
                         temp = float(temp)
@@ -105,3 +588,10 @@ def aggregate_forecast_stats(forecasts: list[FORECAST]) -> list[dict[str, Any]]:
             ).to_json()
         )
     return results
+
+
+AGGREGATORS: dict[str, Callable[[list[FORECAST]], list[dict[str, Any]]]] = {
+    "pydantic": aggregate_forecast_stats,
+    "columnar": aggregate_forecast_stats_columnar,
+    "compact": aggregate_forecast_stats_compact,
+}
@@ -0,0 +1,281 @@
+"""The resident mode: the pools, the connections and the results stay warm.
+
+The daemon answers over HTTP on a TCP or a Unix socket:
+
+    GET /health
+    GET /aggregate?city=moscow&city=paris
+    GET /rank?city=moscow&city=paris&top=3&weights=1,10&tie_break=name
+
+The analysed results are kept for `max_age` seconds and the known cities
+are refreshed in the background, so most queries do no fetching at all.
+"""
+
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterable
+from urllib.parse import parse_qs, urlsplit
+
+from src.cache import ResponseCache
+from src.cluster import parse_address
+from src.coalesce import SingleFlight
+from src.core import ResidentClient
+from src.exceptions import TaskError
+from src.profiles import ProfileSet
+from src.ranking import CityRanker
+from src.scheduler import PoolScheduler, get_scheduler
+from src.tasks import aggregate_cities_task, rank_cities_task
+from src.utils import (
+    DAEMON_REFRESH,
+    FETCH_CONCURRENCY,
+    check_python_version,
+    get_canonical_city_name,
+)
+
+
+UNIX_PREFIX = "unix:"
+
+
+class WeatherDaemon:
+    """Serves the analysed cities from memory, refetching the stale ones.
+
+    Args:
+        cities: Iterable[str] - the cities to refresh in the background
+        refresh: None | float - the seconds between the background
+            refreshes, None for none
+        max_age: None | float - how long a result is served without
+            refetching, the refresh interval by default
+        mode, concurrency, cache, engine, chunk_size, raw, streaming,
+        profiles, scheduler - see `main_task`
+
+    Every update leases the pools of the scheduler, the async updates share
+    one client kept open as long as the daemon.
+    """
+
+    def __init__(
+        self,
+        cities: Iterable[str] = (),
+        refresh: None | float = DAEMON_REFRESH,
+        max_age: None | float = None,
+        mode: str = "threads",
+        concurrency: int = FETCH_CONCURRENCY,
+        cache: None | ResponseCache = None,
+        engine: str = "pydantic",
+        chunk_size: None | int = None,
+        raw: bool = False,
+        streaming: bool = False,
+        profiles: None | ProfileSet = None,
+        scheduler: None | PoolScheduler = None,
+    ):
+        self.cities = sorted(set(map(get_canonical_city_name, cities)))
+        self.refresh = refresh
+        self.max_age = refresh if max_age is None else max_age
+        self.options = dict(
+            mode=mode,
+            concurrency=concurrency,
+            cache=cache,
+            engine=engine,
+            chunk_size=chunk_size,
+            raw=raw,
+            streaming=streaming,
+            profiles=profiles,
+        )
+        self.scheduler = get_scheduler() if scheduler is None else scheduler
+        self.refreshed_at: None | float = None
+        self._results: dict[str, tuple[float, dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._started = False
+        self._resident: None | ResidentClient = None
+        # the concurrent queries of the same stale cities share an update
+        self._updates = SingleFlight()
+        self._refresher: None | threading.Thread = None
+
+    def start(self) -> None:
+        check_python_version()
+        if self.options["mode"] == "async":
+            self._resident = ResidentClient()
+        self._started = True
+        if self.refresh is not None and self.cities:
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, name="daemon-refresh", daemon=True
+            )
+            self._refresher.start()
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._refresher is not None:
+            self._refresher.join()
+        self._started = False
+        if self._resident is not None:
+            self._resident.close()
+            self._resident = None
+
+    def __enter__(self) -> "WeatherDaemon":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _refresh_loop(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.update(self.cities)
+                self.refreshed_at = time.time()
+                logging.info(f"Refreshed {len(self.cities)} cities")
+            except Exception as e:
+                logging.error(f"Cannot refresh the cities: {e}")
+            self._stopped.wait(self.refresh)
+
+    def update(self, cities: Iterable[str]) -> None:
+        """Fetches and aggregates the cities anew."""
+
+        if not self._started:
+            raise TaskError("the daemon is not started")
+        cities = list(cities)
+
+        def on_result(city: str, result: dict[str, Any]) -> None:
+            with self._lock:
+                self._results[city] = (time.monotonic(), result)
+
+        with self.scheduler.run(len(cities)) as (executor, thread_pool):
+            aggregate_cities_task(
+                executor,
+                cities,
+                on_result,
+                thread_pool=thread_pool,
+                resident=self._resident,
+                **self.options,
+            )
+
+    def results(self, city_names: Iterable[str] = ()) -> dict[str, dict[str, Any]]:
+        """Returns the analysed cities, all of the known ones by default."""
+
+        cities = sorted(set(map(get_canonical_city_name, city_names)))
+        if not cities:
+            with self._lock:
+                return {city: result for city, (_, result) in self._results.items()}
+        if stale := [city for city in cities if self._get(city) is None]:
+            self._updates.do(tuple(stale), self.update, stale)
+        results = {city: self._get(city) for city in cities}
+        return {city: result for city, result in results.items() if result}
+
+    def _get(self, city: str) -> None | dict[str, Any]:
+        with self._lock:
+            if (entry := self._results.get(city)) is None:
+                return None
+        updated_at, result = entry
+        if self.max_age is not None and time.monotonic() - updated_at > self.max_age:
+            return None
+        return result
+
+    def rank(
+        self, city_names: Iterable[str] = (), ranker: None | CityRanker = None
+    ) -> dict[str, Any]:
+        ranker = rank_cities_task(self.results(city_names), ranker)
+        return {"best": ranker.best(), "top": ranker.top(), "ratings": ranker.ratings()}
+
+    def health(self) -> dict[str, Any]:
+        with self._lock:
+            cached = len(self._results)
+        return {"status": "ok", "cities": cached, "refreshed_at": self.refreshed_at}
+
+
+def _ranker(query: dict[str, list[str]]) -> CityRanker:
+    try:
+        top = int(query["top"][0]) if "top" in query else None
+        weights = None
+        if "weights" in query:
+            w_temp, w_hours = map(float, query["weights"][0].split(","))
+            weights = (w_temp, w_hours)
+    except ValueError as e:
+        raise TaskError(f"a malformed query: {e}") from None
+    tie_break = query.get("tie_break", ["ties"])[0]
+    return CityRanker(k=top, weights=weights, tie_break=tie_break)
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    server: "DaemonServer"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        daemon = self.server.daemon
+        try:
+            if url.path == "/health":
+                reply = daemon.health()
+            elif url.path == "/aggregate":
+                reply = daemon.results(query.get("city", ()))
+            elif url.path == "/rank":
+                reply = daemon.rank(query.get("city", ()), _ranker(query))
+            else:
+                self._reply(HTTPStatus.NOT_FOUND, {"error": f"no {url.path!r}"})
+                return
+        except TaskError as e:
+            self._reply(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+        except Exception as e:
+            # the client gets an answer whatever has failed
+            logging.exception(f"Cannot answer {self.path!r}")
+            self._reply(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": repr(e)})
+            return
+        self._reply(HTTPStatus.OK, reply)
+
+    def _reply(self, status: HTTPStatus, reply: Any) -> None:
+        body = json.dumps(reply).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # a Unix socket peer has no address
+        return str(self.client_address[0]) if self.client_address else UNIX_PREFIX
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+class DaemonServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], daemon: WeatherDaemon):
+        super().__init__(address, DaemonRequestHandler)
+        self.daemon = daemon
+
+
+class UnixDaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, daemon: WeatherDaemon):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, DaemonRequestHandler)
+        self.daemon = daemon
+
+
+def make_server(address: str, daemon: WeatherDaemon) -> DaemonServer | UnixDaemonServer:
+    """Returns the server of "HOST:PORT" or "unix:PATH"."""
+
+    if address.startswith(UNIX_PREFIX):
+        return UnixDaemonServer(address.removeprefix(UNIX_PREFIX), daemon)
+    return DaemonServer(parse_address(address), daemon)
+
+
+def serve_daemon(address: str, daemon: WeatherDaemon) -> None:
+    """Serves the daemon at the address until interrupted."""
+
+    with daemon, make_server(address, daemon) as server:
+        logging.info(f"Serving at {address}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info("Stopped")
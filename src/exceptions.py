@@ -4,3 +4,15 @@ class TaskError(Exception):
 
 class YandexWeatherAPIError(Exception):
     """Yandex Weather HTTP Request Error."""
+
+
+class CircuitOpenError(YandexWeatherAPIError):
+    """The host is considered down, the request was not sent."""
+
+
+class DeadlineExceededError(YandexWeatherAPIError):
+    """The run deadline has expired, the request was not sent."""
+
+
+class RegistryError(Exception):
+    """City Registry Loading Error."""
@@ -0,0 +1,297 @@
+"""The append-only history of the analysed days.
+
+    python -m src.history DIR [--city NAME ...] [--start DATE] [--end DATE]
+
+prints the per-city averages over the stored days.
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import sys
+import threading
+import time
+from array import array
+from datetime import date
+from pathlib import Path
+from typing import Any, Iterable, Iterator, NamedTuple
+
+from src.writers import NULL_INT
+
+
+# the fixed-width columns: (name, array typecode), one file per column
+HISTORY_COLUMNS = (
+    ("city", "i"),
+    ("date", "i"),
+    ("recorded_at", "d"),
+    ("hours_start", "h"),
+    ("hours_end", "h"),
+    ("hours_count", "h"),
+    ("temp_avg", "d"),
+    ("relevant_cond_hours", "h"),
+)
+CITIES_FILE = "cities.txt"
+
+
+class HistoryRow(NamedTuple):
+    city: str
+    date: date
+    recorded_at: float
+    hours_start: None | int
+    hours_end: None | int
+    hours_count: None | int
+    temp_avg: None | float
+    relevant_cond_hours: None | int
+
+
+def _column_path(directory: Path, name: str) -> Path:
+    return directory / f"{name}.col"
+
+
+def _null(typecode: str, value: Any) -> Any:
+    if typecode == "d":
+        return None if math.isnan(value) else value
+    return None if value == NULL_INT else value
+
+
+class _MappedColumn:
+    """A column file mapped read-only, its items are read in place."""
+
+    def __init__(self, path: Path, typecode: str, rows: int):
+        self._mmap: None | mmap.mmap = None
+        self._view: None | memoryview = None
+        size = rows * array(typecode).itemsize
+        if not size:
+            self.values: Any = array(typecode)
+            return
+        with open(path, "rb") as fin:
+            self._mmap = mmap.mmap(fin.fileno(), size, access=mmap.ACCESS_READ)
+        if sys.byteorder == "little":
+            self._view = memoryview(self._mmap).cast(typecode)
+            self.values = self._view
+        else:
+            # the files are little-endian, a big-endian host reads a copy
+            self.values = array(typecode, self._mmap)
+            self.values.byteswap()
+
+    def close(self) -> None:
+        if self._view is not None:
+            self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+
+class HistoryStore:
+    """Keeps the analysed days of every run in fixed-width column files.
+
+    The rows are only ever appended and the columns are memory-mapped,
+    so a query reads the numbers in place instead of building the rows.
+    The index maps a city to the latest row of each of its dates: a day
+    analysed again by a later run supersedes the earlier row.
+
+    Args:
+        directory: str | os.PathLike - the directory of the column files
+    """
+
+    def __init__(self, directory: str | os.PathLike):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._cities: list[str] = []
+        self._city_ids: dict[str, int] = {}
+        cities_path = self.directory / CITIES_FILE
+        if cities_path.exists():
+            self._cities = cities_path.read_text(encoding="utf-8").splitlines()
+            self._city_ids = {city: i for i, city in enumerate(self._cities)}
+        self._columns: dict[str, _MappedColumn] = {}
+        self._index: dict[int, dict[int, int]] = {}
+        self._rows = 0
+        self._map()
+
+    def _stored_rows(self) -> int:
+        # a column left shorter by an interrupted append bounds them all
+        rows = []
+        for name, typecode in HISTORY_COLUMNS:
+            path = _column_path(self.directory, name)
+            size = path.stat().st_size if path.exists() else 0
+            rows.append(size // array(typecode).itemsize)
+        return min(rows)
+
+    def _map(self) -> None:
+        rows = self._stored_rows()
+        # the previous maps are released with the last scan reading them
+        self._columns = {
+            name: _MappedColumn(_column_path(self.directory, name), typecode, rows)
+            for name, typecode in HISTORY_COLUMNS
+        }
+        cities, dates = self._columns["city"].values, self._columns["date"].values
+        for row in range(self._rows, rows):
+            self._index.setdefault(cities[row], {})[dates[row]] = row
+        self._rows = rows
+
+    def __len__(self) -> int:
+        """Returns the number of the stored rows, the superseded ones too."""
+
+        return self._rows
+
+    def cities(self) -> list[str]:
+        return sorted(self._cities[city_id] for city_id in self._index)
+
+    def append(
+        self,
+        results: dict[str, dict[str, Any]],
+        recorded_at: None | float = None,
+    ) -> int:
+        """Appends the days of the results in the `main_task` format.
+
+        Returns:
+            the number of the appended rows
+        """
+
+        recorded_at = time.time() if recorded_at is None else recorded_at
+        columns = {name: array(typecode) for name, typecode in HISTORY_COLUMNS}
+        with self._lock:
+            new_cities = []
+            for city, result in results.items():
+                for day in result.get("days") or ():
+                    if not day.get("date"):
+                        continue
+                    if (city_id := self._city_ids.get(city)) is None:
+                        city_id = self._city_ids[city] = len(self._cities)
+                        self._cities.append(city)
+                        new_cities.append(city)
+                    columns["city"].append(city_id)
+                    columns["date"].append(date.fromisoformat(day["date"]).toordinal())
+                    columns["recorded_at"].append(recorded_at)
+                    for name, typecode in HISTORY_COLUMNS[3:]:
+                        value = day.get(name)
+                        if value is None:
+                            value = math.nan if typecode == "d" else NULL_INT
+                        columns[name].append(value)
+            if new_cities:
+                with open(self.directory / CITIES_FILE, "a", encoding="utf-8") as fout:
+                    fout.writelines(f"{city}\n" for city in new_cities)
+            rows = self._stored_rows()
+            for name, column in columns.items():
+                if sys.byteorder == "big":
+                    column.byteswap()
+                path = _column_path(self.directory, name)
+                with open(path, "r+b" if path.exists() else "wb") as fout:
+                    # drop the tail of an interrupted append
+                    fout.truncate(rows * column.itemsize)
+                    fout.seek(0, os.SEEK_END)
+                    fout.write(column.tobytes())
+            self._map()
+        return len(columns["city"])
+
+    def _positions(
+        self,
+        start: None | date,
+        end: None | date,
+        cities: None | Iterable[str],
+    ) -> tuple[dict[str, _MappedColumn], list[tuple[str, list[int]]]]:
+        """Returns the columns and the latest rows of the cities by date."""
+
+        first = start.toordinal() if start else -math.inf
+        last = end.toordinal() if end else math.inf
+        with self._lock:
+            if cities is None:
+                names = self.cities()
+            else:
+                names = sorted(set(cities) & self._city_ids.keys())
+            positions = []
+            for city in names:
+                dates = self._index.get(self._city_ids[city], {})
+                rows = [dates[day] for day in sorted(dates) if first <= day <= last]
+                positions.append((city, rows))
+            return (self._columns, positions)
+
+    def scan(
+        self,
+        start: None | date = None,
+        end: None | date = None,
+        cities: None | Iterable[str] = None,
+    ) -> Iterator[HistoryRow]:
+        """Yields the days within [start, end] by city and date.
+
+        Args:
+            start: None | date - the first date, None for the earliest
+            end: None | date - the last date, None for the latest
+            cities: None | Iterable[str] - the cities, None for all
+        """
+
+        mapped, positions = self._positions(start, end, cities)
+        days = mapped["date"].values
+        columns = [
+            (mapped[name].values, typecode) for name, typecode in HISTORY_COLUMNS[2:]
+        ]
+        for city, rows in positions:
+            for row in rows:
+                yield HistoryRow(
+                    city,
+                    date.fromordinal(days[row]),
+                    *(_null(typecode, values[row]) for values, typecode in columns),
+                )
+
+    def city_averages(
+        self,
+        start: None | date = None,
+        end: None | date = None,
+        cities: None | Iterable[str] = None,
+    ) -> dict[str, dict[str, Any]]:
+        """Returns the mean temperature and suitable hours of every city.
+
+        The means are over the days having the value, see `scan` for the
+        arguments.
+        """
+
+        mapped, positions = self._positions(start, end, cities)
+        temps = mapped["temp_avg"].values
+        hours = mapped["relevant_cond_hours"].values
+        averages: dict[str, dict[str, Any]] = {}
+        for city, rows in positions:
+            if not rows:
+                continue
+            temp_sum, temp_days, hours_sum, hours_days = 0.0, 0, 0, 0
+            for row in rows:
+                if not math.isnan(temp := temps[row]):
+                    temp_sum += temp
+                    temp_days += 1
+                if (hour := hours[row]) != NULL_INT:
+                    hours_sum += hour
+                    hours_days += 1
+            averages[city] = {
+                "days": len(rows),
+                "temp_avg": round(temp_sum / temp_days, 3) if temp_days else None,
+                "relevant_cond_hours": (
+                    round(hours_sum / hours_days, 3) if hours_days else None
+                ),
+            }
+        return averages
+
+    def close(self) -> None:
+        with self._lock:
+            for column in self._columns.values():
+                column.close()
+            self._columns = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--city", action="append", dest="cities")
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    args = parser.parse_args()
+    store = HistoryStore(args.directory)
+    try:
+        averages = store.city_averages(args.start, args.end, args.cities)
+    finally:
+        store.close()
+    print(json.dumps(averages, indent=2))
+
+
+if __name__ == "__main__":
+    main()
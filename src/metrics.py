@@ -0,0 +1,284 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+
+# the upper bounds (seconds) of the stage histograms
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+LABELS = tuple[tuple[str, str], ...]
+
+# one profiler runs at a time in the process: since Python 3.12 a second
+# one (in another thread too) fails with "Another profiling tool is active"
+_PROFILER_LOCK = threading.Lock()
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "min": round(self.min, 6) if self.count else None,
+            "max": round(self.max, 6) if self.count else None,
+        }
+
+
+def _labels_text(labels: LABELS, **extra: str) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Metrics:
+    """The counters, gauges and histograms of the task pipeline.
+
+    The stages are timed with `stage(name)`, which also profiles the
+    block with cProfile when a profile directory is given.
+    """
+
+    enabled = True
+
+    def __init__(
+        self,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        profile_dir: None | str | os.PathLike = None,
+    ):
+        self.buckets = buckets
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        if self.profile_dir is not None:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self.counters: dict[tuple[str, LABELS], float] = {}
+        self.gauges: dict[tuple[str, LABELS], float] = {}
+        self.histograms: dict[tuple[str, LABELS], Histogram] = {}
+        self._profiles: dict[str, list[cProfile.Profile]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if (histogram := self.histograms.get(key)) is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Times (and profiles) a pipeline stage in the current thread.
+
+        The stages overlapping a profiled one (the nested ones and those
+        of the other threads) are timed only.
+        """
+
+        if self.profile_dir is None or not _PROFILER_LOCK.acquire(blocking=False):
+            with self.timer("stage_seconds", stage=name):
+                yield
+            return
+        profile: None | cProfile.Profile = cProfile.Profile()
+        try:
+            with self.timer("stage_seconds", stage=name):
+                try:
+                    profile.enable()
+                except ValueError:
+                    # a profiler (or a coverage tool) outside of the metrics
+                    profile = None
+                try:
+                    yield
+                finally:
+                    if profile is not None:
+                        profile.disable()
+        finally:
+            _PROFILER_LOCK.release()
+            if profile is not None:
+                with self._lock:
+                    self._profiles.setdefault(name, []).append(profile)
+
+    def wrap_remote(self, stage: str, func: Callable, *args) -> tuple:
+        """Returns the (callable, args) to submit to a process pool.
+
+        When profiling, the call is profiled in the worker process.
+        """
+
+        if self.profile_dir is None:
+            return (func, args)
+        prefix = str(self.profile_dir / f"{stage}-worker")
+        return (profiled_call, (prefix, func, *args))
+
+    def dump_profiles(self) -> list[Path]:
+        """Writes one merged `<stage>.prof` file per profiled stage."""
+
+        if self.profile_dir is None:
+            return []
+        merged: dict[str, pstats.Stats] = {}
+        for name, profiles in self._profiles.items():
+            for profile in profiles:
+                if name in merged:
+                    merged[name].add(profile)
+                else:
+                    merged[name] = pstats.Stats(profile)
+        for path in self.profile_dir.glob("*-worker-*.prof"):
+            name = path.name.split("-worker-", 1)[0]
+            if name in merged:
+                merged[name].add(str(path))
+            else:
+                merged[name] = pstats.Stats(str(path))
+            path.unlink()
+        paths = []
+        for name, stats in merged.items():
+            path = self.profile_dir / f"{name}.prof"
+            stats.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def to_json(self) -> dict[str, Any]:
+        def key_text(key: tuple[str, LABELS]) -> str:
+            return key[0] + _labels_text(key[1])
+
+        with self._lock:
+            return {
+                "counters": {key_text(k): v for k, v in self.counters.items()},
+                "gauges": {key_text(k): v for k, v in self.gauges.items()},
+                "histograms": {
+                    key_text(k): h.to_json() for k, h in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        lines: list[str] = []
+        with self._lock:
+            for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for name, _ in metrics}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (mname, labels), value in metrics.items():
+                        if mname == name:
+                            lines.append(f"{name}{_labels_text(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (hname, labels), hist in self.histograms.items():
+                    if hname != name:
+                        continue
+                    cumulative = 0
+                    bounds = [*map(str, hist.buckets), "+Inf"]
+                    for bound, count in zip(bounds, hist.counts):
+                        cumulative += count
+                        labels_text = _labels_text(labels, le=bound)
+                        lines.append(f"{name}_bucket{labels_text} {cumulative}")
+                    lines.append(f"{name}_sum{_labels_text(labels)} {hist.sum}")
+                    lines.append(f"{name}_count{_labels_text(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str | os.PathLike) -> None:
+        """Writes a JSON summary (*.json) or the Prometheus text format."""
+
+        path = Path(path)
+        if path.suffix.lower() == ".json":
+            text = json.dumps(self.to_json(), indent=2)
+        else:
+            text = self.to_prometheus()
+        path.write_text(text)
+
+
+class NullMetrics(Metrics):
+    """Does nothing, so the disabled instrumentation costs a method call."""
+
+    enabled = False
+
+    def __init__(self):
+        super().__init__()
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        pass
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        pass
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        pass
+
+    def timer(self, name: str, **labels: str):  # type: ignore[override]
+        return _NULL_CONTEXT
+
+    def stage(self, name: str):  # type: ignore[override]
+        return _NULL_CONTEXT
+
+
+_NULL_CONTEXT = nullcontext()
+_metrics: Metrics = NullMetrics()
+
+
+def profiled_call(prefix: str, func: Callable, *args) -> Any:
+    """Calls the function under cProfile and dumps the stats next to prefix."""
+
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args)
+    finally:
+        profile.dump_stats(f"{prefix}-{os.getpid()}-{uuid.uuid4().hex}.prof")
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def set_metrics(metrics: None | Metrics) -> None:
+    """Makes the pipeline report to the metrics (None disables them)."""
+
+    global _metrics
+    _metrics = NullMetrics() if metrics is None else metrics
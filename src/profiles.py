@@ -0,0 +1,165 @@
+import json
+import os
+from array import array
+from math import isnan
+from typing import Any, Iterable
+
+from src.columnar import CONDITION_CODES, UNKNOWN_HOUR, day_stats, parse_day
+from src.exceptions import TaskError
+from src.types_ import FORECAST
+from src.utils import DAY_HOURS_END, DAY_HOURS_START, SUITABLE_CONDITIONS
+
+
+# the hours of a day, a window is an inclusive range of them
+MAX_HOUR = 23
+
+
+class AnalysisProfile:
+    """The rules telling the suitable hours of a day.
+
+    An hour is suitable when it is in one of the windows, its condition
+    is one of the conditions and its temperature is within the thresholds
+    (an hour without a temperature fails any threshold).
+
+    Args:
+        name: str - the name of the profile in the results
+        windows: Iterable[tuple[int, int]] - the inclusive hour ranges
+        conditions: Iterable[str] - the suitable conditions
+        min_temp: None | float - the lowest suitable temperature
+        max_temp: None | float - the highest suitable temperature
+    """
+
+    def __init__(
+        self,
+        name: str,
+        windows: Iterable[tuple[int, int]] = ((DAY_HOURS_START, DAY_HOURS_END),),
+        conditions: Iterable[str] = SUITABLE_CONDITIONS,
+        min_temp: None | float = None,
+        max_temp: None | float = None,
+    ):
+        self.name = name
+        self.windows = tuple((int(start), int(end)) for start, end in windows)
+        self.conditions = tuple(conditions)
+        self.min_temp = min_temp
+        self.max_temp = max_temp
+        for start, end in self.windows:
+            if not 0 <= start <= end <= MAX_HOUR:
+                raise TaskError(f"{name}: the window {start}-{end} is not within a day")
+        if unknown := set(self.conditions) - CONDITION_CODES.keys():
+            raise TaskError(f"{name}: unknown conditions {sorted(unknown)}")
+        if min_temp is not None and max_temp is not None and min_temp > max_temp:
+            raise TaskError(f"{name}: min_temp={min_temp} > max_temp={max_temp}")
+
+    @property
+    def hour_mask(self) -> int:
+        """The bit `hour` is set for the hours of the windows."""
+
+        mask = 0
+        for start, end in self.windows:
+            mask |= ((1 << (end - start + 1)) - 1) << start
+        return mask
+
+    @property
+    def has_thresholds(self) -> bool:
+        return self.min_temp is not None or self.max_temp is not None
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "windows": [list(window) for window in self.windows],
+            "conditions": list(self.conditions),
+            "min_temp": self.min_temp,
+            "max_temp": self.max_temp,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> "AnalysisProfile":
+        return cls(**data)
+
+
+class ProfileSet:
+    """The profiles compiled to be evaluated in one pass over the hours.
+
+    Profile i is bit i of a mask: `hour_table` is the mask of the profiles
+    whose windows hold an hour and `cond_table` the mask of the profiles
+    accepting a condition code, so the suitable profiles of an hour are
+    two lookups and an AND, the thresholds are checked only for the
+    profiles having them.
+    """
+
+    def __init__(self, profiles: Iterable[AnalysisProfile]):
+        self.profiles = tuple(profiles)
+        if not self.profiles:
+            raise TaskError("no analysis profiles are given")
+        names = [profile.name for profile in self.profiles]
+        if len(set(names)) != len(names):
+            raise TaskError(f"the profile names are not unique: {names}")
+        hour_table = [0] * (UNKNOWN_HOUR + 1)
+        cond_table = [0] * 256
+        self.thresholds: list[tuple[int, float, float]] = []
+        self.threshold_mask = 0
+        for bit, profile in enumerate(self.profiles):
+            hour_mask = profile.hour_mask
+            for hour in range(MAX_HOUR + 1):
+                if hour_mask >> hour & 1:
+                    hour_table[hour] |= 1 << bit
+            for cond in profile.conditions:
+                cond_table[CONDITION_CODES[cond]] |= 1 << bit
+            if profile.has_thresholds:
+                low = -float("inf") if profile.min_temp is None else profile.min_temp
+                high = float("inf") if profile.max_temp is None else profile.max_temp
+                self.thresholds.append((bit, low, high))
+                self.threshold_mask |= 1 << bit
+        self.hour_table = tuple(hour_table)
+        self.cond_table = tuple(cond_table)
+
+    @property
+    def names(self) -> list[str]:
+        return [profile.name for profile in self.profiles]
+
+    def aggregate(self, forecasts: list[FORECAST]) -> dict[str, list[dict[str, Any]]]:
+        """Returns the day stats of every profile, the days are parsed once.
+
+        The stats are those of `aggregate_forecast_stats` under the rules
+        of the profile.
+        """
+
+        results: list[list[dict[str, Any]]] = [[] for _ in self.profiles]
+        hour_table, cond_table = self.hour_table, self.cond_table
+        thresholds, threshold_mask = self.thresholds, self.threshold_mask
+        for forecast in forecasts:
+            if (day := parse_day(forecast)) is None:
+                continue
+            selected = [(bytearray(), array("d")) for _ in self.profiles]
+            for hour, temp, cond in zip(day.hours, day.temps, day.conds):
+                mask = hour_table[hour] & cond_table[cond]
+                if mask & threshold_mask:
+                    for bit, low, high in thresholds:
+                        if mask >> bit & 1 and (isnan(temp) or not low <= temp <= high):
+                            mask &= ~(1 << bit)
+                while mask:
+                    lowest = mask & -mask
+                    hours, temps = selected[lowest.bit_length() - 1]
+                    hours.append(hour)
+                    temps.append(temp)
+                    mask ^= lowest
+            for stats, (hours, temps) in zip(results, selected):
+                stats.append(day_stats(day.date_, bytes(hours), temps))
+        return dict(zip(self.names, results))
+
+    def to_json(self) -> list[dict[str, Any]]:
+        return [profile.to_json() for profile in self.profiles]
+
+    @classmethod
+    def from_json(cls, data: list[dict[str, Any]]) -> "ProfileSet":
+        return cls(AnalysisProfile.from_json(profile) for profile in data)
+
+
+def load_profiles(path: str | os.PathLike) -> ProfileSet:
+    """Reads a JSON list of the AnalysisProfile arguments."""
+
+    try:
+        with open(path, encoding="utf-8") as fin:
+            return ProfileSet.from_json(json.load(fin))
+    except (OSError, ValueError, TypeError) as e:
+        raise TaskError(f"Cannot load the profiles {str(path)!r}: {e}") from e
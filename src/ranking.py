@@ -0,0 +1,131 @@
+import heapq
+from itertools import count
+from typing import Any
+
+from src.exceptions import TaskError
+
+
+TIE_BREAKS = ("ties", "name", "first")
+
+
+def score_city(analytics: dict[str, Any]) -> tuple[float, int]:
+    """Returns the (total temperature, total suitable hours) of the city."""
+
+    days: list[dict[str, Any]] = analytics["days"] or []
+    total_temp: float = 0.0
+    total_conds: int = 0
+    for day in days:
+        atemp = day["temp_avg"]
+        conds = day["relevant_cond_hours"]
+        if atemp and conds:
+            total_temp += atemp
+            total_conds += conds
+    return (total_temp, total_conds)
+
+
+class _Descending:
+    """Inverts the order of a value, so "a" outranks "b"."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __lt__(self, other: "_Descending") -> bool:
+        return other.value < self.value
+
+    def __gt__(self, other: "_Descending") -> bool:
+        return other.value > self.value
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Descending) and self.value == other.value
+
+    def __hash__(self) -> int:
+        return hash(self.value)
+
+
+class CityRanker:
+    """The online ranking of the cities as their results arrive.
+
+    Only the k best ranking keys are kept in a min-heap, so adding a city
+    costs O(log k) and the memory is bounded by k (and the ties). Without
+    k every key is kept for the full rating.
+
+    Args:
+        k: None | int - the number of the best keys to keep, None for all
+        weights: None | tuple[float, float] - score a city by
+            w_temp * total temperature + w_hours * total suitable hours
+            instead of comparing the temperature first and the hours then
+        tie_break: str - "ties" ranks the equal scores together, "name"
+            prefers the alphabetically first city and "first" the city
+            which has arrived first
+    """
+
+    def __init__(
+        self,
+        k: None | int = None,
+        weights: None | tuple[float, float] = None,
+        tie_break: str = "ties",
+    ):
+        if k is not None and k < 1:
+            raise TaskError(f"k={k} must be positive")
+        if tie_break not in TIE_BREAKS:
+            msg = f"unknown tie-break {tie_break!r}, expected one of {TIE_BREAKS}"
+            raise TaskError(msg)
+        self.k = k
+        self.weights = weights
+        self.tie_break = tie_break
+        self._heap: list[Any] = []
+        self._groups: dict[Any, list[str]] = {}
+        self._arrivals = count()
+
+    def score(self, analytics: dict[str, Any]) -> tuple[float, ...]:
+        total_temp, total_conds = score_city(analytics)
+        if self.weights is None:
+            return (total_temp, total_conds)
+        w_temp, w_hours = self.weights
+        return (w_temp * total_temp + w_hours * total_conds,)
+
+    def add(self, city: str, analytics: dict[str, Any]) -> None:
+        self.add_score(city, self.score(analytics))
+
+    def add_score(self, city: str, score: tuple[float, ...]) -> None:
+        """Ranks the city by the score computed with `score`."""
+
+        key: Any = score
+        if self.tie_break == "name":
+            key = (score, _Descending(city))
+        elif self.tie_break == "first":
+            key = (score, -next(self._arrivals))
+        if (group := self._groups.get(key)) is not None:
+            group.append(city)
+        elif self.k is None or len(self._heap) < self.k:
+            heapq.heappush(self._heap, key)
+            self._groups[key] = [city]
+        elif self._heap[0] < key:
+            del self._groups[heapq.heapreplace(self._heap, key)]
+            self._groups[key] = [city]
+
+    def _ranked_keys(self) -> list[Any]:
+        return sorted(self._groups, reverse=True)
+
+    def best(self) -> list[str]:
+        """Returns the city or the tied cities of the first place."""
+
+        if not self._heap:
+            return []
+        return list(self._groups[max(self._heap)])
+
+    def top(self) -> list[str]:
+        """Returns the kept cities from the best one."""
+
+        return [city for key in self._ranked_keys() for city in self._groups[key]]
+
+    def ratings(self) -> dict[str, int]:
+        """Returns the dense rating of the kept cities, 1 for the best."""
+
+        return {
+            city: rating
+            for rating, key in enumerate(self._ranked_keys(), 1)
+            for city in self._groups[key]
+        }
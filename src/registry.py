@@ -0,0 +1,179 @@
+import csv
+import json
+import logging
+import os
+import re
+import threading
+from array import array
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from src.exceptions import RegistryError
+
+
+REGISTRY_SUFFIXES = (".json", ".csv")
+ALIASES_SEPARATOR = ";"
+
+_NON_ALNUM = re.compile(r"[\W_]+")
+
+
+def normalize_city_name(name: str) -> str:
+    """Returns the lookup key: "Abu-Dhabi", "abu dhabi" -> "ABUDHABI"."""
+
+    return _NON_ALNUM.sub("", name).upper()
+
+
+class CityRegistry:
+    """The city name (and alias) to forecast URL mapping.
+
+    The sources are read on the first lookup. A URL is kept as an interned
+    prefix (up to the last slash) plus its own suffix, since thousands
+    of URLs usually share a few prefixes.
+    """
+
+    def __init__(self, sources: Iterable[str | os.PathLike] = ()):
+        self._sources = [Path(source) for source in sources]
+        self._loaded = not self._sources
+        self._lock = threading.Lock()
+        self._index: dict[str, int] = {}
+        self._names: list[str] = []
+        # the position of every registered name, a name is stored once
+        self._positions: dict[str, int] = {}
+        self._prefixes: list[str] = []
+        self._prefix_ids: dict[str, int] = {}
+        self._url_prefixes = array("I")
+        self._url_suffixes: list[str] = []
+
+    @classmethod
+    def from_mapping(cls, mapping: dict[str, str]) -> "CityRegistry":
+        registry = cls()
+        for name, url in mapping.items():
+            registry.add(name, url)
+        return registry
+
+    @classmethod
+    def from_path(cls, path: str | os.PathLike) -> "CityRegistry":
+        """Returns a lazy registry of a JSON/CSV file or a directory of them."""
+
+        path = Path(path)
+        if path.is_dir():
+            sources = sorted(
+                source
+                for source in path.iterdir()
+                if source.suffix.lower() in REGISTRY_SUFFIXES
+            )
+        elif path.is_file():
+            sources = [path]
+        else:
+            raise RegistryError(f"The city registry {str(path)!r} does not exist")
+        return cls(sources)
+
+    def add(self, name: str, url: str, aliases: Iterable[str] = ()) -> None:
+        """Registers the city, a later name or alias overrides an earlier one."""
+
+        prefix, sep, suffix = url.rpartition("/")
+        prefix += sep
+        if (prefix_id := self._prefix_ids.get(prefix)) is None:
+            prefix_id = self._prefix_ids[prefix] = len(self._prefixes)
+            self._prefixes.append(prefix)
+        key = normalize_city_name(name)
+        if (position := self._positions.get(key)) is not None:
+            logging.warning(f"The city {key!r} is registered again, now as {url!r}")
+            self._url_prefixes[position] = prefix_id
+            self._url_suffixes[position] = suffix
+        else:
+            position = self._positions[key] = len(self._names)
+            self._names.append(key)
+            self._url_prefixes.append(prefix_id)
+            self._url_suffixes.append(suffix)
+        self._index[key] = position
+        for alias in aliases:
+            if key := normalize_city_name(alias):
+                self._index[key] = position
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            for source in self._sources:
+                self._load(source)
+            self._loaded = True
+
+    def _load(self, source: Path) -> None:
+        try:
+            if source.suffix.lower() == ".csv":
+                self._load_csv(source)
+            else:
+                self._load_json(source)
+        except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+            raise RegistryError(f"Cannot load the registry {str(source)!r}") from e
+
+    def _load_csv(self, source: Path) -> None:
+        with open(source, newline="", encoding="utf-8") as fin:
+            rows = csv.reader(fin)
+            header = next(rows, [])
+            name_col, url_col = header.index("name"), header.index("url")
+            aliases_col = header.index("aliases") if "aliases" in header else None
+            for row in rows:
+                aliases = ()
+                if aliases_col is not None and row[aliases_col]:
+                    aliases = row[aliases_col].split(ALIASES_SEPARATOR)
+                self.add(row[name_col], row[url_col], aliases)
+
+    def _load_json(self, source: Path) -> None:
+        with open(source, encoding="utf-8") as fin:
+            data: Any = json.load(fin)
+        if isinstance(data, dict):
+            # {"NAME": "url"} like CITIES or {"NAME": {"url": ..., "aliases": ...}}
+            data = [
+                (
+                    {**value, "name": name}
+                    if isinstance(value, dict)
+                    else {"name": name, "url": value}
+                )
+                for name, value in data.items()
+            ]
+        for entry in data:
+            self.add(entry["name"], entry["url"], entry.get("aliases", ()))
+
+    def canonical_name(self, name: str) -> str:
+        """Returns the registered name of the city or its alias."""
+
+        self._ensure_loaded()
+        return self._names[self._index[normalize_city_name(name)]]
+
+    def get_url(self, name: str) -> str:
+        """Returns the forecast URL, raises KeyError for an unknown city."""
+
+        self._ensure_loaded()
+        position = self._index[normalize_city_name(name)]
+        prefix_id = self._url_prefixes[position]
+        return self._prefixes[prefix_id] + self._url_suffixes[position]
+
+    def __contains__(self, name: object) -> bool:
+        self._ensure_loaded()
+        return isinstance(name, str) and normalize_city_name(name) in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        self._ensure_loaded()
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._names)
+
+
+_default_registry: None | CityRegistry = None
+
+
+def get_default_registry() -> None | CityRegistry:
+    return _default_registry
+
+
+def set_default_registry(registry: None | CityRegistry) -> None:
+    """Makes the registry resolve the city names (None means CITIES)."""
+
+    global _default_registry
+    _default_registry = registry
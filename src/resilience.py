@@ -0,0 +1,196 @@
+import random
+import threading
+import time
+from collections import deque
+from http import HTTPStatus
+
+from src.exceptions import CircuitOpenError, DeadlineExceededError
+from src.utils import (
+    BACKOFF_BASE,
+    BACKOFF_MAX,
+    BREAKER_COOLDOWN,
+    FETCH_RETRIES,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_QUANTILE,
+    LATENCY_WINDOW,
+)
+
+
+def is_retryable(status_code: int) -> bool:
+    """The throttled and the server-side failures are worth another attempt."""
+
+    return (
+        status_code == HTTPStatus.TOO_MANY_REQUESTS
+        or status_code >= HTTPStatus.INTERNAL_SERVER_ERROR
+    )
+
+
+class LatencyTracker:
+    """The sliding window of the successful request latencies."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def quantile(self, q: float, min_samples: int = 1) -> None | float:
+        """Returns the q-quantile or None if there are too few samples."""
+
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+
+class CircuitBreaker:
+    """The per-host breaker opened by consecutive failures.
+
+    An open host is skipped for the cool-down, then a single trial request
+    is let through: its success closes the breaker, its failure reopens it.
+    """
+
+    def __init__(self, threshold: int, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures: dict[str, int] = {}
+        self._opened_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host: str) -> bool:
+        with self._lock:
+            if (opened_at := self._opened_at.get(host)) is None:
+                return True
+            if time.monotonic() - opened_at < self.cooldown:
+                return False
+            # half-open: the others wait for this trial
+            self._opened_at[host] = time.monotonic()
+            return True
+
+    def record_success(self, host: str) -> None:
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+
+    def record_failure(self, host: str) -> None:
+        with self._lock:
+            failures = self._failures[host] = self._failures.get(host, 0) + 1
+            if failures >= self.threshold:
+                self._opened_at[host] = time.monotonic()
+
+    def is_open(self, host: str) -> bool:
+        with self._lock:
+            return host in self._opened_at
+
+
+class FetchPolicy:
+    """How hard a request is tried: retries, hedging, breaker and deadline.
+
+    The default policy makes a single attempt, as a plain request does.
+
+    Args:
+        retries: int - the attempts after the first one
+        backoff_base: float - the backoff before the first retry
+        backoff_max: float - the backoff cap
+        hedge: bool - duplicate a request slower than the latency quantile
+        hedge_quantile: float - the quantile of the observed latencies
+        hedge_min_samples: int - the latencies to observe before hedging
+        breaker_threshold: None | int - the failures to open a host breaker
+        breaker_cooldown: float - how long an open host is skipped
+        deadline: None | float - the seconds the whole run may take
+    """
+
+    def __init__(
+        self,
+        retries: int = FETCH_RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+        hedge: bool = False,
+        hedge_quantile: float = HEDGE_QUANTILE,
+        hedge_min_samples: int = HEDGE_MIN_SAMPLES,
+        breaker_threshold: None | int = None,
+        breaker_cooldown: float = BREAKER_COOLDOWN,
+        deadline: None | float = None,
+    ):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = None
+        if breaker_threshold is not None:
+            self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.deadline = deadline
+        self.latencies = LatencyTracker()
+        self._deadline_at: None | float = None
+
+    def start(self) -> None:
+        """Arms the deadline, it counts from the start of the run."""
+
+        if self.deadline is not None:
+            self._deadline_at = time.monotonic() + self.deadline
+
+    def remaining(self) -> None | float:
+        if self._deadline_at is None:
+            return None
+        return max(self._deadline_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+    def timeout(self, timeout: None | float) -> None | float:
+        """Returns the request timeout clipped by the deadline."""
+
+        if (remaining := self.remaining()) is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def backoff(self, attempt: int) -> float:
+        """Returns the "full jitter" delay before the retry of the attempt."""
+
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        if (remaining := self.remaining()) is not None:
+            delay = min(delay, remaining)
+        return delay
+
+    def hedge_delay(self) -> None | float:
+        """Returns when to send a duplicate request (None means never)."""
+
+        if not self.hedge:
+            return None
+        return self.latencies.quantile(self.hedge_quantile, self.hedge_min_samples)
+
+    def check(self, host: str) -> None:
+        """Raises if the request to the host must not be sent."""
+
+        if self.expired:
+            raise DeadlineExceededError(f"The {self.deadline}s deadline has expired")
+        if self.breaker is not None and not self.breaker.allow(host):
+            raise CircuitOpenError(f"The circuit breaker of {host!r} is open")
+
+    def record(self, host: str, ok: bool) -> None:
+        if self.breaker is None:
+            return
+        if ok:
+            self.breaker.record_success(host)
+        else:
+            self.breaker.record_failure(host)
+
+
+_fetch_policy = FetchPolicy()
+
+
+def get_fetch_policy() -> FetchPolicy:
+    return _fetch_policy
+
+
+def set_fetch_policy(policy: None | FetchPolicy) -> None:
+    """Makes the fetches follow the policy (None means a single attempt)."""
+
+    global _fetch_policy
+    _fetch_policy = FetchPolicy() if policy is None else policy
@@ -0,0 +1,329 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, NamedTuple
+
+from src.exceptions import TaskError
+from src.metrics import get_metrics
+from src.resilience import get_fetch_policy
+from src.utils import (
+    INLINE_MAX_CITIES,
+    MAX_FETCH_THREADS,
+    PROCESS_MIN_SECONDS,
+    PROCESS_SPAWN_SECONDS,
+)
+
+
+# the weight of the latest run in the aggregation time estimate
+SMOOTHING = 0.5
+
+
+class PoolPlan(NamedTuple):
+    threads: int
+    # 0 aggregates inline, in the calling thread
+    processes: int
+
+
+def executor_workers(executor: Executor) -> None | int:
+    """Returns the calls the executor runs at a time, None if unknown."""
+
+    if (workers := getattr(executor, "max_workers", None)) is not None:
+        return workers
+    # a plain pool of the concurrent.futures module
+    return getattr(executor, "_max_workers", None)
+
+
+def timed_call(func: Callable, *args: Any) -> tuple[Any, float]:
+    """Returns the result and the CPU seconds of the call in its thread."""
+
+    start = time.thread_time()
+    result = func(*args)
+    return (result, time.thread_time() - start)
+
+
+class InlineExecutor(Executor):
+    """Runs the submitted call right away, no process is worth spawning."""
+
+    max_workers = 1
+
+    def submit(self, fn: Callable, /, *args: Any, **kwargs: Any) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+def _chain(inner: Future, outer: Future) -> None:
+    try:
+        result = inner.result()
+    except BaseException as e:
+        outer.set_exception(e)
+    else:
+        outer.set_result(result)
+
+
+class _LimitedExecutor(Executor):
+    """Runs at most `limit` of the submitted calls at a time in the executor.
+
+    The calls over the limit wait in a queue rather than in `submit`, so
+    a run keeps its share of a larger pool leased to the other runs too.
+    """
+
+    def __init__(self, executor: Executor, limit: int):
+        self.executor = executor
+        self.limit = self.max_workers = limit
+        self._running = 0
+        self._waiting: deque[tuple[Future, Callable, tuple, dict]] = deque()
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, /, *args: Any, **kwargs: Any) -> Future:
+        outer: Future = Future()
+        with self._lock:
+            start = self._running < self.limit
+            if start:
+                self._running += 1
+            else:
+                self._waiting.append((outer, fn, args, kwargs))
+        if start:
+            self._start(outer, fn, args, kwargs)
+        return outer
+
+    def _start(self, outer: Future, fn: Callable, args: tuple, kwargs: dict) -> None:
+        try:
+            inner = self.executor.submit(fn, *args, **kwargs)
+        except BaseException as e:
+            outer.set_exception(e)
+            self._finished()
+            return
+
+        def done(inner: Future) -> None:
+            _chain(inner, outer)
+            self._finished()
+
+        inner.add_done_callback(done)
+
+    def _finished(self) -> None:
+        with self._lock:
+            if not self._waiting:
+                self._running -= 1
+                return
+            waiting = self._waiting.popleft()
+        self._start(*waiting)
+
+
+class _MeasuredExecutor(Executor):
+    """Adds up the CPU seconds of the calls submitted to the executor."""
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self.max_workers = executor_workers(executor)
+        self.cpu_seconds = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, /, *args: Any, **kwargs: Any) -> Future:
+        outer: Future = Future()
+        with self._lock:
+            self.calls += 1
+
+        def done(inner: Future) -> None:
+            try:
+                result, seconds = inner.result()
+            except BaseException as e:
+                outer.set_exception(e)
+                return
+            with self._lock:
+                self.cpu_seconds += seconds
+            outer.set_result(result)
+
+        self.executor.submit(timed_call, fn, *args, **kwargs).add_done_callback(done)
+        return outer
+
+
+class PoolScheduler:
+    """Sizes the pools of a run by the measured costs and reuses them.
+
+    The fetch latency comes from the fetch policy, the aggregation CPU
+    time per city is measured in the runs. A run of a few cities (or of
+    less work than spawning processes costs) is aggregated inline, else
+    a process gets at least PROCESS_MIN_SECONDS of work, and there are
+    enough fetch threads to keep the processes busy.
+
+    Args:
+        threads: None | int - the fetch threads, None to adapt
+        processes: None | int - the aggregation processes (0 for inline),
+            None to adapt
+        inline_max: int - the cities always aggregated inline
+        cpus: None | int - the CPUs the adapted processes may use, all the
+            CPUs of the host by default
+    """
+
+    def __init__(
+        self,
+        threads: None | int = None,
+        processes: None | int = None,
+        inline_max: int = INLINE_MAX_CITIES,
+        cpus: None | int = None,
+    ):
+        if threads is not None and threads < 1:
+            raise TaskError(f"threads={threads} must be positive")
+        if processes is not None and processes < 0:
+            raise TaskError(f"processes={processes} must not be negative")
+        if cpus is not None and cpus < 1:
+            raise TaskError(f"cpus={cpus} must be positive")
+        self.threads = threads
+        self.processes = processes
+        self.inline_max = inline_max
+        self.cpus = cpus
+        # the CPU seconds to aggregate a city, None until measured
+        self.aggregate_seconds: None | float = None
+        self._lock = threading.Lock()
+        # the current pool of a kind, the sizes and the leases by pool id
+        self._pools: dict[str, Executor] = {}
+        self._sizes: dict[int, int] = {}
+        self._leases: dict[int, int] = {}
+
+    def _processes_for(self, cities: int) -> int:
+        cpus = self.cpus or os.cpu_count() or 1
+        if cities <= self.inline_max:
+            return 0
+        if self.aggregate_seconds is None:
+            return min(cpus, cities)
+        work = cities * self.aggregate_seconds
+        processes = max(1, min(cpus, cities, math.ceil(work / PROCESS_MIN_SECONDS)))
+        spawn = 0 if processes <= self.pool_size("processes") else PROCESS_SPAWN_SECONDS
+        if work <= spawn * processes:
+            return 0
+        return processes
+
+    def _threads_for(self, cities: int, processes: int) -> int:
+        threads = min(cities, MAX_FETCH_THREADS)
+        latency = get_fetch_policy().latencies.quantile(0.5)
+        if latency is not None and self.aggregate_seconds:
+            # the cities fetched per second keep up with the aggregated ones
+            threads = min(
+                threads, math.ceil(latency * max(processes, 1) / self.aggregate_seconds)
+            )
+        return max(threads, 1)
+
+    def plan(self, cities: int) -> PoolPlan:
+        """Returns the pool sizes for the number of cities."""
+
+        processes = self.processes
+        if processes is None:
+            processes = self._processes_for(cities)
+        threads = self.threads or self._threads_for(cities, processes)
+        return PoolPlan(threads, processes)
+
+    def _lease(self, kind: str, size: int) -> Executor:
+        """Returns the pool of the kind with `size` workers at least.
+
+        A pool too small is replaced by a larger one, and it is shut down
+        with its last lease: the runs using it go on undisturbed.
+        """
+
+        with self._lock:
+            pool = self._pools.get(kind)
+            if pool is None or self._sizes[id(pool)] < size:
+                if pool is not None:
+                    self._retire(pool)
+                if kind == "threads":
+                    pool = ThreadPoolExecutor(
+                        max_workers=size, thread_name_prefix="fetch"
+                    )
+                else:
+                    pool = ProcessPoolExecutor(max_workers=size)
+                self._pools[kind] = pool
+                self._sizes[id(pool)] = size
+                self._leases[id(pool)] = 0
+            self._leases[id(pool)] += 1
+            return pool
+
+    def _release(self, pool: Executor) -> None:
+        with self._lock:
+            if id(pool) not in self._leases:
+                return  # the scheduler is closed
+            self._leases[id(pool)] -= 1
+            if pool not in self._pools.values() and not self._leases[id(pool)]:
+                self._shutdown(pool)
+
+    def _retire(self, pool: Executor) -> None:
+        if not self._leases[id(pool)]:
+            self._shutdown(pool)
+        # else the last run to release it shuts it down
+
+    def _shutdown(self, pool: Executor) -> None:
+        del self._leases[id(pool)], self._sizes[id(pool)]
+        pool.shutdown(wait=False)
+
+    def pool_size(self, kind: str) -> int:
+        """Returns the workers of the current "threads" or "processes" pool."""
+
+        with self._lock:
+            pool = self._pools.get(kind)
+            return 0 if pool is None else self._sizes[id(pool)]
+
+    @contextmanager
+    def run(self, cities: int) -> Iterator[tuple[Executor, Executor]]:
+        """Yields the (aggregation executor, fetch executor) of a run.
+
+        The pools are shared by the concurrent runs, every run submits to
+        them up to the sizes of its plan. The aggregation time of the run
+        refines the estimate of the next.
+        """
+
+        plan = self.plan(cities)
+        logging.info(
+            f"Scheduling {cities} cities: {plan.threads} fetch threads, "
+            + (f"{plan.processes} processes" if plan.processes else "inline")
+        )
+        metrics = get_metrics()
+        metrics.set_gauge("pool_threads", plan.threads)
+        metrics.set_gauge("pool_processes", plan.processes)
+        leased = [self._lease("threads", plan.threads)]
+        try:
+            if plan.processes:
+                leased.append(self._lease("processes", plan.processes))
+                aggregator: Executor = _LimitedExecutor(leased[1], plan.processes)
+            else:
+                aggregator = InlineExecutor()
+            executor = _MeasuredExecutor(aggregator)
+            yield (executor, _LimitedExecutor(leased[0], plan.threads))
+        finally:
+            for pool in leased:
+                self._release(pool)
+        # a run of nothing to aggregate (all failed or unchanged) tells nothing
+        if cities and executor.calls:
+            seconds = executor.cpu_seconds / cities
+            if self.aggregate_seconds is not None:
+                seconds = SMOOTHING * seconds + (1 - SMOOTHING) * self.aggregate_seconds
+            self.aggregate_seconds = seconds
+
+    def close(self) -> None:
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+            for pool in pools:
+                self._leases.pop(id(pool), None)
+                self._sizes.pop(id(pool), None)
+                pool.shutdown()
+
+
+_scheduler = PoolScheduler()
+
+
+def get_scheduler() -> PoolScheduler:
+    return _scheduler
+
+
+def set_scheduler(scheduler: None | PoolScheduler) -> None:
+    """Makes the runs use the scheduler (None means a new adaptive one)."""
+
+    global _scheduler
+    _scheduler = PoolScheduler() if scheduler is None else scheduler
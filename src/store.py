@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Any, Iterable
+
+from src.types_ import FORECAST
+from src.utils import DAY_HOURS_END, DAY_HOURS_START, SUITABLE_CONDITIONS
+
+
+# the stats depend on the analysis rules as much as on the data
+_RULES = json.dumps([DAY_HOURS_START, DAY_HOURS_END, SUITABLE_CONDITIONS])
+
+# the day fingerprint -> its stats
+KNOWN_DAYS = dict[str, dict[str, Any]]
+
+
+def body_fingerprint(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def day_fingerprint(forecast: FORECAST) -> str:
+    """Returns the digest of the day fields the aggregation reads."""
+
+    hours = [
+        [hour.get("hour"), hour.get("temp"), hour.get("condition")]
+        for hour in forecast.get("hours") or ()
+    ]
+    data = json.dumps([_RULES, forecast.get("date"), hours], separators=(",", ":"))
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+class ResultStore:
+    """The persisted per-(city, date) fingerprints and stats.
+
+    A city also keeps the fingerprint of its last response body, so
+    an unchanged response is neither parsed nor aggregated again.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS bodies (
+                    city TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS days (
+                    city TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    date TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    stats TEXT NOT NULL,
+                    PRIMARY KEY (city, position)
+                );
+                """
+            )
+
+    def body_fingerprint(self, city: str) -> None | str:
+        row = self._conn.execute(
+            "SELECT fingerprint FROM bodies WHERE city = ?", (city,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def known_days(self, city: str) -> KNOWN_DAYS:
+        rows = self._conn.execute(
+            "SELECT fingerprint, stats FROM days WHERE city = ?", (city,)
+        )
+        return {fp: json.loads(stats) for fp, stats in rows}
+
+    def load(self, city: str) -> None | dict[str, Any]:
+        """Returns the stored result of the city in the main_task format."""
+
+        rows = self._conn.execute(
+            "SELECT stats FROM days WHERE city = ? ORDER BY position", (city,)
+        ).fetchall()
+        if not rows and self.body_fingerprint(city) is None:
+            return None
+        return {"days": [json.loads(stats) for stats, in rows]}
+
+    def load_results(self, cities: Iterable[str]) -> dict[str, dict[str, Any]]:
+        return {
+            city: result for city in cities if (result := self.load(city)) is not None
+        }
+
+    def save(
+        self,
+        city: str,
+        days: list[dict[str, Any]],
+        fingerprints: list[str],
+        body_fp: None | str = None,
+    ) -> None:
+        """Replaces the stored days (and the body fingerprint) of the city."""
+
+        with self._conn:
+            self._conn.execute("DELETE FROM days WHERE city = ?", (city,))
+            self._conn.executemany(
+                "INSERT INTO days VALUES (?, ?, ?, ?, ?)",
+                [
+                    (city, position, day["date"], fp, json.dumps(day))
+                    for position, (day, fp) in enumerate(zip(days, fingerprints))
+                ],
+            )
+            if body_fp is None:
+                self._conn.execute("DELETE FROM bodies WHERE city = ?", (city,))
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO bodies VALUES (?, ?)", (city, body_fp)
+                )
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,213 @@
+import codecs
+import json
+import re
+from typing import Any, Callable, Generator, Iterable
+
+from src.types_ import FORECAST
+
+
+# the only fields the aggregation reads
+DAY_FIELDS = ("date", "hours")
+HOUR_FIELDS = ("hour", "temp", "condition")
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# the characters that may follow a complete number or literal
+_DELIMITERS = frozenset(",}] \t\n\r")
+_decoder = json.JSONDecoder()
+
+# a parsing step, it yields whenever it needs more data
+_STEP = Generator[None, None, Any]
+
+
+class _Found(Exception):
+    """The forecasts are complete, the rest of the body is not parsed."""
+
+
+def _trim(value: Any, fields: tuple[str, ...]) -> Any:
+    if not isinstance(value, dict):
+        return value
+    return {field: value[field] for field in fields if field in value}
+
+
+class ForecastStreamParser:
+    """Extracts `forecasts[].date` and `forecasts[].hours[]` from a body stream.
+
+    The chunks are parsed as they are fed, the sections the aggregation
+    does not read are skipped one value at a time and the hours are trimmed
+    to `hour`, `temp` and `condition`. So a body is never held as a whole
+    and neither is its full dict tree.
+    """
+
+    def __init__(self):
+        self._decode = codecs.getincrementaldecoder("utf-8-sig")().decode
+        self._buffer = ""
+        self._pos = 0
+        self._final = False
+        self._found = False
+        self._result: Any = None
+        self._forecasts: Any = None
+        self._days: list[FORECAST] = []
+        self._steps = self._parse()
+        self.done = False
+
+    def feed(self, chunk: bytes) -> list[FORECAST]:
+        """Parses the chunk, returns the days completed by it."""
+
+        if not self.done:
+            self._buffer = self._buffer[self._pos :] + self._decode(chunk)
+            self._pos = 0
+            self._resume()
+        days, self._days = self._days, []
+        return days
+
+    def close(self) -> None | list[FORECAST]:
+        """Returns the forecasts like `parse_forecasts` does."""
+
+        if not self.done:
+            self._buffer = self._buffer[self._pos :] + self._decode(b"", True)
+            self._pos = 0
+            self._final = True
+            self._resume()
+        if not self._result:
+            return None
+        if not self._found:
+            # the same error as indexing the fully decoded body
+            return self._result["forecasts"]
+        return self._forecasts
+
+    def _resume(self) -> None:
+        try:
+            next(self._steps)
+        except StopIteration:
+            self.done = True
+
+    def _peek(self) -> _STEP:
+        """Skips the whitespace and returns the next character."""
+
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._final:
+                raise json.JSONDecodeError("Expecting value", self._buffer, self._pos)
+            yield
+
+    def _expect(self, chars: str) -> _STEP:
+        char = yield from self._peek()
+        if char not in chars:
+            msg = f"Expecting one of {chars!r}"
+            raise json.JSONDecodeError(msg, self._buffer, self._pos)
+        self._pos += 1
+        return char
+
+    def _value(self) -> _STEP:
+        """Decodes the next complete value."""
+
+        first = yield from self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._final:
+                    raise
+                # the retries are amortized by doubling the data to decode
+                needed = 2 * (len(self._buffer) - self._pos)
+                while len(self._buffer) - self._pos < needed and not self._final:
+                    yield
+                continue
+            # a number or a literal may go on in the next chunk: "1." is
+            # decoded as 1, so it is complete only before a delimiter
+            if (
+                first not in '{["'
+                and not self._final
+                and (end == len(self._buffer) or self._buffer[end] not in _DELIMITERS)
+            ):
+                yield
+                continue
+            self._pos = end
+            return value
+
+    def _members(self, on_member: Callable[[str], _STEP]) -> _STEP:
+        yield from self._expect("{")
+        if (yield from self._peek()) == "}":
+            self._pos += 1
+            return
+        while True:
+            key = yield from self._value()
+            yield from self._expect(":")
+            yield from on_member(key)
+            if (yield from self._expect(",}")) == "}":
+                return
+
+    def _items(self, on_item: Callable[[], _STEP]) -> _STEP:
+        yield from self._expect("[")
+        if (yield from self._peek()) == "]":
+            self._pos += 1
+            return
+        while True:
+            yield from on_item()
+            if (yield from self._expect(",]")) == "]":
+                return
+
+    def _parse(self) -> _STEP:
+        if (yield from self._peek()) != "{":
+            self._result = yield from self._value()
+            return
+        # the keys only, the skipped values are not kept
+        self._result = {}
+        try:
+            yield from self._members(self._root_member)
+        except _Found:
+            pass
+
+    def _root_member(self, key: str) -> _STEP:
+        self._result[key] = None
+        if key != "forecasts":
+            yield from self._value()
+            return
+        self._found = True
+        if (yield from self._peek()) != "[":
+            self._forecasts = yield from self._value()
+            raise _Found
+        self._forecasts = []
+        yield from self._items(self._day_item)
+        raise _Found
+
+    def _day_item(self) -> _STEP:
+        if (yield from self._peek()) != "{":
+            day = yield from self._value()
+        else:
+            day = {}
+
+            def day_member(key: str) -> _STEP:
+                if key not in DAY_FIELDS:
+                    yield from self._value()
+                elif key == "hours":
+                    # a day of hours is small, one decoding call is cheaper
+                    # than walking them hour by hour
+                    hours = yield from self._value()
+                    if isinstance(hours, list):
+                        hours = [_trim(hour, HOUR_FIELDS) for hour in hours]
+                    day[key] = hours
+                else:
+                    day[key] = yield from self._value()
+
+            yield from self._members(day_member)
+        self._forecasts.append(day)
+        self._days.append(day)
+
+
+def parse_forecasts_streaming(
+    chunks: bytes | Iterable[bytes],
+) -> None | list[FORECAST]:
+    """Returns the forecasts of the body (or its chunks), trimmed to the
+    fields the aggregation reads."""
+
+    if isinstance(chunks, bytes):
+        chunks = (chunks,)
+    parser = ForecastStreamParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.done:
+            break
+    return parser.close()
@@ -1,119 +1,1018 @@
+import asyncio
 import logging
-from collections import defaultdict
+import queue
+import threading
 from concurrent.futures import (
-    ProcessPoolExecutor,
+    Executor,
     ThreadPoolExecutor,
     as_completed,
     Future,
 )
+from contextlib import ExitStack, contextmanager
+from functools import partial
+import io
 import json
-from typing import Any, TextIO
+import math
+import os
+import pickle
+import time
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, TextIO
 
-from src.core import fetch_forecasts, aggregate_forecast_stats
-from src.exceptions import YandexWeatherAPIError
-from src.types_ import FORECAST
-from src.utils import check_python_version, FETCH_TIMEOUT
+import httpx
+
+from src.cache import ResponseCache
+from src.cluster import Coordinator
+from src.coalesce import (
+    MISSING,
+    FetchCoalescer,
+    get_coalescer,
+    group_by_source,
+    set_coalescer,
+    source_key,
+)
+from src.core import (
+    AGGREGATORS,
+    fetch_forecasts,
+    fetch_forecasts_async,
+    fetch_forecasts_raw,
+    fetch_forecasts_raw_async,
+    fetch_forecasts_streaming,
+    fetch_forecasts_streaming_async,
+    make_async_client,
+    parse_forecasts,
+    ResidentClient,
+)
+from src.exceptions import TaskError, YandexWeatherAPIError
+from src.history import HistoryStore
+from src.metrics import get_metrics
+from src.profiles import ProfileSet
+from src.ranking import CityRanker
+from src.scheduler import PoolScheduler, executor_workers, get_scheduler
+from src.registry import CityRegistry, get_default_registry, set_default_registry
+from src.resilience import get_fetch_policy, set_fetch_policy, FetchPolicy
+from src.store import (
+    body_fingerprint,
+    day_fingerprint,
+    KNOWN_DAYS,
+    ResultStore,
+)
+from src.types_ import FETCHED, FORECAST
+from src.utils import (
+    AGGREGATION_ENGINES,
+    check_python_version,
+    CHUNKS_PER_WORKER,
+    FETCH_CONCURRENCY,
+    FETCH_MODES,
+    FETCH_TIMEOUT,
+    get_canonical_city_name,
+    MAX_CHUNK_SIZE,
+    MAX_CONNECTIONS,
+    OUTPUT_FORMATS,
+    STREAM_QUEUE_SIZE,
+)
+from src.writers import write_results
 
 
 logging.basicConfig(level=logging.INFO)
 
 
 def fetch_forecasts_task(
-    city_name: str, timeout: None | float
-) -> tuple[str, None | list[FORECAST]]:
-    """Fetches the forecasts for the city."""
+    city_name: str,
+    timeout: None | float,
+    cache: None | ResponseCache = None,
+    raw: bool = False,
+    streaming: bool = False,
+) -> tuple[str, FETCHED]:
+    """Fetches the forecasts (or the undecoded body if `raw`) for the city.
 
-    forecasts = None
+    The concurrent fetches of the same URL (and kind) are shared.
+    """
+
+    forecasts: FETCHED = None
+    fetch = fetch_forecasts_streaming if streaming else fetch_forecasts
+    if raw:
+        fetch = fetch_forecasts_raw
+    key = (source_key(city_name), fetch.__name__)
     try:
-        forecasts = fetch_forecasts(city=city_name, timeout=timeout)
+        forecasts = get_coalescer().fetch(
+            key, fetch, city=city_name, timeout=timeout, cache=cache
+        )
     except YandexWeatherAPIError as e:
         msg = f"Cannot request data for the city {city_name!r}: {e}"
         logging.error(msg)
+        get_metrics().inc("fetch_errors_total")
     except KeyError as e:
         msg = f'The key "forecasts" does not exist for the city {city_name!r}: {e}'
         logging.error(msg)
+        get_metrics().inc("fetch_errors_total")
     return (city_name, forecasts)
 
 
-def aggregate_forecasts_task(city_name: str, forecasts: list[FORECAST]):
-    """Returns the analysed forecasts for the city."""
+async def fetch_forecasts_async_task(
+    city_name: str,
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    timeout: None | float,
+    cache: None | ResponseCache = None,
+    raw: bool = False,
+    streaming: bool = False,
+) -> tuple[str, FETCHED]:
+    """Fetches the forecasts for the city within the concurrency bound."""
 
-    stats = None
+    forecasts: FETCHED = None
+    fetch = fetch_forecasts_streaming_async if streaming else fetch_forecasts_async
+    if raw:
+        fetch = fetch_forecasts_raw_async
+    key = (source_key(city_name), fetch.__name__)
+    async with semaphore:
+        try:
+            forecasts = await get_coalescer().fetch_async(
+                key,
+                lambda: fetch(
+                    city=city_name, client=client, timeout=timeout, cache=cache
+                ),
+            )
+        except (YandexWeatherAPIError, httpx.HTTPError) as e:
+            msg = f"Cannot request data for the city {city_name!r}: {e}"
+            logging.error(msg)
+            get_metrics().inc("fetch_errors_total")
+        except KeyError as e:
+            msg = f'The key "forecasts" does not exist for the city {city_name!r}: {e}'
+            logging.error(msg)
+            get_metrics().inc("fetch_errors_total")
+    return (city_name, forecasts)
+
+
+async def fetch_all_forecasts_async(
+    city_names: Iterable[str],
+    timeout: None | float = FETCH_TIMEOUT,
+    concurrency: int = FETCH_CONCURRENCY,
+    max_connections: None | int = MAX_CONNECTIONS,
+    client: None | httpx.AsyncClient = None,
+    cache: None | ResponseCache = None,
+    raw: bool = False,
+    streaming: bool = False,
+) -> AsyncIterator[tuple[str, FETCHED]]:
+    """Yields (city, forecasts) pairs in the order of completion.
+
+    `concurrency` workers pull the cities one by one and wait while as
+    many results are not taken, so a slow consumer slows the fetching.
+
+    Args:
+        city_names: Iterable[str] - the cities to fetch
+        timeout: None | float - the timeout for a single request
+        concurrency: int - the number of requests in flight
+        max_connections: None | int - the connection pool size
+        client: None | httpx.AsyncClient - the client to reuse (not closed)
+        cache: None | ResponseCache - the response cache to consult
+        raw: bool - yield the undecoded bodies instead of the forecasts
+        streaming: bool - decode the bodies while they are downloaded
+    """
+
+    if concurrency < 1:
+        raise TaskError(f"concurrency={concurrency} must be positive")
+    semaphore = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    city_iter = iter(city_names)
+    own_client = client is None
+    if client is None:
+        client = make_async_client(max_connections=max_connections)
+
+    async def worker() -> None:
+        # the failure of a worker is passed on to the consumer
+        try:
+            for city in city_iter:
+                await results.put(
+                    await fetch_forecasts_async_task(
+                        city, client, semaphore, timeout, cache, raw, streaming
+                    )
+                )
+        except Exception as e:
+            await results.put(e)
+        else:
+            await results.put(_DONE)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        running = len(workers)
+        while running:
+            item = await results.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if own_client:
+            await client.aclose()
+
+
+def _parse_in_worker(city_name: str, body: bytes) -> None | list[FORECAST]:
     try:
-        stats = aggregate_forecast_stats(forecasts=forecasts)
+        return parse_forecasts(body)
+    except (ValueError, KeyError, TypeError) as e:
+        msg = f"Cannot parse the forecasts for the city {city_name!r}: {e}"
+        logging.error(msg)
+    return None
+
+
+def aggregate_forecasts_task(
+    city_name: str,
+    forecasts: list[FORECAST] | bytes,
+    engine: str = "pydantic",
+    profiles: None | ProfileSet = None,
+):
+    """Returns the analysed forecasts for the city.
+
+    The undecoded response body is parsed here, in the worker process.
+    With the profiles, their stats are under "profiles" by profile name.
+    """
+
+    if isinstance(forecasts, bytes):
+        if not (parsed := _parse_in_worker(city_name, forecasts)):
+            return (city_name, None)
+        forecasts = parsed
+
+    stats, profile_stats = None, None
+    try:
+        stats = AGGREGATORS[engine](forecasts)
+        if profiles is not None:
+            profile_stats = profiles.aggregate(forecasts)
     except Exception as e:
         msg = f"DataAggregationError: {e}"
         logging.error(msg)
-    result = {"days": stats}
+    result: dict[str, Any] = {"days": stats}
+    if profiles is not None:
+        result["profiles"] = profile_stats
     return (city_name, result)
 
 
+def aggregate_incremental_task(
+    city_name: str,
+    forecasts: list[FORECAST] | bytes,
+    engine: str = "pydantic",
+    known: None | KNOWN_DAYS = None,
+) -> tuple[str, None | dict[str, Any], list[str], None | str]:
+    """Returns the analysed forecasts recomputing only the changed days.
+
+    Returns:
+        (city, result, the day fingerprints, the body fingerprint)
+    """
+
+    body_fp = None
+    if isinstance(forecasts, bytes):
+        body_fp = body_fingerprint(forecasts)
+        if not (parsed := _parse_in_worker(city_name, forecasts)):
+            return (city_name, None, [], None)
+        forecasts = parsed
+
+    known = known or {}
+    # the same days the aggregators skip, so the stats align with the days
+    days = [day for day in forecasts if day.get("date") and day.get("hours")]
+    fingerprints = [day_fingerprint(day) for day in days]
+    changed = [day for day, fp in zip(days, fingerprints) if fp not in known]
+    stats = None
+    try:
+        computed = iter(AGGREGATORS[engine](changed))
+        stats = [known[fp] if fp in known else next(computed) for fp in fingerprints]
+    except Exception as e:
+        msg = f"DataAggregationError: {e}"
+        logging.error(msg)
+        return (city_name, {"days": None}, [], None)
+    logging.debug(
+        f"{len(changed)} of {len(days)} days recomputed for the city {city_name!r}"
+    )
+    return (city_name, {"days": stats}, fingerprints, body_fp)
+
+
+def rank_cities_task(
+    cities_days: dict[str, dict[str, Any]], ranker: None | CityRanker = None
+) -> CityRanker:
+    """Feeds the analysed cities to the ranker (a new full one by default)."""
+
+    ranker = CityRanker() if ranker is None else ranker
+    for city, analytics in cities_days.items():
+        ranker.add(city, analytics)
+    return ranker
+
+
 def analyse_forecasts_task(cities_days: dict[str, dict[str, Any]]) -> list[str]:
     """Returns the list of favourable cities."""
 
-    results: dict[tuple[float, int], list[str]] = defaultdict(list)
-    for city, analytics in cities_days.items():
-        days: list[dict[str, Any]] = analytics["days"]
-        total_temp: float = 0.0
-        total_conds: int = 0
-        for day in days:
-            atemp = day["temp_avg"]
-            conds = day["relevant_cond_hours"]
-            if atemp and conds:
-                total_temp += atemp
-                total_conds += conds
-        results[(total_temp, total_conds)].append(city)
-    return results[max(results)]
-
-
-def main_task(city_names: tuple[str], file_object: TextIO):
-    check_python_version()
+    return rank_cities_task(cities_days, CityRanker(k=1)).best()
 
-    if not city_names:
-        logging.info("No cities were given. Exit.")
-        return
 
-    cities = set(cname.lower() for cname in city_names)
-    final_results: dict[str, dict[str, Any]] = {}
-    with ProcessPoolExecutor() as proc_pool, ThreadPoolExecutor() as thread_pool:
-        # fetching data from the YandexWeatherAPI
+def aggregate_forecasts_batch_task(
+    batch: list[tuple[str, list[FORECAST] | bytes]],
+    engine: str = "pydantic",
+    profiles: None | ProfileSet = None,
+) -> list[tuple[str, None | dict[str, Any]]]:
+    """Returns the analysed forecasts for a chunk of cities."""
+
+    return [
+        aggregate_forecasts_task(city_name, forecasts, engine, profiles)
+        for city_name, forecasts in batch
+    ]
+
+
+def auto_chunk_size(cities_count: int, workers: None | int = None) -> int:
+    """Returns the number of cities per process pool call.
+
+    Every worker gets about CHUNKS_PER_WORKER chunks, which amortises
+    the pickling and IPC costs and still balances the load.
+    """
+
+    workers = workers or os.cpu_count() or 1
+    size = math.ceil(cities_count / (workers * CHUNKS_PER_WORKER))
+    return max(1, min(size, MAX_CHUNK_SIZE))
+
+
+def aggregate_incremental_batch_task(
+    batch: list[tuple[str, list[FORECAST] | bytes, KNOWN_DAYS]],
+    engine: str = "pydantic",
+) -> list[tuple[str, None | dict[str, Any], list[str], None | str]]:
+    """Returns the incrementally analysed forecasts for a chunk of cities."""
+
+    return [
+        aggregate_incremental_task(city_name, forecasts, engine, known)
+        for city_name, forecasts, known in batch
+    ]
+
+
+def _submit_observed(proc_pool: Executor, func: Callable, *args: Any) -> Future:
+    """Submits the aggregation observing its pickled size and latency."""
+
+    metrics = get_metrics()
+    if metrics.enabled:
+        # the executor pickles the call in its feeder thread, out of sight
+        with metrics.timer("pickle_seconds"):
+            metrics.inc("pickled_bytes_total", len(pickle.dumps(args)))
+    with metrics.stage("submit"):
+        func, args = metrics.wrap_remote("aggregate", func, *args)
+        future = proc_pool.submit(func, *args)
+    if metrics.enabled:
+        started = time.perf_counter()
+
+        def observe(_: Future):
+            elapsed = time.perf_counter() - started
+            metrics.observe("stage_seconds", elapsed, stage="aggregate")
+
+        future.add_done_callback(observe)
+    return future
+
+
+class _ChunkSubmitter:
+    """Groups the fetched cities into chunks for the process pool.
+
+    With a store the unchanged responses are not submitted at all
+    and the known day stats travel with the city to the worker.
+    """
+
+    def __init__(
+        self,
+        proc_pool: Executor,
+        engine: str,
+        chunk_size: int,
+        store: None | ResultStore = None,
+        profiles: None | ProfileSet = None,
+    ):
+        self.proc_pool = proc_pool
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self.store = store
+        self.profiles = profiles
+        self.futures: list[Future] = []
+        self.unchanged: list[str] = []
+        self._chunk: list[tuple] = []
+
+    def add(self, city: str, forecasts: FETCHED) -> None:
+        if not forecasts:
+            logging.warning(f"no forecasts for the city {city!r}")
+            return
+        if self.store is None:
+            self._chunk.append((city, forecasts))
+        elif isinstance(forecasts, bytes) and self.store.body_fingerprint(
+            city
+        ) == body_fingerprint(forecasts):
+            self.unchanged.append(city)
+            return
+        else:
+            self._chunk.append((city, forecasts, self.store.known_days(city)))
+        if len(self._chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._chunk:
+            if self.store is None:
+                future = _submit_observed(
+                    self.proc_pool,
+                    aggregate_forecasts_batch_task,
+                    self._chunk,
+                    self.engine,
+                    self.profiles,
+                )
+            else:
+                future = _submit_observed(
+                    self.proc_pool,
+                    aggregate_incremental_batch_task,
+                    self._chunk,
+                    self.engine,
+                )
+            self.futures.append(future)
+            self._chunk = []
+
+
+def _fetch_with_threads(
+    submitter: _ChunkSubmitter,
+    cities: Iterable[str],
+    cache: None | ResponseCache,
+    raw: bool,
+    streaming: bool,
+    thread_pool: None | Executor = None,
+) -> None:
+    with ExitStack() as stack:
+        if thread_pool is None:
+            thread_pool = stack.enter_context(ThreadPoolExecutor())
         fetched_futures: list[Future] = [
-            thread_pool.submit(fetch_forecasts_task, city_name, FETCH_TIMEOUT)
+            thread_pool.submit(
+                fetch_forecasts_task, city_name, FETCH_TIMEOUT, cache, raw, streaming
+            )
             for city_name in cities
         ]
-
-        # analysing non-None fetched data for a city
-        analysed_futures = []
         for future in as_completed(
             fetched_futures
         ):  # timeout=FETCH_TIMEOUT * len(cities)
-            city, forecasts = future.result()
+            submitter.add(*future.result())
+    submitter.flush()
+
+
+def _fetch_with_asyncio(
+    submitter: _ChunkSubmitter,
+    cities: Iterable[str],
+    concurrency: int,
+    cache: None | ResponseCache,
+    raw: bool,
+    streaming: bool,
+    resident: None | ResidentClient = None,
+) -> None:
+    async def fetch_and_submit() -> None:
+        async for city, forecasts in fetch_all_forecasts_async(
+            cities,
+            timeout=FETCH_TIMEOUT,
+            concurrency=concurrency,
+            client=None if resident is None else resident.client,
+            cache=cache,
+            raw=raw,
+            streaming=streaming,
+        ):
+            submitter.add(city, forecasts)
+        submitter.flush()
+
+    if resident is None:
+        asyncio.run(fetch_and_submit())
+    else:
+        resident.run(fetch_and_submit())
+
+
+def aggregate_cities_task(
+    proc_pool: Executor,
+    cities: Iterable[str],
+    on_result: Callable[[str, dict[str, Any]], None],
+    mode: str = "threads",
+    concurrency: int = FETCH_CONCURRENCY,
+    cache: None | ResponseCache = None,
+    engine: str = "pydantic",
+    chunk_size: None | int = None,
+    raw: bool = False,
+    streaming: bool = False,
+    store: None | ResultStore = None,
+    profiles: None | ProfileSet = None,
+    thread_pool: None | Executor = None,
+    resident: None | ResidentClient = None,
+) -> list[str]:
+    """Fetches and aggregates the cities, passes every result to `on_result`.
+
+    The cities of the same URL are fetched and aggregated once, the
+    concurrent callers share the stats (see FetchCoalescer). The fetch
+    threads are a new pool unless `thread_pool` is given, the async
+    fetches run in a new loop with a new client unless `resident` is.
+
+    Returns:
+        the cities whose responses the store has found unchanged
+    """
+
+    groups = group_by_source(cities)
+
+    def report(city: str, analysed_result: None | dict[str, Any]) -> None:
+        if not analysed_result:
+            logging.warning(f"no analysed data for the city {city!r}")
+            get_metrics().inc("aggregate_errors_total")
+            return
+        for alias in groups[city]:
+            on_result(alias, analysed_result)
+
+    # the stats of a city are shared with the concurrent callers unless
+    # they are built from the store, which only the caller knows
+    coalescer = get_coalescer()
+    keys: dict[str, tuple] = {}
+    joined: dict[str, Future] = {}
+    if store is None:
+        profiles_key = (
+            None if profiles is None else json.dumps(profiles.to_json(), sort_keys=True)
+        )
+        for city in groups:
+            key = (source_key(city), engine, profiles_key)
+            stats, flight = coalescer.claim_stats(key)
+            if stats is not MISSING:
+                report(city, stats)
+            elif flight is not None:
+                joined[city] = flight
+            else:
+                keys[city] = key
+        cities = list(keys)
+    else:
+        cities = list(groups)
+
+    try:
+        if chunk_size is None:
+            # the chunks are spread over the workers of the pool, not the CPUs
+            chunk_size = auto_chunk_size(len(cities), executor_workers(proc_pool))
+        logging.info(f"Aggregating the cities in chunks of {chunk_size}")
+        submitter = _ChunkSubmitter(proc_pool, engine, chunk_size, store, profiles)
+        # fetching data from the YandexWeatherAPI and
+        # analysing non-None fetched data as soon as a chunk is full
+        if mode == "async":
+            _fetch_with_asyncio(
+                submitter, cities, concurrency, cache, raw, streaming, resident
+            )
+        else:
+            _fetch_with_threads(submitter, cities, cache, raw, streaming, thread_pool)
+
+        # aggregating the successfully analysed results
+        for future in as_completed(submitter.futures):
+            for city, analysed_result, *fingerprints in future.result():
+                if city in keys:
+                    coalescer.land_stats(keys.pop(city), analysed_result)
+                report(city, analysed_result)
+                if (
+                    store is not None
+                    and analysed_result
+                    and analysed_result["days"] is not None
+                ):
+                    for alias in groups[city]:
+                        store.save(alias, analysed_result["days"], *fingerprints)
+    finally:
+        # the cities without a result fail for the followers too
+        for key in keys.values():
+            coalescer.land_stats(key, None)
+    for city, flight in joined.items():
+        report(city, flight.result())
+    return [alias for city in submitter.unchanged for alias in groups[city]]
+
+
+# the end-of-stream marker passed between the pipeline stages
+_DONE = None
+
+
+def _fetch_stage(
+    cities: Iterable[str],
+    fetched: queue.Queue,
+    mode: str,
+    concurrency: int,
+    cache: None | ResponseCache,
+    raw: bool,
+    streaming: bool,
+    stopped: threading.Event,
+) -> None:
+    """Puts (city, forecasts) pairs into the queue as they are downloaded.
+
+    No more cities are fetched once `stopped` is set.
+    """
+
+    try:
+        if mode == "async":
+
+            async def produce():
+                async for pair in fetch_all_forecasts_async(
+                    cities,
+                    timeout=FETCH_TIMEOUT,
+                    concurrency=concurrency,
+                    cache=cache,
+                    raw=raw,
+                    streaming=streaming,
+                ):
+                    if stopped.is_set():
+                        break
+                    await asyncio.to_thread(fetched.put, pair)
+
+            asyncio.run(produce())
+            return
+
+        city_iter = iter(cities)
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    city = next(city_iter, _DONE)
+                if city is _DONE or stopped.is_set():
+                    return
+                try:
+                    fetched.put(
+                        fetch_forecasts_task(city, FETCH_TIMEOUT, cache, raw, streaming)
+                    )
+                except Exception as e:
+                    logging.error(f"Cannot fetch data for the city {city!r}: {e}")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as thread_pool:
+            for _ in range(concurrency):
+                thread_pool.submit(worker)
+    finally:
+        fetched.put(_DONE)
+
+
+def _aggregate_stage(
+    proc_pool: Executor,
+    fetched: queue.Queue,
+    aggregated: queue.Queue,
+    slots: threading.BoundedSemaphore,
+    capacity: int,
+    stopped: threading.Event,
+    engine: str,
+    profiles: None | ProfileSet = None,
+) -> None:
+    """Submits the fetched forecasts to the process pool.
+
+    A slot is taken per submitted city and given back by the write stage,
+    so no more than `capacity` results are in flight or waiting. If the
+    submitting fails, the fetch stage is stopped.
+    """
+
+    def on_done(city: str, future: Future):
+        try:
+            aggregated.put(future.result())
+        except Exception as e:
+            logging.error(f"DataAggregationError for the city {city!r}: {e}")
+            slots.release()
+
+    metrics = get_metrics()
+    try:
+        while (item := fetched.get()) is not _DONE:
+            metrics.set_gauge("queue_depth", fetched.qsize(), queue="fetched")
+            city, forecasts = item
             if not forecasts:
                 logging.warning(f"no forecasts for the city {city!r}")
                 continue
-            analysed_futures.append(
-                proc_pool.submit(aggregate_forecasts_task, city, forecasts)
-            )
+            slots.acquire()
+            try:
+                future = _submit_observed(
+                    proc_pool,
+                    aggregate_forecasts_task,
+                    city,
+                    forecasts,
+                    engine,
+                    profiles,
+                )
+            except BaseException:
+                slots.release()
+                raise
+            future.add_done_callback(partial(on_done, city))
+    except BaseException:
+        # drained, the fetch stage is not blocked on the full queue
+        stopped.set()
+        while fetched.get() is not _DONE:
+            pass
+        raise
+    finally:
+        # all the slots are back once every submitted city has been written
+        for _ in range(capacity):
+            slots.acquire()
+        aggregated.put(_DONE)
 
-        # aggregating the successfully analysed results
-        for future in as_completed(analysed_futures):
-            city, analysed_result = future.result()
+
+def _write_stage(
+    aggregated: queue.Queue,
+    ranked: queue.Queue,
+    slots: threading.BoundedSemaphore,
+    file_object: TextIO,
+    ranker: CityRanker,
+) -> None:
+    """Writes the aggregated results as NDJSON lines, one city per line."""
+
+    metrics = get_metrics()
+    to_file = not file_object.isatty()
+    item = None
+    try:
+        while (item := aggregated.get()) is not _DONE:
+            slots.release()
+            metrics.set_gauge("queue_depth", aggregated.qsize(), queue="aggregated")
+            city, analysed_result = item
             if not analysed_result:
                 logging.warning(f"no analysed data for the city {city!r}")
+                metrics.inc("aggregate_errors_total")
                 continue
-            final_results[city] = analysed_result
-
-    # the results are already aggregated
-    # so we can write them in the main thread...
-    json_data = json.dumps(obj=final_results, indent=2)
-    if not file_object.isatty():
-        with file_object as fout:
-            fout.write(json_data)
-    else:
-        logging.info(json_data)
-    # ...and choose the best cities in the same main thread
-    msg = "No cities to analyse. Exit"
-    if final_results:
-        favourable_cities = analyse_forecasts_task(final_results)
-        msg = f"The best city/cities is/are: {favourable_cities}"
-    logging.info(msg)
+            with metrics.stage("write"):
+                line = json.dumps(obj={"city": city, **analysed_result})
+                if to_file:
+                    file_object.write(line + "\n")
+                    file_object.flush()
+                else:
+                    logging.info(line)
+            ranked.put((city, ranker.score(analysed_result)))
+    finally:
+        ranked.put(_DONE)
+        if to_file:
+            file_object.close()
+        # keep the aggregate stage going if writing has failed
+        while item is not _DONE:
+            if (item := aggregated.get()) is not _DONE:
+                slots.release()
+
+
+def _rank_stage(ranked: queue.Queue, ranker: CityRanker) -> None:
+    """Ranks the cities online while the results arrive."""
+
+    metrics = get_metrics()
+    while (item := ranked.get()) is not _DONE:
+        metrics.set_gauge("queue_depth", ranked.qsize(), queue="ranked")
+        ranker.add_score(*item)
+
+
+def stream_task(
+    city_names: Iterable[str],
+    file_object: TextIO,
+    mode: str = "threads",
+    concurrency: int = FETCH_CONCURRENCY,
+    queue_size: int = STREAM_QUEUE_SIZE,
+    cache: None | ResponseCache = None,
+    engine: str = "pydantic",
+    raw: bool = False,
+    streaming: bool = False,
+    ranker: None | CityRanker = None,
+    profiles: None | ProfileSet = None,
+    scheduler: None | PoolScheduler = None,
+) -> list[str]:
+    """Runs fetch -> aggregate -> write -> rank as concurrent stages.
+
+    The stages are connected with bounded queues, so the memory usage
+    does not depend on the number of cities and the first results are
+    written before the last forecasts are downloaded.
+
+    Returns:
+        the list of favourable cities
+    """
+
+    # the best cities only unless the ranker is asked for more
+    ranker = CityRanker(k=1) if ranker is None else ranker
+
+    if queue_size < 1:
+        raise TaskError(f"queue_size={queue_size} must be positive")
+    fetched: queue.Queue = queue.Queue(maxsize=queue_size)
+    aggregated: queue.Queue = queue.Queue()  # bounded by the slots
+    ranked: queue.Queue = queue.Queue(maxsize=queue_size)
+    slots = threading.BoundedSemaphore(queue_size)
+    stopped = threading.Event()
+    cities = list(city_names)
+    scheduler = get_scheduler() if scheduler is None else scheduler
+    # the fetch stage runs its own `concurrency` threads
+    with scheduler.run(len(cities)) as (proc_pool, _):
+        stages = [
+            threading.Thread(
+                target=_fetch_stage,
+                args=(
+                    cities,
+                    fetched,
+                    mode,
+                    concurrency,
+                    cache,
+                    raw,
+                    streaming,
+                    stopped,
+                ),
+                name="fetch-stage",
+            ),
+            threading.Thread(
+                target=_aggregate_stage,
+                args=(
+                    proc_pool,
+                    fetched,
+                    aggregated,
+                    slots,
+                    queue_size,
+                    stopped,
+                    engine,
+                    profiles,
+                ),
+                name="aggregate-stage",
+            ),
+            threading.Thread(
+                target=_write_stage,
+                args=(aggregated, ranked, slots, file_object, ranker),
+                name="write-stage",
+            ),
+        ]
+        for stage in stages:
+            stage.start()
+        _rank_stage(ranked, ranker)
+        for stage in stages:
+            stage.join()
+    return ranker.best()
+
+
+@contextmanager
+def run_settings(
+    registry: None | CityRegistry = None,
+    policy: None | FetchPolicy = None,
+    coalescer: None | FetchCoalescer = None,
+) -> Iterator[None]:
+    """Installs the given registry, policy and coalescer for a run.
+
+    The settings of the process are restored after the run, so the next
+    run does not inherit them (the ones not given are left as they are).
+    """
+
+    saved = (get_default_registry(), get_fetch_policy(), get_coalescer())
+    if registry is not None:
+        set_default_registry(registry)
+    if policy is not None:
+        set_fetch_policy(policy)
+    if coalescer is not None:
+        set_coalescer(coalescer)
+    try:
+        yield
+    finally:
+        set_default_registry(saved[0])
+        set_fetch_policy(saved[1])
+        set_coalescer(saved[2])
+
+
+def main_task(
+    city_names: tuple[str],
+    file_object: TextIO,
+    mode: str = "threads",
+    concurrency: int = FETCH_CONCURRENCY,
+    stream: bool = False,
+    cache: None | ResponseCache = None,
+    engine: str = "pydantic",
+    chunk_size: None | int = None,
+    raw: bool = False,
+    registry: None | CityRegistry = None,
+    store: None | ResultStore = None,
+    policy: None | FetchPolicy = None,
+    streaming: bool = False,
+    output_format: str = "json",
+    ranker: None | CityRanker = None,
+    cluster: None | Coordinator = None,
+    history: None | HistoryStore = None,
+    profiles: None | ProfileSet = None,
+    scheduler: None | PoolScheduler = None,
+    coalescer: None | FetchCoalescer = None,
+):
+    check_python_version()
+
+    if mode not in FETCH_MODES:
+        raise TaskError(f"unknown fetch mode {mode!r}, expected one of {FETCH_MODES}")
+    if engine not in AGGREGATION_ENGINES:
+        msg = f"unknown engine {engine!r}, expected one of {AGGREGATION_ENGINES}"
+        raise TaskError(msg)
+    if chunk_size is not None and chunk_size < 1:
+        raise TaskError(f"chunk_size={chunk_size} must be positive")
+    if stream and store is not None:
+        raise TaskError("the result store is not supported in the stream mode")
+    if cluster is not None and (stream or store is not None):
+        raise TaskError("the cluster mode supports neither the stream nor the store")
+    if store is not None and profiles is not None:
+        raise TaskError("the result store keeps the default analysis only")
+    if stream and history is not None:
+        raise TaskError("the history is not supported in the stream mode")
+    if output_format not in OUTPUT_FORMATS:
+        msg = f"unknown format {output_format!r}, expected one of {OUTPUT_FORMATS}"
+        raise TaskError(msg)
+    if stream and output_format != "json":
+        raise TaskError("the stream mode writes JSON lines only")
+    if raw and streaming:
+        raise TaskError("the raw bodies are decoded by the workers, not streamed")
+    if not city_names:
+        logging.info("No cities were given. Exit.")
+        return
+
+    with run_settings(registry, policy, coalescer):
+        get_fetch_policy().start()
+        scheduler = get_scheduler() if scheduler is None else scheduler
+        # the aliases of a city are fetched and aggregated once
+        cities = set(get_canonical_city_name(cname) for cname in city_names)
+        if stream:
+            msg = "No cities to analyse. Exit"
+            favourable_cities = stream_task(
+                cities,
+                file_object,
+                mode,
+                concurrency,
+                cache=cache,
+                engine=engine,
+                raw=raw,
+                streaming=streaming,
+                ranker=ranker,
+                profiles=profiles,
+                scheduler=scheduler,
+            )
+            if favourable_cities:
+                msg = f"The best city/cities is/are: {favourable_cities}"
+            logging.info(msg)
+            if ranker is not None and ranker.k is not None:
+                logging.info(f"The top {ranker.k} cities: {ranker.top()}")
+            if get_fetch_policy().expired:
+                logging.warning("The deadline has expired: the results are partial")
+            if cache is not None:
+                cache.log_stats()
+            return
+
+        final_results: dict[str, dict[str, Any]] = {}
+        unchanged: list[str] = []
+        options = dict(
+            mode=mode,
+            concurrency=concurrency,
+            cache=cache,
+            engine=engine,
+            chunk_size=chunk_size,
+            raw=raw,
+            streaming=streaming,
+            profiles=profiles,
+        )
+        if cluster is not None:
+            # the shards are fetched and aggregated by the workers
+            cluster.run(cities, final_results.__setitem__, **options)
+        else:
+            with scheduler.run(len(cities)) as (executor, thread_pool):
+                unchanged = aggregate_cities_task(
+                    executor,
+                    cities,
+                    final_results.__setitem__,
+                    store=store,
+                    thread_pool=thread_pool,
+                    **options,
+                )
+
+        if store is not None:
+            # the stored stats are the ranking source: the unchanged cities
+            # come from there and so do the failed ones, if they were known
+            stored_results = store.load_results(cities)
+            fresh = set(final_results) | set(unchanged)
+            if stale := set(stored_results) - fresh:
+                logging.warning(f"using the stored results for {sorted(stale)}")
+            logging.info(
+                f"Result store: {len(unchanged)} unchanged, "
+                f"{len(final_results)} (re)computed cities"
+            )
+            final_results = stored_results
+
+        if get_fetch_policy().expired:
+            missing = sorted(cities - set(final_results))
+            logging.warning(
+                f"The deadline has expired: the results are partial, "
+                f"{len(final_results)} of {len(cities)} cities, missing {missing}"
+            )
+            get_metrics().set_gauge("missing_cities", len(missing))
+
+        if history is not None:
+            appended = history.append(final_results)
+            logging.info(
+                f"History: {appended} days appended to {str(history.directory)!r}"
+            )
+
+        # the results are already aggregated, so they are ranked
+        # and written with their ratings in the main thread...
+        with get_metrics().stage("rank"):
+            ranker = rank_cities_task(final_results, ranker)
+        ratings = ranker.ratings()
+        with get_metrics().stage("write"):
+            if not file_object.isatty():
+                with file_object as fout:
+                    write_results(final_results, fout, output_format, ratings)
+            elif output_format == "columnar":
+                logging.error("The columnar output is binary, write it to a file")
+            else:
+                text = io.StringIO()
+                write_results(final_results, text, output_format, ratings)
+                logging.info(text.getvalue())
+        # ...and the best cities are reported
+        msg = "No cities to analyse. Exit"
+        if favourable_cities := ranker.best():
+            msg = f"The best city/cities is/are: {favourable_cities}"
+        logging.info(msg)
+        if ranker.k is not None:
+            logging.info(f"The top {ranker.k} cities: {ranker.top()}")
+        for name in profiles.names if profiles is not None else ():
+            profile_results = {
+                city: {"days": result["profiles"][name]}
+                for city, result in final_results.items()
+                if result.get("profiles")
+            }
+            best = analyse_forecasts_task(profile_results)
+            logging.info(f"The best city/cities of the profile {name!r}: {best}")
+        if cache is not None:
+            cache.log_stats()
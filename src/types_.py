@@ -5,6 +5,8 @@ from pydantic import BaseModel, field_validator, NonNegativeInt
 
 
 FORECAST = dict[str, Any]
+# the parsed forecasts or the undecoded response body
+FETCHED = None | list[FORECAST] | bytes
 
 
 class HourInfo(BaseModel):
@@ -1,11 +1,60 @@
+import os
 import sys
 
+from src.registry import get_default_registry, normalize_city_name
+
 
 MIN_MAJOR_PYTHON_VER = 3
 MIN_MINOR_PYTHON_VER = 9
 
 FETCH_TIMEOUT = 5.0
 
+FETCH_MODES = ("threads", "async")
+FETCH_CONCURRENCY = 32
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 5.0
+
+STREAM_QUEUE_SIZE = 64
+
+DAY_HOURS_START = 9
+DAY_HOURS_END = 19
+
+AGGREGATION_ENGINES = ("pydantic", "columnar", "compact")
+CHUNKS_PER_WORKER = 4
+MAX_CHUNK_SIZE = 64
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "yandex-weather")
+CACHE_TTL = 3600.0
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+OUTPUT_FORMATS = ("json", "compact", "csv", "tsv", "columnar")
+ROW_GROUP_SIZE = 4096
+
+FETCH_RETRIES = 0
+BACKOFF_BASE = 0.1
+BACKOFF_MAX = 2.0
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 256
+BREAKER_COOLDOWN = 30.0
+
+SHARDS_PER_WORKER = 4
+WORKER_CONNECT_TIMEOUT = 30.0
+
+DAEMON_REFRESH = 600.0
+
+# the in-memory fetch results, off unless a TTL is given
+MEMO_TTL = 0.0
+MEMO_MAX_ENTRIES = 256
+
+# the adaptive pool sizing: run a few cities (or cheap work) inline,
+# and give a process at least PROCESS_MIN_SECONDS of aggregation
+INLINE_MAX_CITIES = 2
+PROCESS_SPAWN_SECONDS = 0.02
+PROCESS_MIN_SECONDS = 0.05
+MAX_FETCH_THREADS = 32
+
 CITIES = {
     "MOSCOW": "https://code.s3.yandex.net/async-module/moscow-response.json",
     "PARIS": "https://code.s3.yandex.net/async-module/paris-response.json",
@@ -55,6 +104,8 @@ SUITABLE_CONDITIONS = [
     "cloudy",
     "overcast",
 ]
+# for the membership tests on the hot paths
+SUITABLE_CONDITIONS_SET = frozenset(SUITABLE_CONDITIONS)
 
 
 def check_python_version():
@@ -70,4 +121,14 @@ def check_python_version():
 
 
 def get_url_by_city_name(city_name: str) -> str:
-    return CITIES[city_name.upper()]
+    if (registry := get_default_registry()) is not None:
+        return registry.get_url(city_name)
+    return CITIES[normalize_city_name(city_name)]
+
+
+def get_canonical_city_name(city_name: str) -> str:
+    """Returns the name that identifies the city and all its aliases."""
+
+    if (registry := get_default_registry()) is not None and city_name in registry:
+        return registry.canonical_name(city_name).lower()
+    return normalize_city_name(city_name).lower() or city_name.lower()
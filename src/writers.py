@@ -0,0 +1,280 @@
+import abc
+import csv
+import json
+import math
+import struct
+import sys
+from array import array
+from typing import Any, BinaryIO, Iterable, TextIO
+
+from src.exceptions import TaskError
+from src.utils import ROW_GROUP_SIZE
+
+try:
+    import orjson
+except ImportError:  # the compact writer falls back to the json module
+    orjson = None
+
+
+# the row labels of the README table
+TEMPERATURE_ROW = "Temperature, average"
+DRY_HOURS_ROW = "No precipitation, hours"
+
+
+class ResultWriter(abc.ABC):
+    """Writes the results city by city, so the output is never held whole.
+
+    Args:
+        file_object: TextIO - the output, a binary writer uses its buffer
+    """
+
+    def __init__(self, file_object: TextIO):
+        self.file_object = file_object
+
+    def open(self, dates: list[str]) -> None:
+        """Starts the output, `dates` are all the dates of the results."""
+
+    @abc.abstractmethod
+    def write(self, city: str, result: dict[str, Any], rating: None | int) -> None:
+        """Writes the result of the city with its rating."""
+
+    def close(self) -> None:
+        """Completes the output, the file object is left open."""
+
+
+class JSONWriter(ResultWriter):
+    """The indented JSON object of the cities, as `json.dumps(indent=2)`."""
+
+    def open(self, dates: list[str]) -> None:
+        self._first = True
+
+    def write(self, city: str, result: dict[str, Any], rating: None | int) -> None:
+        body = json.dumps(result, indent=2).replace("\n", "\n  ")
+        self.file_object.write("{\n  " if self._first else ",\n  ")
+        self.file_object.write(f"{json.dumps(city)}: {body}")
+        self._first = False
+
+    def close(self) -> None:
+        self.file_object.write("{}" if self._first else "\n}")
+
+
+def _dumps_compact(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+class CompactJSONWriter(JSONWriter):
+    """The JSON object of the cities without whitespace, with orjson if any."""
+
+    def write(self, city: str, result: dict[str, Any], rating: None | int) -> None:
+        self.file_object.write("{" if self._first else ",")
+        self.file_object.write(f"{json.dumps(city)}:{_dumps_compact(result)}")
+        self._first = False
+
+    def close(self) -> None:
+        self.file_object.write("{}" if self._first else "}")
+
+
+def _mean(values: Iterable[None | float]) -> None | float:
+    present = [value for value in values if value is not None]
+    return round(sum(present) / len(present), 3) if present else None
+
+
+def _cell(value: Any) -> Any:
+    return "" if value is None else value
+
+
+class TableWriter(ResultWriter):
+    """The README table: a temperature and a dry hours row per city.
+
+    City/day | | <date> ... | Average | Rating
+    """
+
+    delimiter = ","
+
+    def open(self, dates: list[str]) -> None:
+        self._dates = dates
+        self._writer = csv.writer(
+            self.file_object, delimiter=self.delimiter, lineterminator="\n"
+        )
+        self._writer.writerow(["City/day", "", *dates, "Average", "Rating"])
+
+    def write(self, city: str, result: dict[str, Any], rating: None | int) -> None:
+        days = {day["date"]: day for day in result["days"] or ()}
+        temps = [
+            days[date_]["temp_avg"] if date_ in days else None for date_ in self._dates
+        ]
+        dry_hours = [
+            days[date_]["relevant_cond_hours"] if date_ in days else None
+            for date_ in self._dates
+        ]
+        self._writer.writerows(
+            [
+                [
+                    city,
+                    TEMPERATURE_ROW,
+                    *map(_cell, temps),
+                    _cell(_mean(temps)),
+                    _cell(rating),
+                ],
+                [
+                    "",
+                    DRY_HOURS_ROW,
+                    *map(_cell, dry_hours),
+                    _cell(_mean(dry_hours)),
+                    "",
+                ],
+            ]
+        )
+
+
+class TSVWriter(TableWriter):
+    delimiter = "\t"
+
+
+# the columns of the binary format: (name, array typecode or "s" for text)
+COLUMNS = (
+    ("city", "s"),
+    ("date", "s"),
+    ("hours_start", "h"),
+    ("hours_end", "h"),
+    ("hours_count", "h"),
+    ("temp_avg", "d"),
+    ("relevant_cond_hours", "h"),
+    # the dense ratings of the large runs do not fit a short
+    ("rating", "i"),
+)
+COLUMNAR_MAGIC = b"YWCOL2\n"
+_GROUP = struct.Struct("<4sI")
+# a missing integer, the missing floats are NaN
+NULL_INT = -1
+
+
+def _pack_column(typecode: str, values: list[Any]) -> bytes:
+    if typecode == "s":
+        data = "\0".join(values).encode()
+        return struct.pack("<I", len(data)) + data
+    if typecode == "d":
+        column = array("d", (math.nan if v is None else v for v in values))
+    else:
+        column = array(typecode, (NULL_INT if v is None else v for v in values))
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+class ColumnarWriter(ResultWriter):
+    """A little-endian columnar binary format of one row per (city, day).
+
+    The rows are written in groups of ROW_GROUP_SIZE, every group holds
+    its columns one after another (see COLUMNS), read with `read_columnar`.
+    """
+
+    def __init__(self, file_object: TextIO, group_size: int = ROW_GROUP_SIZE):
+        super().__init__(file_object)
+        try:
+            self.stream: BinaryIO = file_object.buffer  # type: ignore[attr-defined]
+        except AttributeError:
+            raise TaskError("the columnar output needs a binary file") from None
+        self.group_size = group_size
+        self._rows: list[tuple[Any, ...]] = []
+
+    def open(self, dates: list[str]) -> None:
+        self.file_object.flush()
+        self.stream.write(COLUMNAR_MAGIC)
+
+    def write(self, city: str, result: dict[str, Any], rating: None | int) -> None:
+        for day in result["days"] or ():
+            self._rows.append(
+                (
+                    city,
+                    day["date"] or "",
+                    day["hours_start"],
+                    day["hours_end"],
+                    day["hours_count"],
+                    day["temp_avg"],
+                    day["relevant_cond_hours"],
+                    rating,
+                )
+            )
+            if len(self._rows) >= self.group_size:
+                self._flush_group()
+
+    def _flush_group(self) -> None:
+        if not self._rows:
+            return
+        self.stream.write(_GROUP.pack(b"ROWS", len(self._rows)))
+        for (_, typecode), values in zip(COLUMNS, zip(*self._rows)):
+            self.stream.write(_pack_column(typecode, list(values)))
+        self._rows = []
+
+    def close(self) -> None:
+        self._flush_group()
+        self.stream.write(_GROUP.pack(b"END.", 0))
+        self.stream.flush()
+
+
+def read_columnar(stream: BinaryIO) -> dict[str, list[Any]]:
+    """Returns the columns of a ColumnarWriter output (None for missing)."""
+
+    if stream.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("not a columnar results file")
+    columns: dict[str, list[Any]] = {name: [] for name, _ in COLUMNS}
+    while True:
+        tag, rows = _GROUP.unpack(stream.read(_GROUP.size))
+        if tag == b"END.":
+            return columns
+        for name, typecode in COLUMNS:
+            if typecode == "s":
+                (size,) = struct.unpack("<I", stream.read(4))
+                columns[name].extend(stream.read(size).decode().split("\0"))
+                continue
+            column = array(typecode)
+            column.frombytes(stream.read(rows * column.itemsize))
+            if sys.byteorder == "big":
+                column.byteswap()
+            if typecode == "d":
+                columns[name].extend(None if math.isnan(v) else v for v in column)
+            else:
+                columns[name].extend(None if v == NULL_INT else v for v in column)
+
+
+WRITERS: dict[str, type[ResultWriter]] = {
+    "json": JSONWriter,
+    "compact": CompactJSONWriter,
+    "csv": TableWriter,
+    "tsv": TSVWriter,
+    "columnar": ColumnarWriter,
+}
+
+
+def write_results(
+    results: dict[str, dict[str, Any]],
+    file_object: TextIO,
+    output_format: str = "json",
+    ratings: None | dict[str, int] = None,
+) -> None:
+    """Writes the results of the cities in the format incrementally.
+
+    Args:
+        results: dict[str, dict[str, Any]] - the analysed data of the cities
+        file_object: TextIO - the output, left open
+        output_format: str - one of WRITERS
+        ratings: None | dict[str, int] - the rating of a city, if any
+    """
+
+    ratings = ratings or {}
+    writer = WRITERS[output_format](file_object)
+    dates = sorted(
+        {
+            day["date"]
+            for result in results.values()
+            for day in result["days"] or ()
+            if day["date"]
+        }
+    )
+    writer.open(dates)
+    for city, result in results.items():
+        writer.write(city, result, ratings.get(city))
+    writer.close()
@@ -0,0 +1,74 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from benchmarks.generator import generate_forecasts
+from external.analyzer import (
+    analyze_batch,
+    analyze_json,
+    load_data,
+    load_data_mmap,
+)
+
+
+EXAMPLES = Path(__file__).parent.parent / "examples"
+RESPONSE = EXAMPLES / "response.json"
+
+
+@pytest.fixture
+def archive(tmp_path: Path) -> Path:
+    root = tmp_path / "archive"
+    for day in ("2022-05-26", "2022-05-27"):
+        (root / day).mkdir(parents=True)
+        for city in ("moscow", "paris"):
+            forecasts = generate_forecasts(days=3, seed=f"{day}-{city}")
+            (root / day / f"{city}.json").write_text(
+                json.dumps({"forecasts": forecasts})
+            )
+    (root / "broken.json").write_text('{"forecasts": [')
+    (root / "notes.txt").write_text("not a response")
+    return root
+
+
+def test_results_are_independent():
+    first = analyze_json(load_data(str(RESPONSE)))
+    days = list(first["days"])
+
+    second = analyze_json({"forecasts": []})
+
+    assert second == {"days": []}
+    assert first["days"] == days
+
+
+def test_mmap_load(tmp_path: Path):
+    empty = tmp_path / "empty.json"
+    empty.write_bytes(b"")
+
+    assert load_data_mmap(str(RESPONSE)) == load_data(str(RESPONSE))
+    assert load_data_mmap(str(empty)) is None
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_batch(archive: Path, tmp_path: Path, jobs: int):
+    summary = analyze_batch([str(archive)], str(tmp_path / f"out{jobs}"), jobs)
+
+    assert len(summary["files"]) == 4
+    assert list(summary["errors"]) == [str(archive / "broken.json")]
+    assert summary["stats"]["files"] == 5
+    assert summary["stats"]["days"] == 12
+    assert summary["stats"]["jobs"] == jobs
+    written = tmp_path / f"out{jobs}" / "2022-05-26" / "moscow.json"
+    assert json.loads(written.read_text()) == analyze_json(
+        load_data(str(archive / "2022-05-26" / "moscow.json"))
+    )
+
+
+def test_batch_globs(archive: Path):
+    summary = analyze_batch([str(archive / "*" / "paris.json"), str(RESPONSE)], jobs=1)
+
+    assert sorted(summary["files"]) == sorted(
+        [str(archive / day / "paris.json") for day in ("2022-05-26", "2022-05-27")]
+        + [str(RESPONSE)]
+    )
+    assert summary["files"][str(RESPONSE)]["days"] == 5
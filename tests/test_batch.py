@@ -0,0 +1,68 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from src import tasks
+from src.scheduler import PoolScheduler
+from src.utils import MAX_CHUNK_SIZE
+
+
+RESPONSE_PATH = Path(__file__).parent.parent / "examples" / "response.json"
+BODY = RESPONSE_PATH.read_bytes()
+CITIES = ("moscow", "paris", "london", "berlin", "kazan")
+
+
+@pytest.fixture
+def fake_fetch(monkeypatch):
+    def fetch_forecasts_task(
+        city_name, timeout, cache=None, raw=False, streaming=False
+    ):
+        return (city_name, BODY if raw else json.loads(BODY)["forecasts"])
+
+    monkeypatch.setattr(tasks, "fetch_forecasts_task", fetch_forecasts_task)
+
+
+@pytest.mark.parametrize(
+    ("cities_count", "workers", "size"),
+    [(0, 4, 1), (1, 4, 1), (16, 4, 1), (17, 4, 2), (10**6, 4, MAX_CHUNK_SIZE)],
+)
+def test_auto_chunk_size(cities_count: int, workers: int, size: int):
+    assert tasks.auto_chunk_size(cities_count, workers) == size
+
+
+def test_chunks_follow_the_pool_workers(monkeypatch, caplog, fake_fetch):
+    monkeypatch.setattr(tasks.os, "cpu_count", lambda: 64)
+    cities = [f"city{i}" for i in range(16)]
+    scheduler = PoolScheduler(processes=2)
+    try:
+        with caplog.at_level("INFO"), scheduler.run(len(cities)) as (executor, _):
+            tasks.aggregate_cities_task(executor, cities, lambda *_: None)
+    finally:
+        scheduler.close()
+
+    # 2 workers x CHUNKS_PER_WORKER chunks, not 64 x 4 chunks of one city
+    assert "in chunks of 2" in caplog.text
+
+
+def test_aggregate_forecasts_batch_task():
+    forecasts = json.loads(BODY)["forecasts"]
+
+    parsed = tasks.aggregate_forecasts_batch_task([("a", forecasts)])
+    raw = tasks.aggregate_forecasts_batch_task([("a", BODY), ("b", b"{}")])
+
+    assert raw == parsed + [("b", None)]
+
+
+@pytest.mark.parametrize(
+    ("chunk_size", "raw"), [(1, False), (2, False), (None, False), (None, True)]
+)
+def test_main_task_chunks(fake_fetch, tmp_path: Path, chunk_size, raw: bool):
+    out = tmp_path / "out.json"
+    with open(out, "w") as fout:
+        tasks.main_task(CITIES, fout, chunk_size=chunk_size, raw=raw)
+
+    results = json.loads(out.read_text())
+    assert sorted(results) == sorted(CITIES)
+    expected = tasks.aggregate_forecasts_task("moscow", BODY)[1]
+    assert all(result == expected for result in results.values())
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from benchmarks import models
+from benchmarks.generator import generate_forecasts, generate_response
+from benchmarks.run import percentile
+from benchmarks.server import RESPONSE_PATH, registered_cities, serve
+from src.core import fetch_forecasts
+from src.exceptions import YandexWeatherAPIError
+from src.utils import CITIES
+
+
+def test_generate_forecasts():
+    forecasts = generate_forecasts(days=3, hours=24, seed="moscow")
+
+    assert len(forecasts) == 3
+    assert all(len(day["hours"]) == 24 for day in forecasts)
+    assert forecasts == generate_forecasts(days=3, hours=24, seed="moscow")
+
+
+def test_generate_response_payload_size():
+    response = generate_response(days=1, payload_size=50_000)
+
+    assert len(json.dumps(response)) == 50_000
+
+
+@pytest.mark.parametrize(
+    ("values", "q", "expected"),
+    [([], 50, 0.0), ([3.0, 1.0, 2.0], 50, 2.0), (list(range(1, 101)), 99, 99)],
+)
+def test_percentile(values, q, expected):
+    assert percentile(values, q) == expected
+
+
+def test_fetch_from_local_server():
+    with serve(days=2) as server, registered_cities(
+        server.base_url, ["example", "city1"]
+    ):
+        example = fetch_forecasts("example")
+        synthetic = fetch_forecasts("city1")
+
+    assert example == json.loads(RESPONSE_PATH.read_text())["forecasts"]
+    assert len(synthetic) == 2
+    assert "CITY1" not in CITIES
+
+
+def test_server_errors():
+    with serve(error_rate=1.0) as server, registered_cities(server.base_url, ["city1"]):
+        with pytest.raises(YandexWeatherAPIError):
+            fetch_forecasts("city1")
+
+
+def test_models_comparison():
+    results = {result["model"]: result for result in models.run(days=50)}
+
+    assert results["DayRecord"]["objects"] == results["DayInfo"]["objects"] == 50
+    for name in ("Day", "Stats"):
+        record, model = results[f"{name}Record"], results[f"{name}Info"]
+        assert record["bytes_per_object"] < model["bytes_per_object"]
@@ -0,0 +1,75 @@
+import json
+import os
+from pathlib import Path
+
+import httpx
+import pytest
+
+from src import core
+from src.cache import ResponseCache
+from src.utils import get_url_by_city_name
+
+
+FORECASTS = [{"date": "2022-05-18", "hours": []}]
+BODY = json.dumps({"forecasts": FORECASTS}).encode()
+ETAG = '"v1"'
+
+
+@pytest.fixture
+def requests_log(monkeypatch) -> list[httpx.Request]:
+    log: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        log.append(request)
+        if request.headers.get("If-None-Match") == ETAG:
+            return httpx.Response(304, headers={"ETag": ETAG})
+        return httpx.Response(200, content=BODY, headers={"ETag": ETAG})
+
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(core, "httpx_client", client)
+    return log
+
+
+def test_fresh_hit(tmp_path: Path, requests_log: list[httpx.Request]):
+    cache = ResponseCache(tmp_path)
+
+    assert core.fetch_forecasts("moscow", cache=cache) == FORECASTS
+    assert core.fetch_forecasts("moscow", cache=cache) == FORECASTS
+
+    assert len(requests_log) == 1
+    assert (cache.hits, cache.misses, cache.revalidated) == (1, 1, 0)
+
+
+def test_revalidation(tmp_path: Path, requests_log: list[httpx.Request]):
+    cache = ResponseCache(tmp_path, ttl=0.0)
+
+    assert core.fetch_forecasts("moscow", cache=cache) == FORECASTS
+    assert core.fetch_forecasts("moscow", cache=cache) == FORECASTS
+
+    assert len(requests_log) == 2
+    assert requests_log[1].headers["If-None-Match"] == ETAG
+    assert (cache.hits, cache.misses, cache.revalidated) == (0, 1, 1)
+
+
+def test_persistence(tmp_path: Path, requests_log: list[httpx.Request]):
+    core.fetch_forecasts("moscow", cache=ResponseCache(tmp_path))
+    cache = ResponseCache(tmp_path)
+
+    assert core.fetch_forecasts("moscow", cache=cache) == FORECASTS
+    assert len(requests_log) == 1
+    assert cache.hits == 1
+
+
+def test_lru_eviction(tmp_path: Path, requests_log: list[httpx.Request]):
+    cache = ResponseCache(tmp_path, max_size=2 * len(BODY) + 400)
+    cities = ["moscow", "paris", "london"]
+    for n, city in enumerate(cities):
+        core.fetch_forecasts(city, cache=cache)
+        # the older the entry the earlier its access time
+        url = get_url_by_city_name(city)
+        os.utime(cache._path(url), (n, n))
+    core.fetch_forecasts("berlin", cache=cache)
+
+    assert cache.evictions >= 1
+    assert cache.lookup(get_url_by_city_name("moscow")) is None
+    assert cache.lookup(get_url_by_city_name("berlin")) is not None
@@ -0,0 +1,115 @@
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from benchmarks.server import registered_cities, serve
+from src.cluster import Coordinator, parse_address, recv_message, send_message
+from src.exceptions import TaskError
+from src.tasks import main_task
+
+CITIES = [f"city{i}" for i in range(12)]
+
+
+def _run(tmp_path: Path, name: str, cluster: None | Coordinator) -> dict:
+    path = tmp_path / f"{name}.json"
+    with open(path, "w") as fout:
+        main_task(tuple(CITIES), fout, cluster=cluster)
+    return json.loads(path.read_text())
+
+
+def test_messages():
+    left, right = socket.socketpair()
+    with left, right, right.makefile("rb") as reader:
+        send_message(left, {"type": "result", "city": "x", "result": {"days": []}})
+        send_message(left, {"type": "done"})
+        left.close()
+
+        assert recv_message(reader) == {
+            "type": "result",
+            "city": "x",
+            "result": {"days": []},
+        }
+        assert recv_message(reader) == {"type": "done"}
+        assert recv_message(reader) is None
+
+
+def test_parse_address():
+    assert parse_address("localhost:8000") == ("localhost", 8000)
+    with pytest.raises(TaskError):
+        parse_address("localhost")
+    with pytest.raises(TaskError):
+        Coordinator(local_workers=0)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_same_output_as_a_single_host(tmp_path: Path, workers: int):
+    with serve(days=3) as server, registered_cities(server.base_url, CITIES):
+        expected = _run(tmp_path, "single", None)
+        actual = _run(tmp_path, "cluster", Coordinator(local_workers=workers))
+
+    assert len(expected) == len(CITIES)
+    assert actual == expected
+
+
+def test_shard_of_a_lost_worker_is_requeued(tmp_path: Path):
+    coordinator = Coordinator(local_workers=1, remote_workers=1)
+    results: dict = {}
+
+    def lost_worker():
+        # connects once the coordinator listens, leaves with its first shard
+        while coordinator.address[1] == 0:
+            threading.Event().wait(0.01)
+        with socket.create_connection(coordinator.address) as sock:
+            with sock.makefile("rb") as reader:
+                recv_message(reader)
+                recv_message(reader)
+
+    thread = threading.Thread(target=lost_worker)
+    with serve(days=2) as server, registered_cities(server.base_url, CITIES):
+        thread.start()
+        lost = coordinator.run(CITIES, results.__setitem__)
+    thread.join()
+
+    assert lost == []
+    assert sorted(results) == sorted(CITIES)
+
+
+def test_no_known_cities_start_no_worker(monkeypatch: pytest.MonkeyPatch):
+    started = []
+    monkeypatch.setattr(
+        "subprocess.Popen", lambda *args, **kwargs: started.append(args)
+    )
+    results: dict = {}
+
+    lost = Coordinator(local_workers=1).run(["nowhere1"], results.__setitem__)
+
+    assert (lost, results, started) == ([], {}, [])
+
+
+def test_spare_workers_do_not_delay_the_run(tmp_path: Path):
+    coordinator = Coordinator(local_workers=3, shards_per_worker=1)
+    results: dict = {}
+    start = time.monotonic()
+    with serve(days=2) as server, registered_cities(server.base_url, ["city1"]):
+        lost = coordinator.run(["city1"], results.__setitem__)
+
+    assert lost == [] and list(results) == ["city1"]
+    assert time.monotonic() - start < coordinator.connect_timeout
+
+
+def test_local_workers_share_the_cpus(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+
+    assert Coordinator(local_workers=4).worker_args() == ["--cpus", "2"]
+    assert Coordinator(local_workers=16).worker_args() == ["--cpus", "1"]
+    assert Coordinator(threads=3, processes=2).worker_args() == [
+        "--threads",
+        "3",
+        "--processes",
+        "2",
+    ]
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from benchmarks.server import registered_cities, serve
+from src import coalesce, tasks, utils
+from src.coalesce import (
+    MISSING,
+    FetchCoalescer,
+    SingleFlight,
+    TTLMemo,
+    group_by_source,
+)
+from src.scheduler import InlineExecutor
+from src.tasks import aggregate_cities_task, fetch_forecasts_task, main_task
+
+
+def test_concurrent_calls_share_a_flight():
+    flights = SingleFlight()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(value: int) -> list[int]:
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return [value]
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("k", slow, 1)))
+    leader.start()
+    started.wait(5)
+    followers = [
+        threading.Thread(target=lambda: results.append(flights.do("k", slow, 2)))
+        for _ in range(4)
+    ]
+    for follower in followers:
+        follower.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert calls == [1]
+    assert len(results) == 5
+    assert all(result is results[0] for result in results)
+    # the next call is a new flight
+    assert flights.do("k", lambda: "again") == "again"
+
+
+def test_followers_get_the_exception():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ValueError("failed")
+
+    errors = []
+
+    def call():
+        try:
+            flights.do("k", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 2
+
+
+def test_async_flights():
+    flights = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"calls": calls}
+
+    async def run():
+        return await asyncio.gather(*(flights.do_async("k", fetch) for _ in range(5)))
+
+    results = asyncio.run(run())
+
+    assert calls == 1
+    assert results == [{"calls": 1}] * 5
+
+
+def test_memo_expires_and_evicts(monkeypatch: pytest.MonkeyPatch):
+    now = [100.0]
+    monkeypatch.setattr(coalesce.time, "monotonic", lambda: now[0])
+    memo = TTLMemo(ttl=10, max_entries=2)
+
+    memo.put("a", 1)
+    memo.put("b", 2)
+    assert memo.get("a") == 1
+    memo.put("c", 3)
+    assert memo.get("b") is MISSING
+    now[0] += 11
+    assert memo.get("a") is MISSING
+    assert len(memo) == 1
+    assert TTLMemo(ttl=0).enabled is False
+
+
+def test_memoized_fetch():
+    coalescer = FetchCoalescer(ttl=60)
+    calls = []
+
+    def fetch(city: str):
+        calls.append(city)
+        return None if city == "none" else [city]
+
+    assert coalescer.fetch("url", fetch, "moscow") == ["moscow"]
+    assert coalescer.fetch("url", fetch, "moscow") == ["moscow"]
+    # the failed fetches are not memoized
+    coalescer.fetch("none", fetch, "none")
+    coalescer.fetch("none", fetch, "none")
+
+    assert calls == ["moscow", "none", "none"]
+
+
+def test_cities_of_a_url_are_grouped(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setitem(utils.CITIES, "MOSKVA", utils.CITIES["MOSCOW"])
+
+    assert group_by_source(["moscow", "paris", "moskva", "nowhere"]) == {
+        "moscow": ["moscow", "moskva"],
+        "paris": ["paris"],
+        "nowhere": ["nowhere"],
+    }
+
+
+def test_cities_of_a_url_are_fetched_once(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    with serve(days=2) as server, registered_cities(server.base_url, ["city1"]):
+        monkeypatch.setitem(utils.CITIES, "TOWN1", utils.CITIES["CITY1"])
+        with open(tmp_path / "out.json", "w") as fout:
+            main_task(("city1", "town1"), fout)
+        requests_count = server.requests_count
+
+    results = json.loads((tmp_path / "out.json").read_text())
+    assert requests_count == 1
+    assert results["city1"] == results["town1"]
+
+
+def test_fetch_task_uses_the_memo():
+    coalescer = FetchCoalescer(ttl=60)
+    coalesce.set_coalescer(coalescer)
+    try:
+        with serve(days=2) as server, registered_cities(server.base_url, ["city1"]):
+            first = fetch_forecasts_task("city1", utils.FETCH_TIMEOUT)
+            second = fetch_forecasts_task("city1", utils.FETCH_TIMEOUT)
+            requests_count = server.requests_count
+    finally:
+        coalesce.set_coalescer(None)
+
+    assert requests_count == 1
+    assert first[1] is second[1]
+
+
+def test_concurrent_callers_share_the_stats(monkeypatch: pytest.MonkeyPatch):
+    aggregated = []
+    aggregate = tasks.aggregate_forecasts_task
+
+    def counting(city_name: str, *args):
+        aggregated.append(city_name)
+        return aggregate(city_name, *args)
+
+    monkeypatch.setattr(tasks, "aggregate_forecasts_task", counting)
+    results: list[tuple[str, dict]] = []
+
+    def call():
+        aggregate_cities_task(
+            InlineExecutor(), ["city1"], lambda *result: results.append(result)
+        )
+
+    with serve(days=2, latency=0.2) as server, registered_cities(
+        server.base_url, ["city1"]
+    ):
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        requests_count = server.requests_count
+
+    assert aggregated == ["city1"]
+    assert requests_count == 1
+    assert len(results) == 5
+    assert all(stats is results[0][1] for _, stats in results)
+
+
+def test_memoized_stats_are_per_engine():
+    coalescer = FetchCoalescer(ttl=60)
+    coalesce.set_coalescer(coalescer)
+    results: list[tuple[str, dict]] = []
+    try:
+        with serve(days=2) as server, registered_cities(server.base_url, ["city1"]):
+            for engine in ("pydantic", "pydantic", "compact"):
+                aggregate_cities_task(
+                    InlineExecutor(),
+                    ["city1"],
+                    lambda *result: results.append(result),
+                    engine=engine,
+                )
+    finally:
+        coalesce.set_coalescer(None)
+
+    assert len(results) == 3
+    assert results[0][1] is results[1][1]
+    assert results[2][1] is not results[0][1]
+    assert results[2][1] == results[0][1]
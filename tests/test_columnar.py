@@ -0,0 +1,65 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from src.columnar import aggregate_forecast_stats_columnar
+from src.core import aggregate_forecast_stats
+from src.types_ import FORECAST
+from src.utils import SUITABLE_CONDITIONS
+
+
+RESPONSE_PATH = Path(__file__).parent.parent / "examples" / "response.json"
+
+
+@pytest.mark.parametrize(
+    "forecasts",
+    [
+        [{}],
+        [{"date": None, "hours": None}],
+        [{"date": "2024-08-09", "hours": []}],
+        [
+            {
+                "date": "2024-08-09",
+                "hours": [
+                    {"hour": "10", "temp": None, "condition": SUITABLE_CONDITIONS[2]}
+                ],
+            }
+        ],
+        [
+            {
+                "date": "2022-05-13",
+                "hours": [
+                    {"hour": "20", "temp": "4.1", "condition": "nonono"},
+                    {"hour": "14", "temp": 1, "condition": "nonono"},
+                    {"hour": "12", "temp": 2, "condition": SUITABLE_CONDITIONS[0]},
+                    {"hour": "9", "temp": "4", "condition": SUITABLE_CONDITIONS[1]},
+                    {"hour": "7", "temp": "4.1", "condition": "nonono"},
+                ],
+            }
+        ],
+        [
+            {
+                "date": "2022-05-14",
+                "hours": [
+                    {"hour": "11", "temp": 0.1, "condition": "clear"},
+                    {"hour": "10", "temp": 0.2, "condition": "clear"},
+                    {"hour": "19", "temp": -0.3, "condition": "overcast"},
+                    {"hour": "300", "temp": 5, "condition": "clear"},
+                ],
+            }
+        ],
+    ],
+)
+def test_columnar_matches_pydantic(forecasts: list[FORECAST]):
+    assert aggregate_forecast_stats_columnar(forecasts) == aggregate_forecast_stats(
+        forecasts
+    )
+
+
+def test_columnar_matches_pydantic_on_response():
+    forecasts = json.loads(RESPONSE_PATH.read_text())["forecasts"]
+
+    assert aggregate_forecast_stats_columnar(forecasts) == aggregate_forecast_stats(
+        forecasts
+    )
@@ -0,0 +1,90 @@
+import json
+import pickle
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from src.compact import (
+    aggregate_forecast_stats_compact,
+    select_day_record,
+    StatsRecord,
+)
+from src.core import aggregate_forecast_stats, select_forecast_days
+from src.types_ import FORECAST
+from src.utils import SUITABLE_CONDITIONS
+
+
+RESPONSE_PATH = Path(__file__).parent.parent / "examples" / "response.json"
+FORECASTS = json.loads(RESPONSE_PATH.read_text())["forecasts"]
+
+
+@pytest.mark.parametrize(
+    "forecasts",
+    [
+        [{}],
+        [{"date": None, "hours": None}],
+        [{"date": "2024-08-09", "hours": []}],
+        [
+            {
+                "date": "2024-08-09",
+                "hours": [
+                    {"hour": "10", "temp": None, "condition": SUITABLE_CONDITIONS[2]}
+                ],
+            }
+        ],
+        [
+            {
+                "date": "2022-05-14",
+                "hours": [
+                    {"hour": "11", "temp": 0.1, "condition": "clear"},
+                    {"hour": "10", "temp": 0.2, "condition": "clear"},
+                    {"hour": "19", "temp": -0.3, "condition": "overcast"},
+                    {"hour": "300", "temp": 5, "condition": "clear"},
+                    {"hour": "12", "temp": "4", "condition": "nonono"},
+                ],
+            }
+        ],
+        FORECASTS,
+    ],
+)
+def test_compact_matches_pydantic(forecasts: list[FORECAST]):
+    assert aggregate_forecast_stats_compact(forecasts) == aggregate_forecast_stats(
+        forecasts
+    )
+
+
+def test_records_have_the_same_json():
+    models = select_forecast_days(FORECASTS)
+    records = [day for day in map(select_day_record, FORECASTS) if day is not None]
+
+    assert [day.to_json() for day in records] == [day.to_json() for day in models]
+    assert [day.to_model() for day in records] == models
+    for record in records:
+        stats = record.stats()
+        assert stats.to_json() == stats.to_model().to_json()
+
+
+def test_records_are_pickled_compactly():
+    records = [day for day in map(select_day_record, FORECASTS) if day is not None]
+    models = select_forecast_days(FORECASTS)
+
+    restored = pickle.loads(pickle.dumps(records))
+
+    assert [day.to_json() for day in restored] == [day.to_json() for day in records]
+    assert len(pickle.dumps(records)) < len(pickle.dumps(models))
+
+
+@pytest.mark.parametrize(
+    "stats",
+    [
+        StatsRecord(date(2022, 5, 18), 12, 10, 3, None, 3),
+        StatsRecord(date(2022, 5, 18), 10, 12, 0, None, 0),
+        StatsRecord(date(2022, 5, 18), -1, 12, 3, None, 3),
+    ],
+)
+def test_stats_validation(stats: StatsRecord):
+    with pytest.raises(ValueError):
+        stats.validate()
+    with pytest.raises(ValueError):
+        stats.to_model()
@@ -0,0 +1,140 @@
+import http.client
+import json
+import socket
+import threading
+from pathlib import Path
+
+import pytest
+
+from benchmarks import startup
+from benchmarks.server import registered_cities, serve
+from src import tasks
+from src.daemon import WeatherDaemon, make_server
+from src.scheduler import PoolScheduler
+from src.tasks import rank_cities_task
+
+CITIES = ["city1", "city2", "city3"]
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def _get(connection: http.client.HTTPConnection, path: str) -> tuple[int, dict]:
+    connection.request("GET", path)
+    response = connection.getresponse()
+    return (response.status, json.loads(response.read()))
+
+
+def test_results_are_kept_warm():
+    with serve(days=2) as server, registered_cities(server.base_url, CITIES):
+        with WeatherDaemon(refresh=None) as daemon:
+            results = daemon.results(CITIES)
+            requests_count = server.requests_count
+            ranking = daemon.rank(CITIES)
+
+            assert sorted(results) == CITIES
+            assert server.requests_count == requests_count
+            assert ranking["ratings"] == rank_cities_task(results).ratings()
+
+            daemon.max_age = 0.0
+            daemon.results(["city1"])
+
+            assert server.requests_count == requests_count + 1
+
+
+def test_background_refresh():
+    with serve(days=2) as server, registered_cities(server.base_url, CITIES):
+        with WeatherDaemon(CITIES, refresh=60.0) as daemon:
+            while daemon.refreshed_at is None:
+                threading.Event().wait(0.01)
+
+            assert daemon.health()["cities"] == len(CITIES)
+
+
+def test_async_updates_share_a_client(monkeypatch: pytest.MonkeyPatch):
+    def no_client(*args, **kwargs):
+        raise AssertionError("a new client per update")
+
+    monkeypatch.setattr(tasks, "make_async_client", no_client)
+    with serve(days=2) as server, registered_cities(server.base_url, CITIES):
+        with WeatherDaemon(refresh=None, mode="async") as daemon:
+            client = daemon._resident.client
+            daemon.update(CITIES)
+            daemon.update(CITIES[:1])
+
+            assert sorted(daemon.results()) == CITIES
+            assert daemon._resident.client is client
+            assert not client.is_closed
+    assert client.is_closed
+
+
+def test_updates_lease_the_scheduler():
+    scheduler = PoolScheduler(threads=2, processes=0)
+    try:
+        with serve(days=2) as server, registered_cities(server.base_url, CITIES):
+            with WeatherDaemon(refresh=None, scheduler=scheduler) as daemon:
+                daemon.update(CITIES)
+
+                assert sorted(daemon.results()) == CITIES
+                assert scheduler.pool_size("threads") == 2
+    finally:
+        scheduler.close()
+
+
+@pytest.mark.parametrize("unix", [False, True])
+def test_http_queries(tmp_path: Path, unix: bool):
+    address = f"unix:{tmp_path / 'daemon.sock'}" if unix else "127.0.0.1:0"
+    with serve(days=2) as server, registered_cities(server.base_url, CITIES):
+        with WeatherDaemon(refresh=None) as daemon, make_server(
+            address, daemon
+        ) as daemon_server:
+            thread = threading.Thread(target=daemon_server.serve_forever)
+            thread.start()
+            if unix:
+                connection = _UnixConnection(str(tmp_path / "daemon.sock"))
+            else:
+                connection = http.client.HTTPConnection(
+                    *daemon_server.server_address[:2]
+                )
+            try:
+                status, results = _get(connection, "/aggregate?city=city1&city=city2")
+                assert status == 200
+                assert sorted(results) == ["city1", "city2"]
+
+                status, ranking = _get(connection, "/rank?city=city1&top=1")
+                assert status == 200
+                assert ranking["top"] == ranking["best"] == ["city1"]
+
+                status, _ = _get(connection, "/rank?top=zero")
+                assert status == 400
+                status, _ = _get(connection, "/nowhere")
+                assert status == 404
+                status, health = _get(connection, "/health")
+                assert health["cities"] == 2
+
+                def broken(*args):
+                    raise RuntimeError("the pool is broken")
+
+                daemon.results = broken
+                status, error = _get(connection, "/aggregate?city=city3")
+                assert status == 500
+                assert "the pool is broken" in error["error"]
+            finally:
+                connection.close()
+                daemon_server.shutdown()
+                thread.join()
+
+
+def test_import_time():
+    assert (
+        0
+        < startup.import_time("src.utils", repeat=1)
+        < startup.import_time("src.tasks", repeat=1)
+    )
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from benchmarks.differential import (
+    ENGINES,
+    REFERENCE,
+    Engine,
+    analyzer_reference,
+    check,
+    compare_speed,
+    random_forecasts,
+)
+
+
+@pytest.mark.parametrize("name", list(ENGINES))
+def test_engine_matches_its_reference(name: str):
+    assert check({name: ENGINES[name]}, cases=300, seed=name) == []
+
+
+def test_mismatch_is_shrunk():
+    def no_averages(forecasts):
+        return [{**day, "temp_avg": None} for day in REFERENCE(forecasts)]
+
+    (mismatch,) = check({"broken": Engine(no_averages, REFERENCE)}, cases=50)
+
+    (day,) = mismatch.forecasts
+    assert len(day["hours"]) == 1
+    assert mismatch.expected[0]["temp_avg"] is not None
+    assert mismatch.actual[0]["temp_avg"] is None
+
+
+def test_core_and_analyzer_semantics_differ():
+    forecasts = [
+        {
+            "date": "2022-05-26",
+            "hours": [
+                {"hour": "10", "temp": 10.7, "condition": "clear"},
+                {"hour": "11", "temp": 20, "condition": "rain"},
+            ],
+        }
+    ]
+
+    (core,) = REFERENCE(forecasts)
+    (analyzer,) = analyzer_reference(forecasts)
+
+    assert (core["hours_count"], core["temp_avg"]) == (1, 10.7)
+    assert (analyzer["hours_count"], analyzer["temp_avg"]) == (2, 15.0)
+    assert core["relevant_cond_hours"] == analyzer["relevant_cond_hours"] == 1
+
+
+def test_clean_payloads_suit_the_analyzer():
+    rnd = random.Random(22)
+
+    for _ in range(100):
+        for day in random_forecasts(rnd, messy=False):
+            assert day["date"] and isinstance(day["hours"], list)
+            assert all(hour["temp"] is not None for hour in day["hours"])
+
+
+def test_speed_comparison():
+    results = {result["engine"]: result for result in compare_speed(days=20, repeat=1)}
+
+    assert list(results) == list(ENGINES)
+    assert results["pydantic"]["speedup"] == 1.0
+    assert all(result["days_per_second"] > 0 for result in results.values())
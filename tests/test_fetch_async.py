@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from benchmarks.server import registered_cities
+from src.core import fetch_forecasts_async
+from src.exceptions import YandexWeatherAPIError
+from src.tasks import fetch_all_forecasts_async
+
+
+FORECASTS = [{"date": "2022-05-18", "hours": []}]
+
+
+def _handler(request: httpx.Request) -> httpx.Response:
+    if "moscow" in request.url.path:
+        return httpx.Response(200, content=json.dumps({"forecasts": FORECASTS}))
+    return httpx.Response(404)
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_fetch_forecasts_async():
+    async def fetch():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as c:
+            return await fetch_forecasts_async("moscow", client=c)
+
+    assert _run(fetch()) == FORECASTS
+
+
+@pytest.mark.parametrize("city", ["1", "paris"])
+def test_fetch_forecasts_async_errors(city: str):
+    async def fetch():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as c:
+            return await fetch_forecasts_async(city, client=c)
+
+    with pytest.raises(YandexWeatherAPIError):
+        _run(fetch())
+
+
+def test_fetch_all_forecasts_async():
+    async def fetch_all():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as c:
+            return [
+                pair
+                async for pair in fetch_all_forecasts_async(
+                    ["moscow", "paris", "1"], concurrency=2, client=c
+                )
+            ]
+
+    results = dict(_run(fetch_all()))
+    assert results == {"moscow": FORECASTS, "paris": None, "1": None}
+
+
+def test_slow_consumer_slows_the_fetches():
+    cities = [f"city{i}" for i in range(200)]
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(request.url.path)
+        return httpx.Response(200, content=json.dumps({"forecasts": FORECASTS}))
+
+    async def consume(count: int) -> int:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as c:
+            pairs = fetch_all_forecasts_async(cities, concurrency=4, client=c)
+            async for _ in pairs:
+                count -= 1
+                if not count:
+                    break
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            await pairs.aclose()
+        return len(requested)
+
+    with registered_cities("http://weather.test", cities):
+        requests_count = _run(consume(5))
+
+    # the taken results, the queued ones and those in flight at most
+    assert requests_count <= 5 + 4 + 4
@@ -0,0 +1,98 @@
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from benchmarks.server import registered_cities, serve
+from src.history import HistoryStore, _column_path
+from src.tasks import main_task
+
+
+def _day(date_: str, temp: None | float, hours: int) -> dict:
+    return {
+        "date": date_,
+        "hours_start": 9,
+        "hours_end": 9 + hours,
+        "hours_count": hours,
+        "temp_avg": temp,
+        "relevant_cond_hours": hours,
+    }
+
+
+RESULTS = {
+    "moscow": {"days": [_day("2022-05-26", 10.0, 4), _day("2022-05-27", None, 2)]},
+    "paris": {"days": [_day("2022-05-26", 20.0, 6), _day("2022-05-28", 22.0, 8)]},
+    "nowhere": {"days": None},
+}
+
+
+@pytest.fixture
+def history(tmp_path: Path):
+    history = HistoryStore(tmp_path / "history")
+    yield history
+    history.close()
+
+
+def test_scan_round_trip(history: HistoryStore):
+    assert history.append(RESULTS, recorded_at=1.0) == 4
+
+    rows = list(history.scan())
+    assert [(row.city, row.date.isoformat()) for row in rows] == [
+        ("moscow", "2022-05-26"),
+        ("moscow", "2022-05-27"),
+        ("paris", "2022-05-26"),
+        ("paris", "2022-05-28"),
+    ]
+    assert rows[1].temp_avg is None
+    assert rows[0]._asdict() == {
+        "city": "moscow",
+        "date": date(2022, 5, 26),
+        "recorded_at": 1.0,
+        **{k: v for k, v in _day("2022-05-26", 10.0, 4).items() if k != "date"},
+    }
+
+
+def test_range_and_city_queries(history: HistoryStore):
+    history.append(RESULTS)
+
+    rows = history.scan(start=date(2022, 5, 27), cities=["paris", "unknown"])
+    assert [row.date for row in rows] == [date(2022, 5, 28)]
+    assert history.city_averages(end=date(2022, 5, 27)) == {
+        "moscow": {"days": 2, "temp_avg": 10.0, "relevant_cond_hours": 3.0},
+        "paris": {"days": 1, "temp_avg": 20.0, "relevant_cond_hours": 6.0},
+    }
+
+
+def test_later_runs_supersede_the_days(tmp_path: Path, history: HistoryStore):
+    history.append(RESULTS, recorded_at=1.0)
+    history.append({"paris": {"days": [_day("2022-05-28", 30.0, 8)]}}, 2.0)
+    history.close()
+
+    reopened = HistoryStore(tmp_path / "history")
+    assert len(reopened) == 5
+    assert reopened.city_averages(cities=["paris"])["paris"]["temp_avg"] == 25.0
+    assert [row.recorded_at for row in reopened.scan(cities=["paris"])] == [1.0, 2.0]
+    reopened.close()
+
+
+def test_interrupted_append_is_dropped(tmp_path: Path, history: HistoryStore):
+    history.append(RESULTS)
+    history.close()
+    with open(_column_path(tmp_path / "history", "city"), "ab") as fout:
+        fout.write(b"\1\0\0\0")
+
+    reopened = HistoryStore(tmp_path / "history")
+    assert len(reopened) == 4
+    reopened.append({"rome": {"days": [_day("2022-05-26", 25.0, 5)]}})
+    assert [row.city for row in reopened.scan(start=date(2022, 5, 26))][-1] == "rome"
+    assert len(reopened) == 5
+    reopened.close()
+
+
+def test_main_task_appends(tmp_path: Path, history: HistoryStore):
+    with serve(days=3) as server, registered_cities(server.base_url, ["city1"]):
+        with open(tmp_path / "out.json", "w") as fout:
+            main_task(("city1",), fout, history=history)
+
+    assert history.cities() == ["city1"]
+    assert len(list(history.scan())) == 3
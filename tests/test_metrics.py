@@ -0,0 +1,128 @@
+import cProfile
+import json
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from benchmarks.server import registered_cities, serve
+from src import metrics as metrics_module, tasks
+from src.core import fetch_forecasts
+from src.metrics import Metrics, NullMetrics, get_metrics, set_metrics
+
+
+RESPONSE_PATH = Path(__file__).parent.parent / "examples" / "response.json"
+BODY = RESPONSE_PATH.read_bytes()
+
+
+@pytest.fixture
+def metrics(tmp_path: Path):
+    metrics = Metrics(profile_dir=tmp_path / "profiles")
+    set_metrics(metrics)
+    yield metrics
+    set_metrics(None)
+
+
+def test_histogram_export():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        metrics.observe("stage_seconds", value, stage="fetch")
+    metrics.inc("fetch_errors_total")
+    metrics.set_gauge("queue_depth", 3, queue="fetched")
+
+    summary = metrics.to_json()
+    histogram = summary["histograms"]['stage_seconds{stage="fetch"}']
+    assert histogram["count"] == 3
+    assert histogram["max"] == 5.0
+    assert summary["counters"] == {"fetch_errors_total": 1}
+
+    text = metrics.to_prometheus()
+    assert 'stage_seconds_bucket{stage="fetch",le="0.1"} 1' in text
+    assert 'stage_seconds_bucket{stage="fetch",le="1.0"} 2' in text
+    assert 'stage_seconds_bucket{stage="fetch",le="+Inf"} 3' in text
+    assert 'queue_depth{queue="fetched"} 3' in text
+
+
+def test_null_metrics_record_nothing():
+    metrics = NullMetrics()
+    with metrics.stage("fetch"), metrics.timer("pickle_seconds"):
+        metrics.inc("fetch_errors_total")
+    assert metrics.to_json() == {"counters": {}, "gauges": {}, "histograms": {}}
+    assert not get_metrics().enabled
+
+
+def test_stage_profiles_are_dumped(tmp_path: Path):
+    metrics = Metrics(profile_dir=tmp_path)
+    with metrics.stage("rank"):
+        with metrics.stage("write"):
+            sorted(range(1000), reverse=True)
+
+    paths = metrics.dump_profiles()
+
+    assert [path.name for path in paths] == ["rank.prof"]
+    assert pstats.Stats(str(paths[0])).total_calls > 0
+    assert metrics.histograms.keys() == {
+        ("stage_seconds", (("stage", "rank"),)),
+        ("stage_seconds", (("stage", "write"),)),
+    }
+
+
+def test_concurrent_stages_are_profiled_one_at_a_time(metrics: Metrics):
+    cities = [f"city{i}" for i in range(8)]
+    with serve(days=2, latency=0.01) as server, registered_cities(
+        server.base_url, cities
+    ):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            assert all(pool.map(fetch_forecasts, cities))
+
+    (fetch_stage,) = [
+        histogram
+        for (name, labels), histogram in metrics.histograms.items()
+        if labels == (("stage", "fetch"),)
+    ]
+    assert fetch_stage.count == 8
+    assert "fetch.prof" in [path.name for path in metrics.dump_profiles()]
+
+
+def test_stage_is_timed_if_another_profiler_is_active(monkeypatch, metrics: Metrics):
+    class ActiveProfile(cProfile.Profile):
+        def enable(self, *args, **kwargs):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(metrics_module.cProfile, "Profile", ActiveProfile)
+    with metrics.stage("rank"):
+        pass
+
+    assert metrics.dump_profiles() == []
+    assert metrics.histograms[("stage_seconds", (("stage", "rank"),))].count == 1
+
+
+@pytest.mark.parametrize("raw", [False, True])
+def test_main_task_reports_the_stages(
+    monkeypatch, tmp_path: Path, metrics: Metrics, raw: bool
+):
+    def fetch_forecasts_task(
+        city_name, timeout, cache=None, raw=False, streaming=False
+    ):
+        return (city_name, BODY if raw else json.loads(BODY)["forecasts"])
+
+    monkeypatch.setattr(tasks, "fetch_forecasts_task", fetch_forecasts_task)
+    with open(tmp_path / "out.json", "w") as fout:
+        tasks.main_task(("moscow", "paris"), fout, raw=raw)
+    metrics.dump_profiles()
+
+    stages = {
+        dict(labels)["stage"]
+        for name, labels in metrics.histograms
+        if name == "stage_seconds"
+    }
+    assert {"submit", "aggregate", "write", "rank"} <= stages
+    assert metrics.counters[("pickled_bytes_total", ())] > 0
+    profiles = {path.name for path in metrics.profile_dir.iterdir()}
+    assert {"aggregate.prof", "write.prof", "rank.prof"} <= profiles
+
+    metrics.export(tmp_path / "metrics.json")
+    metrics.export(tmp_path / "metrics.prom")
+    assert json.loads((tmp_path / "metrics.json").read_text())["histograms"]
+    assert "# TYPE stage_seconds histogram" in (tmp_path / "metrics.prom").read_text()
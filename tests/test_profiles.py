@@ -0,0 +1,116 @@
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+from benchmarks.generator import generate_forecasts
+from src import tasks
+from src.columnar import CONDITION_CODES
+from src.core import AGGREGATORS
+from src.exceptions import TaskError
+from src.profiles import AnalysisProfile, ProfileSet, load_profiles
+
+
+EXAMPLES = Path(__file__).parent.parent / "examples"
+FORECASTS = json.loads((EXAMPLES / "response.json").read_text())["forecasts"]
+
+
+def test_default_profile_is_the_default_analysis():
+    forecasts = FORECASTS + generate_forecasts(days=20, seed="profiles")
+    profiles = ProfileSet([AnalysisProfile("default")])
+
+    assert profiles.aggregate(forecasts)["default"] == AGGREGATORS["pydantic"](
+        forecasts
+    )
+
+
+def test_one_pass_is_the_same_as_a_pass_per_profile():
+    rng = random.Random(18)
+    conditions = list(CONDITION_CODES)
+    profiles = [
+        AnalysisProfile(
+            f"p{i}",
+            windows=[tuple(sorted(rng.sample(range(24), 2))) for _ in range(2)],
+            conditions=rng.sample(conditions, 5),
+            min_temp=rng.choice([None, 5.0]),
+            max_temp=rng.choice([None, 20.0]),
+        )
+        for i in range(6)
+    ]
+    forecasts = FORECASTS + generate_forecasts(days=20, seed="one-pass")
+
+    combined = ProfileSet(profiles).aggregate(forecasts)
+
+    for profile in profiles:
+        assert (
+            combined[profile.name]
+            == ProfileSet([profile]).aggregate(forecasts)[profile.name]
+        )
+
+
+def test_thresholds_and_windows():
+    profile = AnalysisProfile(
+        "warm-mornings", windows=[(6, 8), (10, 11)], conditions=["clear"], min_temp=10
+    )
+    forecasts = [
+        {
+            "date": "2022-05-26",
+            "hours": [
+                {"hour": "6", "temp": 12, "condition": "clear"},
+                {"hour": "7", "temp": 9, "condition": "clear"},
+                {"hour": "8", "temp": None, "condition": "clear"},
+                {"hour": "9", "temp": 15, "condition": "clear"},
+                {"hour": "10", "temp": 14, "condition": "cloudy"},
+                {"hour": "11", "temp": 16, "condition": "clear"},
+            ],
+        }
+    ]
+
+    (day,) = ProfileSet([profile]).aggregate(forecasts)["warm-mornings"]
+
+    assert day == {
+        "date": "2022-05-26",
+        "hours_start": 6,
+        "hours_end": 11,
+        "hours_count": 2,
+        "temp_avg": 14.0,
+        "relevant_cond_hours": 2,
+    }
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"windows": [(20, 9)]},
+        {"windows": [(0, 24)]},
+        {"conditions": ["sunny"]},
+        {"min_temp": 10, "max_temp": 0},
+    ],
+)
+def test_invalid_profiles(kwargs: dict):
+    with pytest.raises(TaskError):
+        AnalysisProfile("invalid", **kwargs)
+
+
+def test_profile_names_are_unique():
+    with pytest.raises(TaskError):
+        ProfileSet([AnalysisProfile("a"), AnalysisProfile("a")])
+
+
+def test_load_profiles():
+    profiles = load_profiles(EXAMPLES / "profiles.json")
+
+    assert ProfileSet.from_json(profiles.to_json()).to_json() == profiles.to_json()
+    assert profiles.hour_table[8] == 0b010
+    assert profiles.cond_table[CONDITION_CODES["clear"]] == 0b111
+
+
+def test_aggregate_task_adds_the_profiles():
+    profiles = load_profiles(EXAMPLES / "profiles.json")
+
+    _, result = tasks.aggregate_forecasts_task("city", FORECASTS, "compact", profiles)
+
+    assert result["days"] == AGGREGATORS["compact"](FORECASTS)
+    assert result["profiles"] == profiles.aggregate(FORECASTS)
+    assert list(result["profiles"]) == ["daytime", "commute", "beach"]
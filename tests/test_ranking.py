@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from src import tasks
+from src.exceptions import TaskError
+from src.ranking import CityRanker
+
+
+def _analytics(temp: float, hours: int) -> dict:
+    return {"days": [{"temp_avg": temp, "relevant_cond_hours": hours}]}
+
+
+CITIES = {
+    "moscow": _analytics(10.0, 8),
+    "paris": _analytics(20.0, 5),
+    "london": _analytics(20.0, 5),
+    "berlin": _analytics(20.0, 9),
+    "cairo": _analytics(30.0, 1),
+}
+
+
+def test_best_cities_with_ties():
+    assert tasks.analyse_forecasts_task(CITIES) == ["cairo"]
+    assert tasks.analyse_forecasts_task({**CITIES, "giza": CITIES["cairo"]}) == [
+        "cairo",
+        "giza",
+    ]
+
+
+def test_dense_ratings():
+    assert tasks.rank_cities_task(CITIES).ratings() == {
+        "cairo": 1,
+        "berlin": 2,
+        "paris": 3,
+        "london": 3,
+        "moscow": 4,
+    }
+
+
+@pytest.mark.parametrize(
+    ("tie_break", "expected"),
+    [
+        ("ties", ["cairo", "berlin", "paris", "london"]),
+        ("name", ["cairo", "berlin", "london"]),
+        ("first", ["cairo", "berlin", "paris"]),
+    ],
+)
+def test_top_k(tie_break: str, expected: list[str]):
+    ranker = tasks.rank_cities_task(CITIES, CityRanker(k=3, tie_break=tie_break))
+
+    assert ranker.top() == expected
+    assert len(ranker._heap) == 3
+
+
+def test_weights():
+    ranker = tasks.rank_cities_task(CITIES, CityRanker(weights=(1.0, 10.0)))
+
+    # 20 + 90 > 10 + 80 > 20 + 50 = 20 + 50 > 30 + 10
+    assert ranker.top() == ["berlin", "moscow", "paris", "london", "cairo"]
+
+
+def test_top_k_matches_a_full_sort():
+    rnd = random.Random(0)
+    cities = {
+        f"city{i}": _analytics(rnd.randint(0, 30), rnd.randint(0, 11))
+        for i in range(2000)
+    }
+    full = tasks.rank_cities_task(cities).ratings()
+    ranker = tasks.rank_cities_task(cities, CityRanker(k=10))
+
+    assert ranker.ratings() == {
+        city: rating for city, rating in full.items() if rating <= 10
+    }
+    assert len(ranker._groups) == 10
+
+
+@pytest.mark.parametrize("options", [{"k": 0}, {"tie_break": "random"}])
+def test_wrong_options(options: dict):
+    with pytest.raises(TaskError):
+        CityRanker(**options)
@@ -0,0 +1,120 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from src.coalesce import FetchCoalescer, get_coalescer
+from src.exceptions import RegistryError
+from src.registry import (
+    CityRegistry,
+    get_default_registry,
+    normalize_city_name,
+    set_default_registry,
+)
+from src.resilience import FetchPolicy, get_fetch_policy
+from src.tasks import main_task
+from src.utils import CITIES, get_canonical_city_name, get_url_by_city_name
+
+
+URL = "https://example.org/forecasts/{}-response.json"
+
+
+@pytest.fixture
+def default_registry():
+    registry = CityRegistry.from_mapping({"Abu Dhabi": URL.format("abudhabi")})
+    registry.add("Saint Petersburg", URL.format("spb"), aliases=["SPb", "Piter"])
+    set_default_registry(registry)
+    yield registry
+    set_default_registry(None)
+
+
+@pytest.mark.parametrize(
+    ("name", "key"),
+    [("moscow", "MOSCOW"), ("Abu-Dhabi", "ABUDHABI"), (" new_york ", "NEWYORK")],
+)
+def test_normalize_city_name(name: str, key: str):
+    assert normalize_city_name(name) == key
+
+
+def test_registry_files(tmp_path: Path):
+    (tmp_path / "a.json").write_text(
+        json.dumps(
+            {"London": URL.format("london"), "Paris": {"url": URL.format("paris")}}
+        )
+    )
+    (tmp_path / "b.csv").write_text(
+        "name,url,aliases\n" f"Saint Petersburg,{URL.format('spb')},SPb;Piter\n"
+    )
+    (tmp_path / "notes.txt").write_text("ignored")
+
+    registry = CityRegistry.from_path(tmp_path)
+
+    assert len(registry) == 3
+    assert registry.get_url("piter") == URL.format("spb")
+    assert registry.canonical_name("spb") == "SAINTPETERSBURG"
+    assert registry.get_url("PARIS") == URL.format("paris")
+    assert len(registry._prefixes) == 1
+    with pytest.raises(KeyError):
+        registry.get_url("moscow")
+
+
+def test_duplicate_names_are_merged(tmp_path: Path):
+    (tmp_path / "a.json").write_text(
+        json.dumps({"London": URL.format("old"), "Paris": URL.format("paris")})
+    )
+    (tmp_path / "b.csv").write_text(f"name,url\nlondon,{URL.format('london')}\n")
+
+    registry = CityRegistry.from_path(tmp_path)
+
+    assert len(registry) == 2
+    assert sorted(registry) == ["LONDON", "PARIS"]
+    assert registry.get_url("London") == URL.format("london")
+
+
+def test_registry_is_lazy(tmp_path: Path):
+    source = tmp_path / "cities.json"
+    source.write_text("[]")
+    registry = CityRegistry.from_path(source)
+    source.write_text(json.dumps([{"name": "Kazan", "url": URL.format("kazan")}]))
+
+    assert "kazan" in registry
+
+
+@pytest.mark.parametrize("content", ["{", '[{"name": "x"}]'])
+def test_registry_errors(tmp_path: Path, content: str):
+    source = tmp_path / "cities.json"
+    source.write_text(content)
+
+    with pytest.raises(RegistryError):
+        len(CityRegistry.from_path(source))
+    with pytest.raises(RegistryError):
+        CityRegistry.from_path(tmp_path / "missing.json")
+
+
+def test_default_registry(default_registry: CityRegistry):
+    assert get_url_by_city_name("abu dhabi") == URL.format("abudhabi")
+    assert get_canonical_city_name("Piter") == "saintpetersburg"
+    with pytest.raises(KeyError):
+        get_url_by_city_name("moscow")
+
+
+def test_without_registry():
+    assert get_url_by_city_name("Abu Dhabi") == CITIES["ABUDHABI"]
+    assert get_canonical_city_name("Moscow") == "moscow"
+
+
+def test_run_settings_are_restored(tmp_path: Path):
+    policy, coalescer = get_fetch_policy(), get_coalescer()
+    registry = CityRegistry.from_mapping({"Nowhere": URL.format("nowhere")})
+    with open(tmp_path / "out.json", "w") as fout:
+        main_task(
+            ("nowhere",),
+            fout,
+            registry=registry,
+            policy=FetchPolicy(deadline=0.01),
+            coalescer=FetchCoalescer(ttl=60),
+        )
+
+    assert get_default_registry() is None
+    assert get_fetch_policy() is policy
+    assert get_coalescer() is coalescer
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+from pathlib import Path
+
+import pytest
+
+from benchmarks.server import RESPONSE_PATH, registered_cities, serve
+from src import tasks
+from src.core import fetch_forecasts, fetch_forecasts_async, make_async_client
+from src.exceptions import CircuitOpenError, YandexWeatherAPIError
+from src.metrics import Metrics, set_metrics
+from src.resilience import FetchPolicy, LatencyTracker, set_fetch_policy
+
+
+FORECASTS = json.loads(RESPONSE_PATH.read_bytes())["forecasts"]
+
+
+@pytest.fixture(autouse=True)
+def reset_policy():
+    yield
+    set_fetch_policy(None)
+    set_metrics(None)
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = FetchPolicy(backoff_base=0.1, backoff_max=0.5)
+
+    assert all(0 <= policy.backoff(0) <= 0.1 for _ in range(100))
+    assert all(0 <= policy.backoff(10) <= 0.5 for _ in range(100))
+
+
+def test_latency_quantile():
+    tracker = LatencyTracker(window=100)
+    assert tracker.quantile(0.95) is None
+    for ms in range(1, 201):
+        tracker.observe(ms / 1000)
+
+    assert tracker.quantile(0.95) == 0.196
+    assert tracker.quantile(0.95, min_samples=101) is None
+
+
+def test_retries_overcome_the_failures():
+    set_fetch_policy(FetchPolicy(retries=20, backoff_base=0.001))
+    with serve(error_rate=0.5, seed=1) as server, registered_cities(
+        server.base_url, ["example"]
+    ):
+        assert fetch_forecasts("example") == FORECASTS
+    assert server.requests_count > 1
+
+
+def test_retries_are_bounded():
+    set_fetch_policy(FetchPolicy(retries=2, backoff_base=0.001))
+    with serve(error_rate=1.0) as server, registered_cities(
+        server.base_url, ["example"]
+    ):
+        with pytest.raises(YandexWeatherAPIError):
+            fetch_forecasts("example")
+    assert server.requests_count == 3
+
+
+def test_circuit_breaker_skips_the_host():
+    set_fetch_policy(FetchPolicy(breaker_threshold=2, breaker_cooldown=60))
+    with serve(error_rate=1.0) as server, registered_cities(
+        server.base_url, ["example", "city1"]
+    ):
+        for _ in range(2):
+            with pytest.raises(YandexWeatherAPIError):
+                fetch_forecasts("example")
+        # another city of the same host
+        with pytest.raises(CircuitOpenError):
+            fetch_forecasts("city1")
+    assert server.requests_count == 2
+
+
+@pytest.mark.parametrize("is_async", [False, True])
+def test_slow_requests_are_hedged(is_async: bool):
+    metrics = Metrics()
+    set_metrics(metrics)
+    policy = FetchPolicy(hedge=True, hedge_min_samples=1)
+    policy.latencies.observe(0.001)
+    set_fetch_policy(policy)
+
+    async def fetch_async():
+        async with make_async_client() as client:
+            return await fetch_forecasts_async("example", client)
+
+    with serve(latency=0.05) as server, registered_cities(server.base_url, ["example"]):
+        forecasts = (
+            asyncio.run(fetch_async()) if is_async else fetch_forecasts("example")
+        )
+
+    assert forecasts == FORECASTS
+    assert server.requests_count == 2
+    assert metrics.counters[("hedged_requests_total", ())] == 1
+
+
+@pytest.mark.parametrize("mode", ["threads", "async"])
+def test_deadline_gives_partial_results(tmp_path: Path, caplog, mode: str):
+    out = tmp_path / "out.json"
+    with serve(latency=1.0) as server, registered_cities(
+        server.base_url, ["example"]
+    ), caplog.at_level(logging.WARNING), open(out, "w") as fout:
+        tasks.main_task(("example",), fout, mode=mode, policy=FetchPolicy(deadline=0.2))
+
+    assert json.loads(out.read_text()) == {}
+    assert "the results are partial, 0 of 1 cities, missing ['example']" in (
+        caplog.text
+    )
@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from benchmarks.server import registered_cities, serve
+from src.exceptions import TaskError
+from src.scheduler import InlineExecutor, PoolPlan, PoolScheduler
+from src.tasks import main_task
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = PoolScheduler()
+    yield scheduler
+    scheduler.close()
+
+
+def test_few_cities_are_aggregated_inline(scheduler: PoolScheduler):
+    assert scheduler.plan(1).processes == 0
+    assert scheduler.plan(2).processes == 0
+    assert scheduler.plan(3).processes > 0
+
+
+def test_little_work_is_aggregated_inline(scheduler: PoolScheduler):
+    scheduler.aggregate_seconds = 1e-5
+
+    assert scheduler.plan(100).processes == 0
+
+    scheduler.aggregate_seconds = 0.05
+    assert scheduler.plan(100).processes > 0
+
+
+def test_overrides():
+    scheduler = PoolScheduler(threads=3, processes=0, inline_max=0)
+
+    assert scheduler.plan(100) == PoolPlan(3, 0)
+    with pytest.raises(TaskError):
+        PoolScheduler(threads=0)
+    with pytest.raises(TaskError):
+        PoolScheduler(processes=-1)
+    with pytest.raises(TaskError):
+        PoolScheduler(cpus=0)
+
+
+def test_processes_adapt_within_the_cpus(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+
+    assert PoolScheduler().plan(100).processes == 8
+    assert PoolScheduler(cpus=2).plan(100).processes == 2
+
+
+def test_inline_executor():
+    executor = InlineExecutor()
+
+    assert executor.submit(divmod, 7, 2).result() == (3, 1)
+    with pytest.raises(ZeroDivisionError):
+        executor.submit(divmod, 7, 0).result()
+
+
+def test_pools_are_reused(monkeypatch: pytest.MonkeyPatch, scheduler: PoolScheduler):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    with scheduler.run(8):
+        pools = dict(scheduler._pools)
+    # the smaller runs use the larger pools
+    with scheduler.run(3):
+        pass
+    with scheduler.run(2) as (executor, _):
+        assert isinstance(executor.executor, InlineExecutor)
+
+    assert isinstance(pools["processes"], ProcessPoolExecutor)
+    assert scheduler._pools == pools
+
+
+def test_overlapping_runs(monkeypatch: pytest.MonkeyPatch, scheduler: PoolScheduler):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    with scheduler.run(3) as (small_executor, small_threads):
+        small_pools = dict(scheduler._pools)
+        with scheduler.run(8) as (large_executor, large_threads):
+            assert scheduler.pool_size("threads") == 8
+            assert scheduler.pool_size("processes") == 8
+            large = [large_executor.submit(divmod, 7, i) for i in range(1, 9)]
+            large += [large_threads.submit(divmod, 7, i) for i in range(1, 9)]
+        # the replaced pools serve the run leasing them
+        small = [small_executor.submit(divmod, 7, i) for i in range(1, 4)]
+        small += [small_threads.submit(divmod, 7, i) for i in range(1, 4)]
+        assert [future.result() for future in small] == [(7, 0), (3, 1), (2, 1)] * 2
+    assert [future.result() for future in large] == [
+        divmod(7, i) for i in range(1, 9)
+    ] * 2
+
+    # the last lease has shut them down
+    with pytest.raises(RuntimeError):
+        small_pools["threads"].submit(divmod, 7, 1)
+
+
+def test_run_limits_its_share_of_the_pool(scheduler: PoolScheduler):
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def task():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    # a larger pool is leased already
+    with scheduler.run(30):
+        scheduler.threads, scheduler.processes = 2, 0
+        with scheduler.run(30) as (_, threads):
+            futures = [threads.submit(task) for _ in range(10)]
+            for future in futures:
+                future.result()
+
+    assert peak[0] == 2
+
+
+def test_aggregation_time_is_measured(scheduler: PoolScheduler):
+    with scheduler.run(2) as (executor, _):
+        assert executor.submit(sum, range(100_000)).result() == 4999950000
+
+    assert scheduler.aggregate_seconds > 0
+
+
+def test_inline_and_processes_give_the_same_results(tmp_path: Path):
+    cities = [f"city{i}" for i in range(4)]
+    outputs = []
+    with serve(days=3) as server, registered_cities(server.base_url, cities):
+        for processes in (0, 2):
+            scheduler = PoolScheduler(processes=processes)
+            path = tmp_path / f"out{processes}.json"
+            with open(path, "w") as fout:
+                main_task(cities, fout, scheduler=scheduler)
+            scheduler.close()
+            outputs.append(json.loads(path.read_text()))
+
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0]) == len(cities)
@@ -0,0 +1,78 @@
+import copy
+import json
+from pathlib import Path
+
+import pytest
+
+from src import tasks
+from src.store import ResultStore, day_fingerprint
+
+
+RESPONSE_PATH = Path(__file__).parent.parent / "examples" / "response.json"
+BODY = RESPONSE_PATH.read_bytes()
+FORECASTS = json.loads(BODY)["forecasts"]
+
+
+@pytest.fixture
+def store(tmp_path: Path):
+    store = ResultStore(tmp_path / "stats.db")
+    yield store
+    store.close()
+
+
+def test_only_changed_days_are_recomputed():
+    _, result, fingerprints, _ = tasks.aggregate_incremental_task("a", FORECASTS)
+    # the known stats are marked to tell them from the recomputed ones
+    known = {
+        fp: {**day, "known": True} for fp, day in zip(fingerprints, result["days"])
+    }
+    changed = copy.deepcopy(FORECASTS)
+    changed[1]["hours"][12]["temp"] += 10
+    known.pop(day_fingerprint(FORECASTS[1]))
+
+    _, partial, _, _ = tasks.aggregate_incremental_task("a", changed, known=known)
+
+    reused = [day.pop("known", False) for day in partial["days"]]
+    assert reused == [True, False] + [True] * (len(reused) - 2)
+    assert partial == tasks.aggregate_forecasts_task("a", changed)[1]
+
+
+def test_store_round_trip(store: ResultStore):
+    _, result, fingerprints, body_fp = tasks.aggregate_incremental_task("a", BODY)
+    store.save("a", result["days"], fingerprints, body_fp)
+
+    assert store.load("a") == result
+    assert store.body_fingerprint("a") == body_fp
+    assert set(store.known_days("a")) == set(fingerprints)
+    assert store.load("b") is None
+
+
+@pytest.mark.parametrize("raw", [False, True])
+def test_main_task_reuses_the_store(
+    monkeypatch, tmp_path: Path, store: ResultStore, raw: bool
+):
+    submitted = []
+
+    def fetch_forecasts_task(
+        city_name, timeout, cache=None, raw=False, streaming=False
+    ):
+        return (city_name, BODY if raw else json.loads(BODY)["forecasts"])
+
+    def count_batches(self):
+        submitted.extend(city for city, *_ in self._chunk)
+        return flush(self)
+
+    flush = tasks._ChunkSubmitter.flush
+    monkeypatch.setattr(tasks, "fetch_forecasts_task", fetch_forecasts_task)
+    monkeypatch.setattr(tasks._ChunkSubmitter, "flush", count_batches)
+
+    outputs = []
+    for _ in range(2):
+        out = tmp_path / "out.json"
+        with open(out, "w") as fout:
+            tasks.main_task(("moscow", "paris"), fout, raw=raw, store=store)
+        outputs.append(json.loads(out.read_text()))
+
+    assert outputs[0] == outputs[1]
+    assert sorted(outputs[0]) == ["moscow", "paris"]
+    assert len(submitted) == (2 if raw else 4)
@@ -0,0 +1,74 @@
+import json
+import threading
+from pathlib import Path
+
+import pytest
+
+from src import tasks
+from src.types_ import FORECAST
+
+
+def _day(date_: str, temp: float, cond: str) -> FORECAST:
+    hours = [{"hour": str(h), "temp": temp, "condition": cond} for h in range(24)]
+    return {"date": date_, "hours": hours}
+
+
+FORECASTS = {
+    "moscow": [_day("2022-05-18", 10, "clear")],
+    "paris": [_day("2022-05-18", 20, "cloudy")],
+    "cairo": [_day("2022-05-18", 20, "cloudy")],
+    "london": [_day("2022-05-18", 30, "rain")],
+    "nowhere": None,
+}
+
+
+@pytest.fixture
+def fake_fetch(monkeypatch):
+    def fetch_forecasts_task(
+        city_name, timeout, cache=None, raw=False, streaming=False
+    ):
+        return (city_name, FORECASTS[city_name])
+
+    monkeypatch.setattr(tasks, "fetch_forecasts_task", fetch_forecasts_task)
+
+
+@pytest.mark.parametrize("queue_size", [1, 2, 64])
+def test_stream_task(fake_fetch, tmp_path: Path, queue_size: int):
+    out = tmp_path / "out.ndjson"
+    with open(out, "w") as fout:
+        best = tasks.stream_task(
+            list(FORECASTS), fout, concurrency=2, queue_size=queue_size
+        )
+
+    assert sorted(best) == ["cairo", "paris"]
+    records = [json.loads(line) for line in out.read_text().splitlines()]
+    assert sorted(rec["city"] for rec in records) == [
+        "cairo",
+        "london",
+        "moscow",
+        "paris",
+    ]
+    by_city = {rec.pop("city"): rec for rec in records}
+    assert by_city["moscow"]["days"][0]["temp_avg"] == 10.0
+    assert by_city["london"]["days"][0]["relevant_cond_hours"] == 0
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_failed_submit_stops_the_stream(
+    fake_fetch, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    def broken_pool(*args):
+        raise RuntimeError("cannot schedule new futures after shutdown")
+
+    monkeypatch.setattr(tasks, "_submit_observed", broken_pool)
+    with open(tmp_path / "out.ndjson", "w") as fout:
+        run = threading.Thread(
+            target=tasks.stream_task,
+            args=(list(FORECASTS) * 20, fout),
+            kwargs={"concurrency": 2, "queue_size": 1},
+            daemon=True,
+        )
+        run.start()
+        run.join(10)
+
+    assert not run.is_alive()
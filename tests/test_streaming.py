@@ -0,0 +1,148 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from benchmarks.server import RESPONSE_PATH, registered_cities, serve
+from src import tasks
+from src.cache import ResponseCache
+from src.core import (
+    aggregate_forecast_stats,
+    fetch_forecasts,
+    fetch_forecasts_streaming,
+    fetch_forecasts_streaming_async,
+    make_async_client,
+    parse_forecasts,
+)
+from src.streaming import ForecastStreamParser, parse_forecasts_streaming
+
+
+BODY = RESPONSE_PATH.read_bytes()
+FORECASTS = json.loads(BODY)["forecasts"]
+TRIMMED = [
+    {
+        "date": day["date"],
+        "hours": [
+            {key: hour[key] for key in ("hour", "temp", "condition")}
+            for hour in day["hours"]
+        ],
+    }
+    for day in FORECASTS
+]
+
+
+def _chunks(body: bytes, size: int) -> list[bytes]:
+    return [body[i : i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096, len(BODY)])
+def test_chunked_parsing(size: int):
+    assert parse_forecasts_streaming(_chunks(BODY, size)) == TRIMMED
+
+
+def test_days_are_yielded_as_they_arrive():
+    parser = ForecastStreamParser()
+    days = []
+    for chunk in _chunks(BODY, 1024):
+        days.append(len(parser.feed(chunk)))
+
+    assert sum(days) == len(FORECASTS)
+    assert days.count(0) < len(days) - 1  # the days do not all come at the end
+    assert parser.done
+    assert parser.close() == TRIMMED
+
+
+def _small_response() -> bytes:
+    # every section of the fixture, with the hours of its first day
+    response = json.loads(BODY)
+    day = response["forecasts"][0]
+    response["forecasts"] = [{**day, "hours": day["hours"][8:12]}]
+    return json.dumps(response).encode()
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        _small_response(),
+        b'{"a": -1.5e+3, "b": [true, false, null], "forecasts": [{"date": 2E-1}]}',
+    ],
+    ids=["response", "literals"],
+)
+def test_split_at_every_offset(body: bytes):
+    expected = []
+    for day in json.loads(body)["forecasts"]:
+        day = {key: day[key] for key in ("date", "hours") if key in day}
+        if "hours" in day:
+            day["hours"] = [
+                {key: hour[key] for key in ("hour", "temp", "condition")}
+                for hour in day["hours"]
+            ]
+        expected.append(day)
+
+    for offset in range(len(body) + 1):
+        assert parse_forecasts_streaming([body[:offset], body[offset:]]) == expected
+
+
+@pytest.mark.parametrize(
+    "body",
+    [b"null", b"{}", b"[]", b'{"forecasts": []}', b'{"a": [1, 2], "forecasts": 0}'],
+)
+def test_the_same_results_as_parse_forecasts(body: bytes):
+    assert parse_forecasts_streaming(_chunks(body, 1)) == parse_forecasts(body)
+
+
+@pytest.mark.parametrize(
+    ("body", "error"),
+    [(b'{"fact": {}}', KeyError), (b'{"forecasts": [{"date": 1', ValueError)],
+)
+def test_the_same_errors_as_parse_forecasts(body: bytes, error: type[Exception]):
+    with pytest.raises(error):
+        parse_forecasts(body)
+    with pytest.raises(error):
+        parse_forecasts_streaming(_chunks(body, 3))
+
+
+def test_streaming_fetch_gives_the_same_stats(tmp_path: Path):
+    cache = ResponseCache(tmp_path, ttl=0)
+    with serve(payload_size=100_000) as server, registered_cities(
+        server.base_url, ["example", "city1"]
+    ):
+        assert fetch_forecasts_streaming("example") == TRIMMED
+        forecasts = fetch_forecasts("city1")
+        for _ in range(2):  # downloaded, then revalidated
+            streamed = fetch_forecasts_streaming("city1", cache=cache)
+            assert aggregate_forecast_stats(streamed) == aggregate_forecast_stats(
+                forecasts
+            )
+    assert cache.revalidated == 1
+
+
+def test_streaming_fetch_async():
+    async def fetch():
+        async with make_async_client() as client:
+            return await fetch_forecasts_streaming_async("example", client)
+
+    with serve() as server, registered_cities(server.base_url, ["example"]):
+        assert asyncio.run(fetch()) == TRIMMED
+
+
+@pytest.mark.parametrize("mode", ["threads", "async"])
+def test_main_task_streaming(tmp_path: Path, mode: str):
+    outputs = []
+    with serve() as server, registered_cities(
+        server.base_url, ["example", "city1", "city2"]
+    ):
+        for streaming in (False, True):
+            out = tmp_path / f"{streaming}.json"
+            with open(out, "w") as fout:
+                tasks.main_task(
+                    ("example", "city1", "city2"),
+                    fout,
+                    mode=mode,
+                    streaming=streaming,
+                )
+            outputs.append(json.loads(out.read_text()))
+
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0]) == 3
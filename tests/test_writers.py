@@ -0,0 +1,110 @@
+import csv
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from src import tasks, writers
+from src.exceptions import TaskError
+from src.writers import read_columnar, write_results
+
+
+OUTPUT_PATH = Path(__file__).parent.parent / "examples" / "output.json"
+RESPONSE_PATH = OUTPUT_PATH.parent / "response.json"
+RESULT = json.loads(OUTPUT_PATH.read_text())
+RESULTS = {
+    "moscow": RESULT,
+    "paris": {"days": RESULT["days"][:2]},
+    "nowhere": {"days": None},
+}
+
+
+def _write(output_format: str, results=RESULTS, ratings=None) -> str:
+    out = io.StringIO()
+    write_results(results, out, output_format, ratings)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("results", [RESULTS, {}])
+def test_json_is_the_same_as_dumps(results):
+    assert _write("json", results) == json.dumps(results, indent=2)
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_compact_json(monkeypatch, fast: bool):
+    if not fast:
+        monkeypatch.setattr(writers, "orjson", None)
+
+    assert json.loads(_write("compact")) == RESULTS
+    assert _write("compact", {}) == "{}"
+
+
+@pytest.mark.parametrize(("output_format", "delimiter"), [("csv", ","), ("tsv", "\t")])
+def test_table_layout(output_format: str, delimiter: str):
+    text = _write(output_format, ratings={"moscow": 1, "paris": 2, "nowhere": 3})
+    rows = list(csv.reader(io.StringIO(text), delimiter=delimiter))
+    dates = [day["date"] for day in RESULT["days"]]
+
+    assert rows[0] == ["City/day", "", *dates, "Average", "Rating"]
+    assert len(rows) == 1 + 2 * len(RESULTS)
+    moscow_temps, moscow_hours = rows[1], rows[2]
+    assert moscow_temps[:3] == ["moscow", writers.TEMPERATURE_ROW, "13.091"]
+    assert moscow_temps[-1] == "1"
+    assert moscow_hours[:3] == ["", writers.DRY_HOURS_ROW, "11"]
+    # paris has the first two days only
+    assert rows[3][4:-2] == [""] * (len(dates) - 2)
+    assert rows[5][1:] == [writers.TEMPERATURE_ROW, *[""] * len(dates), "", "3"]
+
+
+@pytest.mark.parametrize("rating", [7, 100_000])
+def test_columnar_round_trip(tmp_path: Path, rating: int):
+    path = tmp_path / "out.bin"
+    with open(path, "w") as fout:
+        writer = writers.ColumnarWriter(fout, group_size=4)
+        writer.open([])
+        for city, result in RESULTS.items():
+            writer.write(city, result, rating)
+        writer.close()
+    with open(path, "rb") as fin:
+        columns = read_columnar(fin)
+
+    days = [(city, day) for city, r in RESULTS.items() for day in r["days"] or ()]
+    assert columns["city"] == [city for city, _ in days]
+    for name in ("date", "hours_start", "temp_avg", "relevant_cond_hours"):
+        assert columns[name] == [day[name] for _, day in days]
+    assert set(columns["rating"]) == {rating}
+
+
+def test_columnar_needs_a_binary_file():
+    with pytest.raises(TaskError):
+        writers.ColumnarWriter(io.StringIO())
+
+
+@pytest.mark.parametrize("output_format", ["compact", "csv", "columnar"])
+def test_main_task_formats(monkeypatch, tmp_path: Path, output_format: str):
+    def fetch_forecasts_task(
+        city_name, timeout, cache=None, raw=False, streaming=False
+    ):
+        return (city_name, json.loads(RESPONSE_PATH.read_bytes())["forecasts"])
+
+    monkeypatch.setattr(tasks, "fetch_forecasts_task", fetch_forecasts_task)
+    out = tmp_path / "out"
+    with open(out, "w") as fout:
+        tasks.main_task(("moscow", "paris"), fout, output_format=output_format)
+
+    if output_format == "columnar":
+        with open(out, "rb") as fin:
+            assert set(read_columnar(fin)["city"]) == {"moscow", "paris"}
+    elif output_format == "csv":
+        assert len(out.read_text().splitlines()) == 5
+    else:
+        assert sorted(json.loads(out.read_text())) == ["moscow", "paris"]
+
+
+def test_incomplete_writer_fails_early():
+    class NoWrite(writers.ResultWriter):
+        pass
+
+    with pytest.raises(TypeError):
+        NoWrite(io.StringIO())